@@ -9,6 +9,12 @@ class AccountsConfig(AppConfig):
     
     def ready(self):
         """Run migrations automatically on startup (for Render free tier)"""
+        from django.db.backends.signals import connection_created
+        from .schema import probe_schema
+        
+        # Optional columns are checked once, on the first database connection
+        connection_created.connect(probe_schema, dispatch_uid='accounts_probe_schema')
+        
         # Only run in production (Render), not during tests or management commands
         if os.environ.get('RENDER') or os.environ.get('DATABASE_URL'):
             # Skip if running migrations, tests, or other management commands
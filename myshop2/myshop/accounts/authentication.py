@@ -0,0 +1,108 @@
+"""
+JWT Authentication
+simplejwt's JWTAuthentication with the user read from a short-lived cache snapshot instead of
+a database query on every API call, and the token_version claim checked so that
+invalidate_all_tokens() logs every device out. Each request also marks its UserSession as
+used (coalesced, see session_utils.record_session_activity).
+
+A snapshot holds only what authentication needs (AUTH_FIELDS plus the md5 password hash
+simplejwt compares revoke claims with, never the password hash itself); the other columns are
+loaded together on first access (see Customer.refresh_from_db).
+
+Snapshots are dropped when the Customer is saved or deleted (see accounts.models), but that
+delete only reaches other workers through a shared cache (Redis). With a per-process cache
+(LocMemCache, i.e. no REDIS_URL) other workers keep a snapshot for up to
+JWT_USER_CACHE_LOCAL_TTL seconds, so "logout all devices" and deactivation take that long to
+reach them. Updates that bypass save() are picked up when the snapshot expires.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .session_utils import get_client_ip, record_session_activity, validate_token_version
+
+AUTH_FIELDS = ('id', 'email', 'is_active', 'is_staff', 'is_superuser', 'token_version')
+REVOKE_HASH = '_revoke_hash'
+
+
+def user_cache_key(user_id):
+    return f"jwt_user:{user_id}"
+
+
+def invalidate_cached_user(user_id):
+    cache.delete(user_cache_key(user_id))
+
+
+def snapshot_ttl():
+    """Seconds a snapshot lives; short when the cache is private to this process"""
+    ttl = getattr(settings, 'JWT_USER_CACHE_TTL', 60)
+    if isinstance(caches['default'], LocMemCache):
+        ttl = min(ttl, getattr(settings, 'JWT_USER_CACHE_LOCAL_TTL', 5))
+    return ttl
+
+
+def get_cached_user(user_id):
+    """
+    The user with this USER_ID_FIELD value. Returns (user, md5 of its password hash); a user
+    built from the cache only has AUTH_FIELDS loaded.
+    """
+    User = get_user_model()
+    key = user_cache_key(user_id)
+    values = cache.get(key)
+    if values is not None:
+        values = dict(values)
+        revoke_hash = values.pop(REVOKE_HASH)
+        return User.from_db(router.db_for_read(User), list(values), list(values.values())), revoke_hash
+
+    user = User.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+    revoke_hash = get_md5_hash_password(user.password)
+    # In model field order, as from_db() expects for a partial row
+    values = {
+        field.attname: user.__dict__[field.attname]
+        for field in User._meta.concrete_fields
+        if field.attname in AUTH_FIELDS and field.attname in user.__dict__
+    }
+    values[REVOKE_HASH] = revoke_hash
+    cache.set(key, values, snapshot_ttl())
+    return user, revoke_hash
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None:
+            # Sessions are keyed by the access token's jti (see create_or_update_session)
+            record_session_activity(str(result[1].get('jti', '')), get_client_ip(request))
+        return result
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        try:
+            user, revoke_hash = get_cached_user(user_id)
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if not validate_token_version(user, validated_token):
+            raise AuthenticationFailed(
+                _("Token has been invalidated. Please login again."), code="token_invalidated"
+            )
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != revoke_hash:
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
@@ -0,0 +1,231 @@
+"""
+Login Failure Counters
+Sliding-window counts of failed logins per email and per IP, kept in the cache so the login
+path never has to COUNT rows of LoginAttempt.
+
+Each identity has three rings of buckets at different resolutions:
+    10 second buckets over 2 minutes   (per-minute limit, fast attack detection)
+    5 minute buckets over 1 hour       (hourly limits)
+    1 hour buckets over 1 day          (security tier)
+A window is the sum of the buckets it fully covers plus the part of the oldest bucket still
+inside it (the usual sliding-window counter approximation). All windows of an email and an IP
+are answered from one get_many.
+
+LoginAttempt stays the audit log. It is written by a background thread in batches, and is
+only read to rebuild the counters of an identity the cache does not know (cold cache).
+
+Counters in a per-process cache (LocMemCache) would give every server worker its own limits,
+so unless LOGIN_FAILURE_COUNTS is 'cache' (set when Redis is configured) the counts are read
+from LoginAttempt instead, which is then written synchronously.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.db.models import Count, Q
+from django.utils import timezone
+
+logger = logging.getLogger('security')
+
+# (bucket seconds, number of buckets)
+RESOLUTIONS = (
+    (10, 12),
+    (300, 12),
+    (3600, 24),
+)
+MAX_WINDOW = max(size * count for size, count in RESOLUTIONS)
+WARM_MARKER = 'warm'
+
+LOG_BATCH_SIZE = 500
+
+
+def counts_in_cache():
+    """True when failure counts live in the (shared) cache rather than in LoginAttempt"""
+    return getattr(settings, 'LOGIN_FAILURE_COUNTS', 'database') == 'cache'
+
+
+class FailureCounter:
+    """Failed login buckets of one identity (scope 'email' or 'ip')"""
+
+    def __init__(self, scope, identity):
+        self.scope = scope
+        self.identity = identity
+        self.prefix = f"login_fail:{scope}:{identity}"
+
+    def _key(self, size, index):
+        return f"{self.prefix}:{size}:{index}"
+
+    @property
+    def warm_key(self):
+        return f"{self.prefix}:{WARM_MARKER}"
+
+    def keys(self, now):
+        """Every bucket key a count may need (one extra per ring for the partial oldest bucket)"""
+        keys = [self.warm_key]
+        for size, count in RESOLUTIONS:
+            current = int(now // size)
+            keys.extend(self._key(size, index) for index in range(current - count, current + 1))
+        return keys
+
+    def record(self, now=None):
+        now = time.time() if now is None else now
+        for size, count in RESOLUTIONS:
+            key = self._key(size, int(now // size))
+            cache.add(key, 0, timeout=size * (count + 1))
+            try:
+                cache.incr(key)
+            except ValueError:
+                # Evicted between add() and incr()
+                cache.set(key, 1, timeout=size * (count + 1))
+
+    def count(self, values, window, now):
+        """Failures in the last `window` seconds, from bucket `values` fetched with keys()"""
+        size, count = next(
+            ((size, count) for size, count in RESOLUTIONS if size * count >= window),
+            RESOLUTIONS[-1],
+        )
+        window = min(window, size * count)
+        current = int(now // size)
+        full = int(window // size)
+
+        # The current (partial) bucket plus the full buckets behind it
+        total = sum(values.get(self._key(size, index), 0) for index in range(current - full + 1, current + 1))
+        # Share of the oldest bucket that still lies inside the window
+        covered = min(size, (current - full + 1) * size - (now - window))
+        if covered > 0:
+            total += values.get(self._key(size, current - full), 0) * covered / size
+        return int(round(total))
+
+    def seed(self, timestamps, now):
+        """Rebuild the buckets from audit log timestamps (epoch seconds) after a cache miss"""
+        for size, count in RESOLUTIONS:
+            buckets = {}
+            oldest = int(now // size) - count
+            for stamp in timestamps:
+                index = int(stamp // size)
+                if index >= oldest:
+                    key = self._key(size, index)
+                    buckets[key] = buckets.get(key, 0) + 1
+            if buckets:
+                cache.set_many(buckets, timeout=size * (count + 1))
+        cache.set(self.warm_key, 1, timeout=MAX_WINDOW)
+
+
+def _audit_timestamps(counter, now):
+    """Failed attempt times of an identity over the longest window, from LoginAttempt"""
+    from .models import LoginAttempt
+
+    since = timezone.now() - timedelta(seconds=MAX_WINDOW)
+    field = 'email' if counter.scope == 'email' else 'ip_address'
+    rows = LoginAttempt.objects.filter(**{field: counter.identity, 'success': False, 'created_at__gte': since})
+    return [created.timestamp() for created in rows.values_list('created_at', flat=True)]
+
+
+def _database_counts(counter, windows, now):
+    """{window: count} of an identity's failed attempts, in one LoginAttempt query"""
+    from .models import LoginAttempt
+
+    field = 'email' if counter.scope == 'email' else 'ip_address'
+    until = datetime.fromtimestamp(now, tz=dt_timezone.utc)
+    rows = LoginAttempt.objects.filter(**{
+        field: counter.identity,
+        'success': False,
+        'created_at__gte': until - timedelta(seconds=max(windows)),
+    })
+    counts = rows.aggregate(**{
+        f"last_{window}": Count('pk', filter=Q(created_at__gte=until - timedelta(seconds=window)))
+        for window in windows
+    })
+    return {window: counts[f"last_{window}"] for window in windows}
+
+
+def load_counts(counters, windows, now=None):
+    """
+    {(scope, window): count} for every counter and window, in one cache round trip
+    (plus one audit log query per counter the cache has never seen).
+    Without a shared cache, one LoginAttempt query per counter.
+    """
+    now = time.time() if now is None else now
+    if not counts_in_cache():
+        counts = {}
+        for counter in counters:
+            for window, count in _database_counts(counter, windows, now).items():
+                counts[(counter.scope, window)] = count
+        return counts
+
+    keys = [key for counter in counters for key in counter.keys(now)]
+    values = cache.get_many(keys)
+
+    for counter in counters:
+        if counter.warm_key not in values:
+            try:
+                counter.seed(_audit_timestamps(counter, now), now)
+            except Exception as e:
+                logger.error(f"Could not rebuild login counters for {counter.prefix}: {str(e)}")
+                continue
+            values.update(cache.get_many(counter.keys(now)))
+
+    return {
+        (counter.scope, window): counter.count(values, window, now)
+        for counter in counters
+        for window in windows
+    }
+
+
+# ============================================================================
+# ASYNC AUDIT LOG
+# ============================================================================
+
+_log_queue = None
+_log_pid = None
+_log_lock = threading.Lock()
+
+
+def _log_writer(log_queue):
+    from .models import LoginAttempt
+
+    while True:
+        batch = [log_queue.get()]
+        while len(batch) < LOG_BATCH_SIZE:
+            try:
+                batch.append(log_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            close_old_connections()
+            LoginAttempt.objects.bulk_create([LoginAttempt(**fields) for fields in batch])
+        except Exception as e:
+            logger.error(f"Failed to record {len(batch)} login attempts to database: {str(e)}")
+
+
+def _get_log_queue():
+    global _log_queue, _log_pid
+    with _log_lock:
+        # Threads do not survive a fork, so each server worker process starts its own writer
+        if _log_queue is None or _log_pid != os.getpid():
+            _log_queue = queue.Queue()
+            _log_pid = os.getpid()
+            threading.Thread(target=_log_writer, args=(_log_queue,), daemon=True).start()
+        return _log_queue
+
+
+def log_attempt(**fields):
+    """
+    Append a LoginAttempt row, in the background unless LOGIN_ATTEMPT_LOG_ASYNC is off or the
+    failure counts are read from LoginAttempt (the next check must see this row).
+    """
+    from .models import LoginAttempt
+
+    if getattr(settings, 'LOGIN_ATTEMPT_LOG_ASYNC', True) and counts_in_cache():
+        _get_log_queue().put(fields)
+        return
+    try:
+        LoginAttempt.objects.create(**fields)
+    except Exception as e:
+        logger.error(f"Failed to record login attempt to database: {str(e)}")
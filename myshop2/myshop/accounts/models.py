@@ -5,55 +5,19 @@ from django.utils import timezone
 import uuid
 import secrets
 from datetime import timedelta
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.conf import settings
 
 class CustomerManager(BaseUserManager):
-    _token_version_column_exists = None
-    
     def get_queryset(self):
         """Override to exclude token_version if column doesn't exist"""
-        from django.db import connection
-        from django.db import OperationalError
+        from .schema import has_token_version_column
         
-        # Cache the check result (check once per process)
-        if CustomerManager._token_version_column_exists is None:
-            try:
-                with connection.cursor() as cursor:
-                    if connection.vendor == 'sqlite':
-                        cursor.execute("PRAGMA table_info(accounts_customer)")
-                        columns = [row[1] for row in cursor.fetchall()]
-                        CustomerManager._token_version_column_exists = 'token_version' in columns
-                    elif connection.vendor == 'postgresql':
-                        cursor.execute("""
-                            SELECT column_name 
-                            FROM information_schema.columns 
-                            WHERE table_name='accounts_customer' 
-                            AND column_name='token_version'
-                        """)
-                        CustomerManager._token_version_column_exists = cursor.fetchone() is not None
-                    else:
-                        # For other databases, assume it exists (will fail gracefully if not)
-                        CustomerManager._token_version_column_exists = True
-            except Exception as e:
-                # If check fails, assume column doesn't exist to be safe
-                import logging
-                logger = logging.getLogger('accounts.models')
-                logger.warning(f"Could not check token_version column: {e}")
-                CustomerManager._token_version_column_exists = False
-        
-        # Get base queryset
         queryset = super().get_queryset()
-        
-        # If column doesn't exist, defer it to prevent SELECT errors
-        if not CustomerManager._token_version_column_exists:
-            try:
-                queryset = queryset.defer('token_version')
-            except Exception:
-                # If defer fails, return queryset as-is (will handle error in __getattribute__)
-                pass
-        
+        # If column doesn't exist, defer it to prevent SELECT errors (see Customer.refresh_from_db)
+        if not has_token_version_column():
+            queryset = queryset.defer('token_version')
         return queryset
     
     def create_user(self, email, password=None, **extra_fields):
@@ -105,7 +69,7 @@ class Customer(AbstractUser):
     # SESSION MANAGEMENT - Multi-device tracking and instant token invalidation
     # ========================================================================
     # Note: This field may not exist in database until migrations run
-    # Code handles missing column gracefully via Manager.get_queryset() and __getattribute__
+    # Code handles missing column gracefully via Manager.get_queryset() and refresh_from_db()
     token_version = models.IntegerField(
         default=0,
         null=True,  # Allow NULL during migration period
@@ -159,18 +123,26 @@ class Customer(AbstractUser):
     def __str__(self):
         return self.email
     
-    def __getattribute__(self, name):
-        """Override to handle token_version gracefully when column doesn't exist"""
-        if name == 'token_version':
-            try:
-                # Try to get the value normally
-                return super().__getattribute__(name)
-            except (AttributeError, Exception):
-                # If column doesn't exist or value is None, return 0 (default)
-                # Set it as an attribute to avoid repeated lookups
-                object.__setattr__(self, name, 0)
-                return 0
-        return super().__getattribute__(name)
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        """
+        Load deferred fields together, and read a deferred token_version as 0 while its
+        column doesn't exist.
+        """
+        from .schema import has_token_version_column
+        
+        # JWT-authenticated users only carry the auth fields (accounts.authentication); the
+        # first access to another column loads all of them in one query, not one per attribute
+        if fields and from_queryset is None:
+            deferred = self.get_deferred_fields()
+            if set(fields) <= deferred:
+                fields = list(deferred)
+        
+        if fields and 'token_version' in fields and not has_token_version_column():
+            self.token_version = 0
+            fields = [field for field in fields if field != 'token_version']
+            if not fields:
+                return
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
     
     # ========================================================================
     # SESSION MANAGEMENT METHODS
@@ -184,7 +156,7 @@ class Customer(AbstractUser):
         from django.db import OperationalError
         
         try:
-            self.token_version += 1
+            self.token_version = (self.token_version or 0) + 1
             self.save(update_fields=['token_version'])
         except OperationalError:
             # token_version column doesn't exist yet (migrations pending)
@@ -259,20 +231,8 @@ class Customer(AbstractUser):
                 counter += 1
         
         # Check if token_version column exists before trying to save
-        from django.db import connection
-        has_token_version_column = True
-        try:
-            with connection.cursor() as cursor:
-                cursor.execute("""
-                    SELECT column_name 
-                    FROM information_schema.columns 
-                    WHERE table_name='accounts_customer' 
-                    AND column_name='token_version'
-                """)
-                has_token_version_column = cursor.fetchone() is not None
-        except Exception:
-            # If we can't check, assume it exists and try normal save
-            pass
+        from .schema import has_token_version_column as column_exists
+        has_token_version_column = column_exists()
         
         # Only set token_version if column exists
         if has_token_version_column:
@@ -427,6 +387,14 @@ def create_customer_profile(sender, instance, created, **kwargs):
         # You can add additional logic here if needed
         pass  # Customer is already the user model, so nothing to do
 
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def invalidate_cached_jwt_user(sender, instance, **kwargs):
+    # Profile saves, token invalidation and deletes must not be served from the JWT user cache
+    from .authentication import invalidate_cached_user
+    invalidate_cached_user(instance.pk)
+
 class Address(models.Model):
     customer = models.ForeignKey('Customer', on_delete=models.CASCADE, related_name='addresses')
     label = models.CharField(max_length=50, blank=True, help_text='e.g. Home, Work, etc.')
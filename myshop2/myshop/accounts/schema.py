@@ -0,0 +1,40 @@
+"""
+Schema Capabilities
+Columns whose migration may not have run yet on a deployment (Render applies pending migrations
+in a background thread after boot). Each is probed once, when the process opens its first
+database connection, so models and managers only read a flag instead of checking on every
+query or attribute access.
+"""
+import logging
+
+logger = logging.getLogger('accounts.models')
+
+_capabilities = {}
+
+
+def probe_schema(sender=None, connection=None, **kwargs):
+    """connection_created receiver: introspect the optional columns once per process"""
+    if 'token_version' in _capabilities or connection is None:
+        return
+    try:
+        with connection.cursor() as cursor:
+            tables = connection.introspection.table_names(cursor)
+            if 'accounts_customer' not in tables:
+                # Fresh database: migrate creates the table with the column
+                columns = None
+            else:
+                columns = [
+                    column.name
+                    for column in connection.introspection.get_table_description(cursor, 'accounts_customer')
+                ]
+    except Exception as e:
+        logger.warning(f"Could not check token_version column: {e}")
+        return
+    _capabilities['token_version'] = columns is None or 'token_version' in columns
+    if not _capabilities['token_version']:
+        logger.warning("token_version column is missing; token invalidation is disabled until migrations run")
+
+
+def has_token_version_column():
+    """Whether accounts_customer has token_version (assumed until the probe says otherwise)"""
+    return _capabilities.get('token_version', True)
@@ -2,6 +2,7 @@
 Production-Grade Login Security Service
 Implements 5-tier progressive security with speed-based attack detection.
 """
+import math
 import time
 import logging
 from datetime import timedelta
@@ -10,6 +11,8 @@ from django.core.cache import cache
 from django.conf import settings
 from django.contrib.auth import get_user_model
 
+from .login_counters import FailureCounter, counts_in_cache, load_counts, log_attempt
+
 logger = logging.getLogger('security')
 
 # Import models - these will be available after Django initialization
@@ -119,18 +122,22 @@ class LoginSecurityService:
     # ========================================================================
     
     def record_attempt(self, success=False, failure_reason='', security_tier=1):
-        """Record a login attempt in database"""
+        """Count a failed attempt in the cache counters and queue the audit log row"""
         _ensure_models_loaded()
         
+        if not success and counts_in_cache():
+            try:
+                for counter in self._counters():
+                    counter.record()
+            except Exception as e:
+                logger.error(f"Failed to update login failure counters: {str(e)}")
+        
         if LoginAttempt is None:
             # Models not available - just log
             logger.warning("LoginAttempt model not available, skipping database record")
-            return
-        
-        response_time_ms = int((time.time() - self.start_time) * 1000)
-        
-        try:
-            LoginAttempt.objects.create(
+        else:
+            response_time_ms = int((time.time() - self.start_time) * 1000)
+            log_attempt(
                 email=self.email,
                 ip_address=self.ip_address,
                 user_agent=self.user_agent,
@@ -139,9 +146,6 @@ class LoginSecurityService:
                 security_tier=security_tier,
                 response_time_ms=response_time_ms,
             )
-        except Exception as e:
-            # If database write fails, log but don't fail the request
-            logger.error(f"Failed to record login attempt to database: {str(e)}")
         
         if not success:
             logger.warning(
@@ -149,27 +153,70 @@ class LoginSecurityService:
                 f"(Tier {security_tier}, Reason: {failure_reason})"
             )
     
+    def _counters(self):
+        return (FailureCounter('email', self.email), FailureCounter('ip', self.ip_address))
+    
+    def get_failure_counts(self, windows):
+        """{(scope, window): failed attempts} for 'email' and 'ip' (see login_counters.load_counts)"""
+        return load_counts(self._counters(), windows)
+    
     def get_failed_attempts_count(self, time_window_seconds):
         """Get count of failed attempts within time window"""
-        _ensure_models_loaded()
-        since = timezone.now() - timedelta(seconds=time_window_seconds)
-        
-        return LoginAttempt.objects.filter(
-            email=self.email,
-            success=False,
-            created_at__gte=since
-        ).count()
+        return load_counts(self._counters()[:1], [time_window_seconds])[('email', time_window_seconds)]
     
     def get_failed_attempts_from_ip(self, time_window_seconds):
         """Get count of failed attempts from this IP within time window"""
+        return load_counts(self._counters()[1:], [time_window_seconds])[('ip', time_window_seconds)]
+    
+    # ========================================================================
+    # PROGRESSIVE DELAY (non-blocking)
+    # ========================================================================
+    
+    def _delay_keys(self):
+        return (f"login_not_before:email:{self.email}", f"login_not_before:ip:{self.ip_address}")
+    
+    def get_retry_after(self):
+        """
+        Seconds until this email/IP may try to log in again (0 = now).
+        Both "not before" timestamps are read in one cache round trip; without a shared cache
+        they follow from the tier of the latest failures in LoginAttempt.
+        """
+        if counts_in_cache():
+            not_before = cache.get_many(self._delay_keys()).values()
+        else:
+            not_before = self._not_before_from_attempts()
+        remaining = max((value - time.time() for value in not_before), default=0)
+        return math.ceil(remaining) if remaining > 0 else 0
+    
+    def _not_before_from_attempts(self):
+        """Failure time plus the delay of its tier, for failures whose delay may not be over"""
         _ensure_models_loaded()
-        since = timezone.now() - timedelta(seconds=time_window_seconds)
+        from django.db.models import Q
         
-        return LoginAttempt.objects.filter(
-            ip_address=self.ip_address,
+        delays = {
+            2: SecurityConfig.TIER_2_DELAY,
+            3: SecurityConfig.TIER_3_DELAY,
+            4: SecurityConfig.TIER_4_DELAY,
+        }
+        since = timezone.now() - timedelta(seconds=max(delays.values()))
+        recent = LoginAttempt.objects.filter(
+            Q(email=self.email) | Q(ip_address=self.ip_address),
             success=False,
-            created_at__gte=since
-        ).count()
+            security_tier__in=delays,
+            created_at__gte=since,
+        ).values_list('created_at', 'security_tier')
+        return [created.timestamp() + delays[tier] for created, tier in recent]
+    
+    def apply_delay(self, delay_seconds):
+        """
+        Enforce a tier delay on the next attempt from this email and IP instead of sleeping:
+        earlier retries are rejected with 429 and Retry-After, so no worker is held meanwhile.
+        Without a shared cache the delay is read back from the attempt's recorded tier.
+        """
+        if not counts_in_cache():
+            return
+        not_before = time.time() + delay_seconds
+        cache.set_many({key: not_before for key in self._delay_keys()}, timeout=math.ceil(delay_seconds))
     
     # ========================================================================
     # ACCOUNT LOCK MANAGEMENT
@@ -275,14 +322,16 @@ class LoginSecurityService:
         Check IP-based rate limiting.
         Returns: (is_limited, message)
         """
+        counts = load_counts(self._counters()[1:], (SecurityConfig.MINUTE_WINDOW, SecurityConfig.HOUR_WINDOW))
+        
         # Per-minute check
-        per_minute = self.get_failed_attempts_from_ip(SecurityConfig.MINUTE_WINDOW)
+        per_minute = counts[('ip', SecurityConfig.MINUTE_WINDOW)]
         if per_minute >= SecurityConfig.MAX_PER_MINUTE:
             logger.warning(f"IP rate limit: {self.ip_address} ({per_minute}/min)")
             return True, "Too many requests. Please try again in 1 minute."
         
         # Per-hour check
-        per_hour = self.get_failed_attempts_from_ip(SecurityConfig.HOUR_WINDOW)
+        per_hour = counts[('ip', SecurityConfig.HOUR_WINDOW)]
         if per_hour >= SecurityConfig.MAX_PER_HOUR:
             logger.warning(f"IP hourly limit: {self.ip_address} ({per_hour}/hour)")
             return True, "Too many failed attempts. Your IP has been temporarily blocked."
@@ -298,14 +347,14 @@ class LoginSecurityService:
         Determine which security tier should be applied based on failed attempts.
         Returns: (tier, failed_count, delay_seconds)
         """
+        counts = load_counts(self._counters()[:1], (SecurityConfig.FAST_ATTACK_WINDOW, SecurityConfig.DAY_WINDOW))
+        # Count failed attempts in last 24 hours
+        failed_count = counts[('email', SecurityConfig.DAY_WINDOW)]
+        
         # Check for fast attack first
-        is_fast_attack, _ = self.detect_fast_attack()
-        if is_fast_attack:
+        if counts[('email', SecurityConfig.FAST_ATTACK_WINDOW)] >= SecurityConfig.FAST_ATTACK_THRESHOLD:
             # Skip directly to Tier 5 (lock)
-            return 5, self.get_failed_attempts_count(SecurityConfig.DAY_WINDOW), 0
-        
-        # Count failed attempts in last 24 hours
-        failed_count = self.get_failed_attempts_count(SecurityConfig.DAY_WINDOW)
+            return 5, failed_count, 0
         
         # Determine tier and delay
         if failed_count <= SecurityConfig.TIER_1_MAX:
@@ -326,7 +375,7 @@ class LoginSecurityService:
     def check_security(self):
         """
         Main security check before allowing login attempt.
-        OPTIMIZED: Single database query instead of 5 separate queries.
+        Failure counts come from the cache counters when the cache is shared, else LoginAttempt.
         
         Returns: {
             'allowed': bool,
@@ -361,38 +410,28 @@ class LoginSecurityService:
             })
             return result
         
-        # 2. OPTIMIZED: Fetch ALL failed attempts at once (ONE query instead of 4)
+        # 2. All failure counts in one cache round trip (or one LoginAttempt query per identity)
+        windows = (
+            SecurityConfig.MINUTE_WINDOW,
+            SecurityConfig.FAST_ATTACK_WINDOW,
+            SecurityConfig.HOUR_WINDOW,
+            SecurityConfig.DAY_WINDOW,
+        )
         try:
-            _ensure_models_loaded()
-            
-            if LoginAttempt is None:
-                # Models not available - assume no failed attempts
-                failed_attempts = []
-            else:
-                since_day = timezone.now() - timedelta(seconds=SecurityConfig.DAY_WINDOW)
-                
-                # Get all failed attempts for this email in last 24 hours
-                failed_attempts = list(LoginAttempt.objects.filter(
-                    email=self.email,
-                    success=False,
-                    created_at__gte=since_day
-                ).values_list('created_at', 'ip_address'))
+            counts = self.get_failure_counts(windows)
         except Exception as e:
-            # If database query fails, assume no failed attempts (allow login)
-            logger.error(f"Failed to fetch login attempts: {str(e)}")
-            failed_attempts = []
+            # If the cache is unavailable, assume no failed attempts (allow login)
+            logger.error(f"Failed to read login failure counters: {str(e)}")
+            counts = {}
         
-        # Process in memory (fast!) instead of 4 separate database queries
-        now = timezone.now()
-        failed_count_day = len(failed_attempts)
-        failed_count_hour = sum(1 for dt, _ in failed_attempts if (now - dt).total_seconds() <= SecurityConfig.HOUR_WINDOW)
-        failed_count_minute = sum(1 for dt, _ in failed_attempts if (now - dt).total_seconds() <= SecurityConfig.MINUTE_WINDOW)
-        failed_from_ip_hour = sum(1 for dt, ip in failed_attempts if ip == self.ip_address and (now - dt).total_seconds() <= SecurityConfig.HOUR_WINDOW)
+        failed_count_day = counts.get(('email', SecurityConfig.DAY_WINDOW), 0)
+        failed_count_minute = counts.get(('email', SecurityConfig.MINUTE_WINDOW), 0)
+        failed_from_ip_hour = counts.get(('ip', SecurityConfig.HOUR_WINDOW), 0)
         
         # Fast attack detection (2 min window)
-        failed_fast = sum(1 for dt, _ in failed_attempts if (now - dt).total_seconds() <= 120)
+        failed_fast = counts.get(('email', SecurityConfig.FAST_ATTACK_WINDOW), 0)
         
-        # 3. Check IP rate limiting (using in-memory data)
+        # 3. Check rate limiting
         if failed_count_minute >= SecurityConfig.MAX_PER_MINUTE:
             result.update({
                 'allowed': False,
@@ -407,7 +446,7 @@ class LoginSecurityService:
             })
             return result
         
-        # 3. Determine security tier (using in-memory data - no extra queries!)
+        # 3. Determine security tier
         # Check for fast attack
         if failed_fast >= SecurityConfig.FAST_ATTACK_THRESHOLD:
             tier, delay = 5, 0
@@ -477,9 +516,10 @@ class LoginSecurityService:
         security = self.check_security()
         tier = security['tier']
         
-        # Apply progressive delay (simulate processing time)
+        # Apply progressive delay to the next attempt (never sleep in the worker)
         if security['delay'] > 0:
-            time.sleep(security['delay'])
+            self.apply_delay(security['delay'])
+            security['retry_after'] = security['delay']
         
         # Record the attempt
         self.record_attempt(
@@ -1,7 +1,7 @@
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
-from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from rest_framework.exceptions import AuthenticationFailed, Throttled, ValidationError
 from .models import Customer, Address
 from .security_service import LoginSecurityService
 from .email_service import SecurityEmailService
@@ -46,6 +46,14 @@ class EmailTokenObtainPairSerializer(TokenObtainPairSerializer):
                 # ====================================================================
                 # STEP 1: Pre-authentication security checks
                 # ====================================================================
+                # Progressive delay: retries before the "not before" time get 429 + Retry-After
+                retry_after = security.get_retry_after()
+                if retry_after:
+                    raise Throttled(
+                        wait=retry_after,
+                        detail=f'Too many login attempts. Please try again in {retry_after} second(s).'
+                    )
+                
                 security_check = security.check_security()
                 
                 if not security_check['allowed']:
@@ -61,8 +69,8 @@ class EmailTokenObtainPairSerializer(TokenObtainPairSerializer):
                         logger.warning(f"Failed to record login attempt: {str(record_error)}")
                     
                     raise AuthenticationFailed(security_check['message'])
-            except AuthenticationFailed:
-                # Re-raise authentication failures (they're intentional)
+            except (AuthenticationFailed, Throttled):
+                # Re-raise authentication failures and delays (they're intentional)
                 raise
             except Exception as e:
                 # Security features failed, log and continue without them
@@ -142,12 +150,12 @@ class EmailTokenObtainPairSerializer(TokenObtainPairSerializer):
             # ================================================================
             try:
                 from .session_utils import create_or_update_session
-                from rest_framework_simplejwt.tokens import RefreshToken
+                from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
                 from django.db import OperationalError
                 
-                # Get the tokens
+                # Get the tokens (the issued access token: sessions are keyed by its jti)
                 refresh = RefreshToken(data['refresh'])
-                access = refresh.access_token
+                access = AccessToken(data['access'])
                 
                 # Create/update session
                 session = create_or_update_session(
@@ -267,6 +275,19 @@ class CustomTokenRefreshSerializer(TokenRefreshSerializer):
         # Continue with normal validation
         data = super().validate(attrs)
         data['user_id'] = refresh.payload.get('user_id')
+        
+        # Keep the device's session keyed by the tokens it now uses
+        try:
+            from .session_utils import rotate_session_tokens
+            from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+            
+            rotate_session_tokens(
+                str(refresh.payload.get('jti', '')),
+                AccessToken(data['access']).payload,
+                RefreshToken(data['refresh']).payload if 'refresh' in data else None,
+            )
+        except Exception as e:
+            logger.warning(f"Failed to update session on token refresh: {str(e)}")
         return data
 
 class UserSerializer(serializers.ModelSerializer):
@@ -3,9 +3,15 @@ Session Management Utilities
 Device fingerprinting, session tracking, and helper functions
 """
 
+from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
-from datetime import timedelta
+from datetime import timedelta, timezone as dt_timezone
+import logging
 import re
+import threading
+
+logger = logging.getLogger('security')
 
 # Optional import - if user_agents is not installed, use fallback
 try:
@@ -151,7 +157,7 @@ def create_or_update_session(user, request, access_token, refresh_token):
     # Calculate expiration (from refresh token)
     refresh_exp = refresh_token.get('exp')
     if refresh_exp:
-        expires_at = timezone.datetime.fromtimestamp(refresh_exp, tz=timezone.utc)
+        expires_at = timezone.datetime.fromtimestamp(refresh_exp, tz=dt_timezone.utc)
     else:
         # Default: 30 days
         expires_at = timezone.now() + timedelta(days=30)
@@ -178,7 +184,10 @@ def create_or_update_session(user, request, access_token, refresh_token):
         existing_session.expires_at = expires_at
         existing_session.location_city = location['city']
         existing_session.location_country = location['country']
-        existing_session.save()
+        existing_session.save(update_fields=[
+            'session_key', 'refresh_token_jti', 'ip_address', 'user_agent',
+            'last_activity', 'expires_at', 'location_city', 'location_country',
+        ])
         return existing_session
     else:
         # Create new session
@@ -221,6 +230,118 @@ def validate_token_version(user, token):
     return token_version == user_token_version
 
 
+# ============================================================================
+# SESSION ACTIVITY - coalesced last_activity / ip_address updates
+# ============================================================================
+
+_activity_lock = threading.Lock()
+_pending_activity = {}  # session_key -> (last_activity, ip_address) not written yet
+_cached_at = {}  # session_key -> when its cache copy was last written
+_last_flush = None
+
+
+def activity_cache_key(session_key):
+    return f"session_activity:{session_key}"
+
+
+def record_session_activity(session_key, ip_address, now=None):
+    """
+    Note that a session was used. Nothing is written per request: the activity is kept in
+    memory, copied to the cache at most once per SESSION_ACTIVITY_CACHE_INTERVAL per session
+    (so session lists are fresh in every worker), and written to UserSession with one
+    bulk_update at most once per SESSION_ACTIVITY_FLUSH_INTERVAL.
+    """
+    global _last_flush
+    if not session_key:
+        return
+    now = now or timezone.now()
+    cache_interval = getattr(settings, 'SESSION_ACTIVITY_CACHE_INTERVAL', 60)
+    flush_interval = getattr(settings, 'SESSION_ACTIVITY_FLUSH_INTERVAL', 300)
+    
+    with _activity_lock:
+        _pending_activity[session_key] = (now, ip_address)
+        cached_at = _cached_at.get(session_key)
+        write_cache = cached_at is None or (now - cached_at).total_seconds() >= cache_interval
+        if write_cache:
+            _cached_at[session_key] = now
+        if _last_flush is None:
+            _last_flush = now
+        flush_due = (now - _last_flush).total_seconds() >= flush_interval
+    
+    if write_cache:
+        cache.set(activity_cache_key(session_key), (now, ip_address), flush_interval * 2)
+    if flush_due:
+        flush_session_activity(now)
+
+
+def flush_session_activity(now=None):
+    """Write the pending activity of this process to UserSession; returns the rows updated"""
+    global _last_flush
+    from .models import UserSession
+    
+    with _activity_lock:
+        pending = dict(_pending_activity)
+        _pending_activity.clear()
+        _cached_at.clear()
+        _last_flush = now or timezone.now()
+    
+    keys = list(pending)
+    updated = 0
+    try:
+        for start in range(0, len(keys), 500):
+            sessions = list(
+                UserSession.objects.filter(session_key__in=keys[start:start + 500], is_active=True)
+                .only('pk', 'session_key', 'last_activity', 'ip_address')
+            )
+            for session in sessions:
+                session.last_activity, session.ip_address = pending[session.session_key]
+            # bulk_update writes the values as set (last_activity's auto_now only applies on save())
+            UserSession.objects.bulk_update(sessions, ['last_activity', 'ip_address'])
+            updated += len(sessions)
+    except Exception as e:
+        logger.error(f"Failed to write activity of {len(keys)} sessions: {str(e)}")
+    return updated
+
+
+def rotate_session_tokens(old_refresh_jti, access_token, refresh_token=None):
+    """
+    Re-key a session after a token refresh, so activity of the new access token still lands on it.
+    The session is found by the refresh token that was used; returns it (or None).
+    """
+    from .models import UserSession
+    
+    session = UserSession.objects.filter(refresh_token_jti=old_refresh_jti, is_active=True).first()
+    if session is None:
+        return None
+    old_session_key = session.session_key
+    session.session_key = str(access_token.get('jti', ''))
+    if refresh_token is not None:
+        session.refresh_token_jti = str(refresh_token.get('jti', ''))
+    session.save(update_fields=['session_key', 'refresh_token_jti', 'last_activity'])
+    
+    # Activity of the old access token that has not been flushed yet belongs to the same session
+    with _activity_lock:
+        pending = _pending_activity.pop(old_session_key, None)
+        if pending is not None:
+            _pending_activity[session.session_key] = pending
+    return session
+
+
+def with_cached_activity(sessions):
+    """
+    The sessions with activity that is newer in the cache than in the database applied
+    (one get_many), most recently used first.
+    """
+    sessions = list(sessions)
+    cached = cache.get_many([activity_cache_key(session.session_key) for session in sessions])
+    for session in sessions:
+        activity = cached.get(activity_cache_key(session.session_key))
+        if activity and activity[0] > session.last_activity:
+            session.last_activity, session.ip_address = activity
+    sessions.sort(key=lambda session: session.last_activity, reverse=True)
+    return sessions
+
+
 def cleanup_expired_sessions():
     """
     Clean up expired sessions.
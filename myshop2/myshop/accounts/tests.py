@@ -1,3 +1,272 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 # Create your tests here.
+
+
+@override_settings(LOGIN_ATTEMPT_LOG_ASYNC=False)
+class LoginDelayTest(TestCase):
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+        from django.core.cache import cache
+
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email='shopper@example.com', password='correct-horse')
+
+    def _login(self, password):
+        return self.client.post(
+            '/accounts/token/',
+            data={'email': 'shopper@example.com', 'password': password},
+            content_type='application/json',
+        )
+
+    def _old_failures(self, count):
+        from datetime import timedelta
+        from django.utils import timezone
+        from accounts.models import LoginAttempt
+
+        for _ in range(count):
+            LoginAttempt.objects.create(email='shopper@example.com', ip_address='127.0.0.1', success=False)
+        # Outside the per-minute window, inside the day window
+        LoginAttempt.objects.update(created_at=timezone.now() - timedelta(minutes=10))
+
+    def test_tier_delay_rejects_early_retries_without_sleeping(self):
+        import time
+        from accounts.security_service import SecurityConfig
+
+        self._old_failures(SecurityConfig.TIER_1_MAX + 1)
+
+        started = time.monotonic()
+        self.assertEqual(self._login('wrong').status_code, 401)
+        response = self._login('correct-horse')
+        self.assertLess(time.monotonic() - started, 1)
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], str(SecurityConfig.TIER_2_DELAY))
+
+    def test_tier_one_failures_are_not_delayed(self):
+        self.assertEqual(self._login('wrong').status_code, 401)
+        self.assertEqual(self._login('correct-horse').status_code, 200)
+
+    def test_delay_holds_in_every_worker_without_a_shared_cache(self):
+        from django.core.cache import cache
+        from accounts.security_service import SecurityConfig
+
+        self._old_failures(SecurityConfig.TIER_1_MAX + 1)
+        self.assertEqual(self._login('wrong').status_code, 401)
+
+        # Another worker's LocMemCache knows nothing about this failure
+        cache.clear()
+        response = self._login('correct-horse')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], str(SecurityConfig.TIER_2_DELAY))
+
+    @override_settings(LOGIN_FAILURE_COUNTS='cache')
+    def test_tier_delay_with_cache_counters(self):
+        from accounts.security_service import SecurityConfig
+
+        self._old_failures(SecurityConfig.TIER_1_MAX + 1)
+        self.assertEqual(self._login('wrong').status_code, 401)
+        response = self._login('correct-horse')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], str(SecurityConfig.TIER_2_DELAY))
+
+
+@override_settings(LOGIN_ATTEMPT_LOG_ASYNC=False, LOGIN_FAILURE_COUNTS='cache')
+class LoginCounterTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+
+    def test_windows_slide_over_buckets(self):
+        from accounts.login_counters import FailureCounter, load_counts
+
+        counter = FailureCounter('email', 'shopper@example.com')
+        now = 1_000_000.0
+        load_counts([counter], [60], now=now)  # Warm the (empty) counter
+        for offset in (3 * 60 * 60, 30 * 60, 90, 5):
+            counter.record(now=now - offset)
+
+        counts = load_counts([counter], [60, 120, 60 * 60, 24 * 60 * 60], now=now)
+        self.assertEqual(counts[('email', 60)], 1)
+        self.assertEqual(counts[('email', 120)], 2)
+        self.assertEqual(counts[('email', 60 * 60)], 3)
+        self.assertEqual(counts[('email', 24 * 60 * 60)], 4)
+
+    def test_cold_cache_is_rebuilt_from_audit_log(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from accounts.login_counters import FailureCounter, load_counts
+        from accounts.models import LoginAttempt
+
+        for _ in range(3):
+            LoginAttempt.objects.create(email='shopper@example.com', ip_address='10.0.0.1', success=False)
+        LoginAttempt.objects.create(email='other@example.com', ip_address='10.0.0.1', success=False)
+        LoginAttempt.objects.update(created_at=timezone.now() - timedelta(minutes=10))
+
+        counters = [FailureCounter('email', 'shopper@example.com'), FailureCounter('ip', '10.0.0.1')]
+        counts = load_counts(counters, [60, 60 * 60])
+        self.assertEqual(counts[('email', 60)], 0)
+        self.assertEqual(counts[('email', 60 * 60)], 3)
+        self.assertEqual(counts[('ip', 60 * 60)], 4)
+
+        # Warm counters are answered from the cache alone
+        with self.assertNumQueries(0):
+            load_counts(counters, [60, 60 * 60])
+
+    @override_settings(LOGIN_FAILURE_COUNTS='database')
+    def test_counts_come_from_the_audit_log_without_a_shared_cache(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from accounts.login_counters import FailureCounter, load_counts
+        from accounts.models import LoginAttempt
+
+        for minutes in (0, 0, 10, 10 * 60):
+            attempt = LoginAttempt.objects.create(email='shopper@example.com', ip_address='10.0.0.1', success=False)
+            LoginAttempt.objects.filter(pk=attempt.pk).update(created_at=timezone.now() - timedelta(minutes=minutes))
+        LoginAttempt.objects.create(email='shopper@example.com', ip_address='10.0.0.1', success=True)
+
+        counters = [FailureCounter('email', 'shopper@example.com'), FailureCounter('ip', '10.0.0.1')]
+        with self.assertNumQueries(2):
+            counts = load_counts(counters, [60, 60 * 60, 24 * 60 * 60])
+        self.assertEqual(counts[('email', 60)], 2)
+        self.assertEqual(counts[('email', 60 * 60)], 3)
+        self.assertEqual(counts[('ip', 24 * 60 * 60)], 4)
+
+
+class CachedJWTAuthenticationTest(TestCase):
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+        from django.core.cache import cache
+        from accounts.serializers import EmailTokenObtainPairSerializer
+
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email='shopper@example.com', password='correct-horse')
+        self.access = str(EmailTokenObtainPairSerializer.get_token(self.user).access_token)
+
+    def _authenticate(self):
+        from django.test import RequestFactory
+        from accounts.authentication import CachedJWTAuthentication
+
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {self.access}')
+        return CachedJWTAuthentication().authenticate(request)[0]
+
+    def test_user_is_served_from_cache(self):
+        from django.core.cache import cache
+        from accounts.authentication import user_cache_key
+
+        self.assertEqual(self._authenticate(), self.user)
+        with self.assertNumQueries(0):
+            user = self._authenticate()
+            self.assertEqual(user.email, 'shopper@example.com')
+            self.assertEqual(user.token_version, 0)
+        self.assertNotIn('password', cache.get(user_cache_key(self.user.pk)))
+
+        # Everything else is loaded in one query on first use
+        with self.assertNumQueries(1):
+            self.assertEqual(user.get_full_name().strip(), '')
+            self.assertTrue(user.check_password('correct-horse'))
+
+    def test_local_cache_keeps_snapshots_briefly(self):
+        from django.test import override_settings
+        from accounts.authentication import snapshot_ttl
+
+        with override_settings(JWT_USER_CACHE_TTL=60, JWT_USER_CACHE_LOCAL_TTL=5):
+            self.assertEqual(snapshot_ttl(), 5)
+
+    def test_profile_save_drops_cached_user(self):
+        self._authenticate()
+        self.user.first_name = 'Ada'
+        self.user.save()
+        self.assertEqual(self._authenticate().first_name, 'Ada')
+
+    def test_invalidated_tokens_are_rejected(self):
+        from rest_framework.exceptions import AuthenticationFailed
+
+        self._authenticate()
+        self.user.invalidate_all_tokens()
+        with self.assertRaises(AuthenticationFailed):
+            self._authenticate()
+
+
+class SessionActivityTest(TestCase):
+    def setUp(self):
+        from datetime import timedelta
+        from django.contrib.auth import get_user_model
+        from django.core.cache import cache
+        from django.utils import timezone
+        from accounts.models import UserSession
+        from accounts.session_utils import flush_session_activity
+
+        cache.clear()
+        flush_session_activity()
+        self.user = get_user_model().objects.create_user(email='shopper@example.com', password='correct-horse')
+        self.session = UserSession.objects.create(
+            user=self.user, session_key='access-jti', ip_address='10.0.0.1',
+            expires_at=timezone.now() + timedelta(days=30),
+        )
+        self.logged_in = self.session.last_activity
+
+    def test_activity_is_coalesced_into_one_bulk_update(self):
+        from datetime import timedelta
+        from accounts.session_utils import flush_session_activity, record_session_activity, with_cached_activity
+
+        later = self.logged_in + timedelta(seconds=30)
+        with self.assertNumQueries(0):
+            for second in range(100):
+                record_session_activity('access-jti', '10.0.0.2', now=later + timedelta(seconds=second / 10))
+
+        # Not in the database yet, but the session list already shows it
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.last_activity, self.logged_in)
+        self.assertEqual(with_cached_activity([self.session])[0].ip_address, '10.0.0.2')
+
+        with self.assertNumQueries(2):
+            self.assertEqual(flush_session_activity(), 1)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.ip_address, '10.0.0.2')
+        self.assertEqual(self.session.last_activity, later + timedelta(seconds=9.9))
+
+    @override_settings(LOGIN_ATTEMPT_LOG_ASYNC=False)
+    def test_login_creates_session(self):
+        from accounts.models import UserSession
+
+        response = self.client.post(
+            '/accounts/token/',
+            data={'email': 'shopper@example.com', 'password': 'correct-horse'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(UserSession.objects.filter(user=self.user).count(), 2)
+
+        auth = {'HTTP_AUTHORIZATION': f"Bearer {response.json()['access']}", 'REMOTE_ADDR': '10.0.0.3'}
+        current = self.client.get('/accounts/sessions/current/', **auth).json()
+        self.assertIsNotNone(current['session']['last_activity'])
+        sessions = self.client.get('/accounts/sessions/', **auth).json()['sessions']
+        self.assertEqual(sessions[0]['ip_address'], '10.0.0.3')
+
+    @override_settings(LOGIN_ATTEMPT_LOG_ASYNC=False)
+    def test_activity_follows_session_through_token_refresh(self):
+        from accounts.models import UserSession
+        from accounts.session_utils import flush_session_activity
+
+        tokens = self.client.post(
+            '/accounts/token/',
+            data={'email': 'shopper@example.com', 'password': 'correct-horse'},
+            content_type='application/json',
+        ).json()
+        session = UserSession.objects.exclude(pk=self.session.pk).get(user=self.user)
+
+        refreshed = self.client.post(
+            '/accounts/token/refresh/', data={'refresh': tokens['refresh']}, content_type='application/json',
+        ).json()
+        auth = {'HTTP_AUTHORIZATION': f"Bearer {refreshed['access']}", 'REMOTE_ADDR': '10.0.0.4'}
+        current = self.client.get('/accounts/sessions/current/', **auth).json()
+        self.assertIsNotNone(current['session']['last_activity'])
+
+        self.assertEqual(flush_session_activity(), 1)
+        session.refresh_from_db()
+        self.assertEqual(session.ip_address, '10.0.0.4')
+        if 'refresh' in refreshed:
+            from rest_framework_simplejwt.tokens import RefreshToken
+            self.assertEqual(session.refresh_token_jti, RefreshToken(refreshed['refresh'])['jti'])
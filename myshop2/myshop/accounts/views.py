@@ -34,7 +34,7 @@ from shop.models import Product
 from .utils import is_rate_limited, get_client_ip
 from rest_framework_simplejwt.exceptions import TokenError, InvalidToken
 from rest_framework import status
-from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from rest_framework.exceptions import AuthenticationFailed, Throttled, ValidationError
 from django.views.decorators.csrf import csrf_exempt
 import json
 from django.http import JsonResponse, HttpResponse
@@ -135,6 +135,13 @@ class EmailTokenObtainPairView(TokenObtainPairView):
             serializer.is_valid(raise_exception=True)
             return Response(serializer.validated_data, status=status.HTTP_200_OK)
             
+        except Throttled as e:
+            # Progressive delay still running: tell the client when to retry
+            return Response(
+                {'detail': e.detail, 'error': True, 'retry_after': e.wait},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={'Retry-After': str(int(e.wait))},
+            )
         except (AuthenticationFailed, ValidationError) as e:
             # Authentication/validation errors - return 401
             error_detail = e.detail if hasattr(e, 'detail') else str(e)
@@ -1411,6 +1418,7 @@ class CheckSecurityStatusView(APIView):
             'requires_captcha': security_check.get('requires_captcha', False),
             'requires_verification': security_check.get('requires_verification', False),
             'message': security_check.get('message', ''),
+            'retry_after': security.get_retry_after(),
         }
         
         if lock_obj:
@@ -1651,7 +1659,7 @@ class UserSessionsListView(APIView):
         
         try:
             from .models import UserSession
-            from .session_utils import get_client_ip
+            from .session_utils import get_client_ip, with_cached_activity
         except ImportError:
             return Response({
                 'error': 'Session management not available',
@@ -1662,8 +1670,8 @@ class UserSessionsListView(APIView):
         current_ip = get_client_ip(request)
         
         try:
-            # Get all active sessions
-            sessions = user.get_active_sessions()
+            # Get all active sessions (with activity not written to the database yet)
+            sessions = with_cached_activity(user.get_active_sessions())
         except OperationalError as e:
             # Table doesn't exist yet (migrations not run)
             logger.error(f"UserSession table not found: {str(e)}")
@@ -1832,12 +1840,26 @@ class CurrentSessionView(APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
-        from .session_utils import parse_device_info, get_client_ip
+        from django.db import OperationalError
+        from .models import UserSession
+        from .session_utils import parse_device_info, get_client_ip, with_cached_activity
         
         user = request.user
         device_info = parse_device_info(request)
         ip_address = get_client_ip(request)
         
+        # Session of the access token used for this request (sessions are keyed by its jti)
+        last_activity = None
+        session_key = request.auth.get('jti') if request.auth is not None and hasattr(request.auth, 'get') else None
+        if session_key:
+            try:
+                sessions = with_cached_activity(UserSession.objects.filter(user=user, session_key=session_key))
+            except OperationalError:
+                # UserSession table doesn't exist yet (migrations pending)
+                sessions = []
+            if sessions:
+                last_activity = sessions[0].last_activity.isoformat()
+        
         return Response({
             'user': {
                 'id': user.id,
@@ -1850,6 +1872,7 @@ class CurrentSessionView(APIView):
                 'os_version': device_info['os_version'],
                 'app_version': device_info['app_version'],
                 'ip_address': ip_address,
+                'last_activity': last_activity,
             },
             'active_sessions_count': user.get_session_count(),
         }, status=status.HTTP_200_OK)
@@ -0,0 +1,150 @@
+"""
+Batch image operations
+Applies operations to many EditedImages at once. Each image's operations are appended to its
+log and the full-resolution result is rendered in the shared image process pool. The original
+is read through its storage and sent to the worker as bytes; the rendered bytes come back and
+are saved through the storage, so batches work on remote storage too. The row only switches to
+the new render once it is saved, and the previous render is removed after the switch commits.
+"""
+import logging
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+
+from shop import process_pool
+
+from .operations import append_operation, apply_operations, encode_image, operations_version, output_format, resolve_operation
+
+logger = logging.getLogger(__name__)
+
+EDITED_DIR = 'edited_images/edited'
+
+
+def get_max_items():
+    return getattr(settings, 'IMAGE_EDITOR_BATCH_MAX_ITEMS', 100)
+
+
+def render_item(data, name, base_operations, new_operations):
+    """
+    Worker: render the original's bytes with its existing and new operations.
+    Returns the encoded result and the new operations in stored form.
+    """
+    from shop.utils import safe_open_image
+
+    img = safe_open_image(BytesIO(data))
+    img.load()
+    img = apply_operations(img, base_operations)
+
+    resolved = []
+    for operation in new_operations:
+        operation = resolve_operation(img.size, operation)
+        img = apply_operations(img, [operation])
+        resolved.append(operation)
+
+    return {
+        'content': encode_image(img, output_format(name)),
+        'operations': resolved,
+        'width': img.width,
+        'height': img.height,
+    }
+
+
+def start_batch(items):
+    """
+    Create an EditBatch for [(image_id, [operations])] and dispatch every item once the
+    transaction commits. Operations must already be validated.
+    """
+    from .models import EditBatch
+
+    batch = EditBatch.objects.create(total=len(items))
+    if not items:
+        EditBatch.objects.filter(pk=batch.pk).update(status='done', finished_at=timezone.now())
+        return batch
+
+    def dispatch():
+        for image_id, operations in items:
+            dispatch_item(batch.pk, image_id, operations)
+
+    transaction.on_commit(dispatch)
+    return batch
+
+
+def dispatch_item(batch_id, image_id, operations):
+    from .models import EditedImage
+
+    image = EditedImage.objects.filter(pk=image_id).first()
+    if image is None or not image.original_image:
+        _record(batch_id, image_id, error='Image not found')
+        return
+
+    base_operations = list(image.operations)
+    extension = os.path.splitext(image.original_image.name)[1].lower() or '.jpg'
+    target_name = f"{EDITED_DIR}/batch_{batch_id}_{image_id}{extension}"
+
+    try:
+        with image.original_image.open('rb') as f:
+            job = (render_item, f.read(), image.original_image.name, base_operations, operations)
+    except Exception as e:
+        _record(batch_id, image_id, error=e)
+        return
+
+    process_pool.run_job(
+        job,
+        lambda result: _store_result(batch_id, image_id, base_operations, target_name, result),
+        lambda error: _record(batch_id, image_id, error=error),
+    )
+
+
+def _store_result(batch_id, image_id, base_operations, target_name, result):
+    from .models import EditedImage
+
+    storage = EditedImage._meta.get_field('edited_image').storage
+    target_name = storage.save(target_name, ContentFile(result['content']))
+
+    with transaction.atomic():
+        image = EditedImage.objects.select_for_update().filter(pk=image_id).first()
+        if image is None or image.operations != base_operations:
+            # Edited (or deleted) while the batch was rendering: keep the newer state
+            storage.delete(target_name)
+            _record(batch_id, image_id, error='Image was changed while the batch was running')
+            return
+
+        operations = base_operations
+        for operation in result['operations']:
+            operations = append_operation(operations, operation)
+
+        previous = image.edited_image.name if image.edited_image else None
+        image.operations = operations
+        image.edited_image.name = target_name
+        image.rendered_version = operations_version(operations)
+        image.save(update_fields=['operations', 'edited_image', 'rendered_version'])
+
+        if previous and previous != target_name:
+            transaction.on_commit(lambda: storage.delete(previous))
+        _record(batch_id, image_id, url=storage.url(target_name), width=result['width'], height=result['height'])
+
+
+def _record(batch_id, image_id, error=None, **payload):
+    from .models import EditBatch
+
+    if error is not None:
+        logger.warning('Batch %s: image %s failed: %s', batch_id, image_id, error)
+        entry = {'status': 'failed', 'error': str(error)[:255]}
+    else:
+        entry = dict({'status': 'done'}, **payload)
+
+    with transaction.atomic():
+        batch = EditBatch.objects.select_for_update().get(pk=batch_id)
+        batch.results[str(image_id)] = entry
+        if error is not None:
+            batch.failed += 1
+        else:
+            batch.succeeded += 1
+        if batch.succeeded + batch.failed >= batch.total:
+            batch.status = 'done'
+            batch.finished_at = timezone.now()
+        batch.save(update_fields=['results', 'succeeded', 'failed', 'status', 'finished_at'])
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from image_editor.models import InteractiveImage
+from image_editor.tiles import STATUS_READY, build_tiles, source_version
+
+
+class Command(BaseCommand):
+    help = 'Generate deep-zoom tile pyramids for interactive images that do not have an up-to-date one'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--id', type=int, help='Only this interactive image')
+        parser.add_argument('--force', action='store_true', help='Regenerate pyramids that are already ready')
+        parser.add_argument('--dry-run', action='store_true', help='List the images that would be tiled')
+
+    def handle(self, *args, **options):
+        queryset = InteractiveImage.objects.exclude(image='').order_by('pk')
+        if options.get('id'):
+            queryset = queryset.filter(pk=options['id'])
+
+        todo = [
+            image for image in queryset
+            if options['force'] or image.tiles_status != STATUS_READY or image.tiles_version != source_version(image)
+        ]
+        if options['dry_run']:
+            for image in todo:
+                self.stdout.write(f"Would tile {image} ({image.image.name})")
+            self.stdout.write(self.style.WARNING(f"DRY RUN: {len(todo)} images would be tiled"))
+            return
+
+        built = 0
+        for image in todo:
+            if build_tiles(image.pk):
+                built += 1
+            else:
+                self.stderr.write(self.style.WARNING(f"Could not tile {image}"))
+        self.stdout.write(self.style.SUCCESS(f"Generated tile pyramids for {built} of {len(todo)} images"))
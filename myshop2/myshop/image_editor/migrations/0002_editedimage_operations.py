@@ -0,0 +1,46 @@
+from django.db import migrations, models
+
+
+def rebase_legacy_edits(apps, schema_editor):
+    """Edits made before the operation log were baked into edited_image; start from there"""
+    EditedImage = apps.get_model('image_editor', 'EditedImage')
+    for image in EditedImage.objects.exclude(edited_image='').exclude(edited_image__isnull=True):
+        image.original_image = image.edited_image.name
+        image.edited_image = None
+        image.save(update_fields=['original_image', 'edited_image'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_editor', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='editedimage',
+            name='operations',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='editedimage',
+            name='proxy_image',
+            field=models.ImageField(blank=True, null=True, upload_to='edited_images/proxies/'),
+        ),
+        migrations.AddField(
+            model_name='editedimage',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, help_text='Original width after EXIF orientation', null=True),
+        ),
+        migrations.AddField(
+            model_name='editedimage',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, help_text='Original height after EXIF orientation', null=True),
+        ),
+        migrations.AddField(
+            model_name='editedimage',
+            name='rendered_version',
+            field=models.CharField(blank=True, help_text='Operations baked into edited_image', max_length=40),
+        ),
+        migrations.RunPython(rebase_legacy_edits, migrations.RunPython.noop),
+    ]
@@ -1,18 +1,149 @@
 from django.db import models
+import io
 import os
 from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
 from django.utils import timezone
 
+PREVIEW_CACHE_TIMEOUT = 60 * 60
+
 # Create your models here.
 
 class EditedImage(models.Model):
-    """Model to store uploaded and edited images."""
+    """
+    Model to store uploaded and edited images.
+
+    Edits are an ordered operation list applied to original_image (see image_editor.operations).
+    proxy_image is a downscaled copy used for previews; edited_image is only the full-resolution
+    render of the operations, refreshed on download or update_image.
+    """
     original_image = models.ImageField(upload_to='edited_images/originals/')
     edited_image = models.ImageField(upload_to='edited_images/edited/', blank=True, null=True)
     upload_date = models.DateTimeField(default=timezone.now)
+    operations = models.JSONField(default=list, blank=True)
+    proxy_image = models.ImageField(upload_to='edited_images/proxies/', blank=True, null=True)
+    width = models.PositiveIntegerField(null=True, blank=True, help_text="Original width after EXIF orientation")
+    height = models.PositiveIntegerField(null=True, blank=True, help_text="Original height after EXIF orientation")
+    rendered_version = models.CharField(max_length=40, blank=True, help_text="Operations baked into edited_image")
     
     def __str__(self):
         return f"Image {self.id} - {os.path.basename(self.original_image.name)}"
+
+    @property
+    def operations_version(self):
+        from .operations import operations_version
+        return operations_version(self.operations)
+
+    @property
+    def is_rendered(self):
+        """True when edited_image matches the current operations"""
+        return bool(self.edited_image) and self.rendered_version == self.operations_version
+
+    def full_size(self):
+        """Size of the original as displayed (EXIF orientation applied)"""
+        if not self.width or not self.height:
+            self.build_proxy()
+        return self.width, self.height
+
+    def proxy_size(self):
+        if not self.proxy_image:
+            self.build_proxy()
+        return self.proxy_image.width, self.proxy_image.height
+
+    def preview_size(self):
+        """Size of the preview the editor shows, i.e. the proxy after all operations"""
+        from .operations import output_size
+        proxy_width, proxy_height = self.proxy_size()
+        return output_size((proxy_width, proxy_height), self.operations, proxy_width / self.full_size()[0])
+
+    def build_proxy(self):
+        """Decode the original once (reduced-scale for JPEGs) and store a small WebP proxy"""
+        from PIL import Image, ImageOps
+        from shop.utils import safe_open_image
+        from .operations import PROXY_MAX_SIZE
+
+        with self.original_image.open('rb') as f:
+            header = Image.open(f)
+            width, height = header.size
+            if header.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+                width, height = height, width
+            f.seek(0)
+            img = safe_open_image(f, target_size=(PROXY_MAX_SIZE, PROXY_MAX_SIZE))
+            img.load()
+
+        img.thumbnail((PROXY_MAX_SIZE, PROXY_MAX_SIZE), Image.Resampling.LANCZOS)
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+
+        output = io.BytesIO()
+        img.save(output, format='WEBP', quality=85)
+        if self.proxy_image:
+            self.proxy_image.delete(save=False)
+        self.proxy_image.save(f"proxy_{self.pk}.webp", ContentFile(output.getvalue()), save=False)
+        self.width, self.height = width, height
+        self.save(update_fields=['proxy_image', 'width', 'height'])
+        return img
+
+    def render_preview(self):
+        """Preview bytes (WebP): the operations replayed on the proxy, cached per operation list"""
+        from PIL import Image
+        from .operations import apply_operations
+
+        cache_key = f"image_editor:preview:{self.pk}:{self.operations_version}"
+        data = cache.get(cache_key)
+        if data is not None:
+            return data
+
+        if self.proxy_image:
+            with self.proxy_image.open('rb') as f:
+                proxy = Image.open(f)
+                proxy.load()
+        else:
+            proxy = self.build_proxy()
+        img = apply_operations(proxy, self.operations, proxy.width / self.full_size()[0])
+
+        output = io.BytesIO()
+        img.save(output, format='WEBP', quality=85)
+        data = output.getvalue()
+        cache.set(cache_key, data, PREVIEW_CACHE_TIMEOUT)
+        return data
+
+    def render(self):
+        """
+        Render the operations on the full-resolution original into edited_image, replacing the
+        previous render, so each image keeps at most one edited file.
+        """
+        from shop.utils import safe_open_image
+        from .operations import apply_operations, encode_image, output_format
+
+        if self.is_rendered:
+            return self.edited_image
+
+        with self.original_image.open('rb') as f:
+            img = safe_open_image(f)
+            img.load()
+        img = apply_operations(img, self.operations)
+
+        content = encode_image(img, output_format(self.original_image.name))
+        if self.edited_image:
+            self.edited_image.delete(save=False)
+        self.edited_image.save(
+            f"edited_{os.path.basename(self.original_image.name)}", ContentFile(content), save=False
+        )
+        self.rendered_version = self.operations_version
+        self.save(update_fields=['edited_image', 'rendered_version'])
+        return self.edited_image
+
+    def add_operation(self, operation):
+        from .operations import append_operation
+        self.operations = append_operation(self.operations, operation)
+        self.save(update_fields=['operations'])
+
+    def undo_operation(self):
+        if self.operations:
+            self.operations = self.operations[:-1]
+            self.save(update_fields=['operations'])
     
     def delete(self, *args, **kwargs):
         """
@@ -25,35 +156,88 @@ class EditedImage(models.Model):
                 if os.path.isfile(self.original_image.path):
                     os.remove(self.original_image.path)
             
-            # Delete the edited image file if it exists
-            if self.edited_image and hasattr(self.edited_image, 'path'):
-                if os.path.isfile(self.edited_image.path):
-                    os.remove(self.edited_image.path)
+            # Delete the edited image and preview proxy files if they exist
+            for field_file in (self.edited_image, self.proxy_image):
+                if field_file and hasattr(field_file, 'path'):
+                    if os.path.isfile(field_file.path):
+                        os.remove(field_file.path)
         except Exception as e:
             print(f"Error deleting image files: {e}")
                 
         super().delete(*args, **kwargs)
 
 
+class EditBatch(models.Model):
+    """Progress and per-image results of a batch edit (see image_editor.batch)."""
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('done', 'Done'),
+    ]
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    total = models.PositiveIntegerField(default=0)
+    succeeded = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    results = models.JSONField(default=dict, blank=True, help_text="Per image id: status and url or error")
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Batch {self.id} ({self.succeeded + self.failed}/{self.total})"
+
+    @property
+    def progress(self):
+        if not self.total:
+            return 1.0
+        return round((self.succeeded + self.failed) / self.total, 3)
+
+
 class InteractiveImage(models.Model):
     """Model to store images with interactive coordinate regions."""
+    TILES_STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+
     name = models.CharField(max_length=200, blank=True, help_text="Optional name for this image")
     image = models.ImageField(upload_to='interactive_images/')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    tiles_status = models.CharField(max_length=20, choices=TILES_STATUS_CHOICES, default='pending')
+    tiles_version = models.CharField(max_length=12, blank=True, help_text="Source version of the generated tile pyramid")
     
     class Meta:
         ordering = ['-created_at']
     
     def __str__(self):
         return self.name or f"Interactive Image {self.id}"
+
+    def save(self, *args, **kwargs):
+        from . import tiles
+
+        # A new or replaced image needs a new tile pyramid
+        needs_tiles = bool(self.image) and self.tiles_version != tiles.source_version(self)
+        if needs_tiles:
+            self.tiles_status = tiles.STATUS_PENDING
+        super().save(*args, **kwargs)
+        if needs_tiles:
+            tiles.schedule_tiles(self.pk)
     
     def delete(self, *args, **kwargs):
-        """Delete image file when model is deleted."""
+        """Delete image file and its tiles when model is deleted."""
+        from .tiles import delete_tiles
+
         try:
             if self.image and hasattr(self.image, 'path'):
                 if os.path.isfile(self.image.path):
                     os.remove(self.image.path)
+            delete_tiles(self.pk)
         except Exception as e:
             print(f"Error deleting image file: {e}")
         super().delete(*args, **kwargs)
@@ -0,0 +1,223 @@
+"""
+Non-destructive edit operations
+Edits are kept as an ordered list of operations applied to the untouched original, instead of
+decoding and re-encoding the previous result on every click. Previews replay the list on a
+small proxy of the original; the full-resolution image is only rendered for download.
+
+Operations are stored resolution-independently so the same list applies to the proxy and to
+the original:
+    {'op': 'rotate', 'direction': 'left' | 'right' | 'flip'}
+    {'op': 'crop', 'box': [left, top, right, bottom]}   fractions of the current image
+    {'op': 'resize', 'width': w, 'height': h}          pixels at full resolution
+
+Batch requests may also send {'op': 'crop', 'aspect': '4:5'} (centred) or a resize with only
+one side; resolve_operation() turns those into the stored form once the image size is known.
+"""
+import hashlib
+import io
+import json
+
+from PIL import Image
+
+PROXY_MAX_SIZE = 1200
+MIN_CROP_SIZE = 10
+MAX_RESIZE = 10000
+
+ROTATIONS = {
+    'left': Image.Transpose.ROTATE_90,
+    'right': Image.Transpose.ROTATE_270,
+    'flip': Image.Transpose.ROTATE_180,
+}
+QUARTER_TURNS = {'left': 1, 'flip': 2, 'right': 3}
+TURNS_TO_DIRECTION = {1: 'left', 2: 'flip', 3: 'right'}
+
+
+def operations_version(operations):
+    """Token that changes whenever the operation list does"""
+    payload = json.dumps(operations, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def append_operation(operations, operation):
+    """New operation list with `operation` appended; consecutive rotations are merged"""
+    operations = list(operations)
+    if operation['op'] == 'rotate' and operations and operations[-1]['op'] == 'rotate':
+        previous = operations.pop()
+        turns = (QUARTER_TURNS[previous['direction']] + QUARTER_TURNS[operation['direction']]) % 4
+        if turns:
+            operations.append({'op': 'rotate', 'direction': TURNS_TO_DIRECTION[turns]})
+        return operations
+    operations.append(operation)
+    return operations
+
+
+def _crop_pixels(size, box):
+    width, height = size
+    left, top, right, bottom = box
+    # Round the origin and the extent separately so the crop size does not depend on the offset
+    x, y = round(left * width), round(top * height)
+    crop_width = max(1, min(round((right - left) * width), width - x))
+    crop_height = max(1, min(round((bottom - top) * height), height - y))
+    return x, y, x + crop_width, y + crop_height
+
+
+def _step_size(size, operation, scale):
+    """Size after one operation, without touching pixels"""
+    width, height = size
+    if operation['op'] == 'rotate':
+        return size if operation['direction'] == 'flip' else (height, width)
+    if operation['op'] == 'crop':
+        left, top, right, bottom = _crop_pixels(size, operation['box'])
+        return right - left, bottom - top
+    if operation['op'] == 'resize':
+        return max(1, round(operation['width'] * scale)), max(1, round(operation['height'] * scale))
+    raise ValueError(f"Unknown operation '{operation['op']}'")
+
+
+def output_size(size, operations, scale=1.0):
+    """Size of `size` after all operations (scale = base size / full-resolution size)"""
+    for operation in operations:
+        size = _step_size(size, operation, scale)
+    return size
+
+
+def apply_operations(img, operations, scale=1.0):
+    """Replay the operation list on a PIL image"""
+    for operation in operations:
+        if operation['op'] == 'rotate':
+            img = img.transpose(ROTATIONS[operation['direction']])
+        elif operation['op'] == 'crop':
+            img = img.crop(_crop_pixels(img.size, operation['box']))
+        elif operation['op'] == 'resize':
+            img = img.resize(_step_size(img.size, operation, scale), Image.Resampling.LANCZOS)
+        else:
+            raise ValueError(f"Unknown operation '{operation['op']}'")
+    return img
+
+
+def output_format(name):
+    """Pillow format to encode a render of the file `name` in"""
+    img_format = name.rsplit('.', 1)[-1].upper()
+    if img_format == 'JPG':
+        return 'JPEG'
+    return img_format if img_format in ('JPEG', 'PNG', 'WEBP') else 'JPEG'
+
+
+def encode_image(img, img_format):
+    """Encode a full-resolution render; it is the only lossy step, so use a high quality"""
+    options = {'quality': 95} if img_format in ('JPEG', 'WEBP') else {}
+    if img_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    output = io.BytesIO()
+    img.save(output, format=img_format, **options)
+    return output.getvalue()
+
+
+def rotate_operation(direction):
+    if direction not in ROTATIONS:
+        raise ValueError('Invalid rotation direction. Use "left" or "right".')
+    return {'op': 'rotate', 'direction': direction}
+
+
+def crop_operation(size, x, y, width, height):
+    """
+    Crop operation from a pixel rectangle on an image of `size` (the preview the user sees).
+    The rectangle is clamped to the image like the editor always did.
+    """
+    image_width, image_height = size
+    if width <= 0 or height <= 0:
+        raise ValueError('Invalid crop dimensions: width and height must be positive')
+
+    x, y = max(x, 0), max(y, 0)
+    width = min(width, image_width - x)
+    height = min(height, image_height - y)
+    if width <= MIN_CROP_SIZE or height <= MIN_CROP_SIZE:
+        raise ValueError('Crop area too small after adjustment to image boundaries')
+
+    return {
+        'op': 'crop',
+        'box': [
+            round(x / image_width, 6),
+            round(y / image_height, 6),
+            round((x + width) / image_width, 6),
+            round((y + height) / image_height, 6),
+        ],
+    }
+
+
+def resize_operation(full_size, width=None, height=None):
+    """Resize operation to `width` and/or `height` full-resolution pixels (aspect kept if one is missing)"""
+    current_width, current_height = full_size
+    if not width and not height:
+        raise ValueError('Provide a width or a height')
+    if width and not height:
+        height = round(current_height * width / current_width)
+    elif height and not width:
+        width = round(current_width * height / current_height)
+    if width < 1 or height < 1 or width > MAX_RESIZE or height > MAX_RESIZE:
+        raise ValueError('Invalid resize dimensions')
+    return {'op': 'resize', 'width': int(width), 'height': int(height)}
+
+
+def _fraction(value):
+    value = float(value)
+    if not 0 <= value <= 1:
+        raise ValueError('Crop box values must be fractions between 0 and 1')
+    return value
+
+
+def parse_aspect(aspect):
+    """'4:5' -> 0.8 (width / height)"""
+    try:
+        width, height = (float(part) for part in str(aspect).split(':'))
+    except ValueError:
+        raise ValueError(f"Invalid aspect ratio '{aspect}', use e.g. '4:5'")
+    if width <= 0 or height <= 0:
+        raise ValueError(f"Invalid aspect ratio '{aspect}'")
+    return width / height
+
+
+def validate_operation(data):
+    """Check an operation sent by a client; returns a clean dict or raises ValueError"""
+    if not isinstance(data, dict):
+        raise ValueError('Each operation must be an object')
+    op = data.get('op')
+    if op == 'rotate':
+        return rotate_operation(data.get('direction'))
+    if op == 'crop':
+        if 'aspect' in data:
+            parse_aspect(data['aspect'])
+            return {'op': 'crop', 'aspect': str(data['aspect'])}
+        box = data.get('box')
+        if not isinstance(box, (list, tuple)) or len(box) != 4:
+            raise ValueError("Crop needs a 'box' of four fractions or an 'aspect'")
+        left, top, right, bottom = (_fraction(value) for value in box)
+        if right <= left or bottom <= top:
+            raise ValueError('Crop box is empty')
+        return {'op': 'crop', 'box': [left, top, right, bottom]}
+    if op == 'resize':
+        width = int(data['width']) if data.get('width') else None
+        height = int(data['height']) if data.get('height') else None
+        if not width and not height:
+            raise ValueError('Provide a width or a height')
+        if any(value is not None and not 1 <= value <= MAX_RESIZE for value in (width, height)):
+            raise ValueError('Invalid resize dimensions')
+        return {'op': 'resize', 'width': width, 'height': height}
+    raise ValueError(f"Unknown operation '{op}'")
+
+
+def resolve_operation(size, operation):
+    """Stored form of a validated operation for an image that currently has `size` (full resolution)"""
+    if operation['op'] == 'crop' and 'aspect' in operation:
+        width, height = size
+        ratio = parse_aspect(operation['aspect'])
+        if width / height > ratio:
+            keep = ratio * height / width
+            box = [(1 - keep) / 2, 0, (1 + keep) / 2, 1]
+        else:
+            keep = width / ratio / height
+            box = [0, (1 - keep) / 2, 1, (1 + keep) / 2]
+        return {'op': 'crop', 'box': [round(value, 6) for value in box]}
+    if operation['op'] == 'resize' and not (operation['width'] and operation['height']):
+        return resize_operation(size, operation['width'], operation['height'])
+    return operation
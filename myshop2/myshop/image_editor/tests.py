@@ -1,3 +1,308 @@
+from django.core.files.storage import FileSystemStorage, Storage
 from django.test import TestCase
 
 # Create your tests here.
+
+
+class RemoteStorage(Storage):
+    """Storage that, like S3, has no local paths (backed by MEDIA_ROOT for the test)"""
+    def __init__(self):
+        self.files = FileSystemStorage()
+
+    def _open(self, name, mode='rb'):
+        return self.files.open(name, mode)
+
+    def _save(self, name, content):
+        return self.files.save(name, content)
+
+    def exists(self, name):
+        return self.files.exists(name)
+
+    def delete(self, name):
+        self.files.delete(name)
+
+    def url(self, name):
+        return self.files.url(name)
+
+
+class EditOperationsTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from io import BytesIO
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.test import override_settings
+        from .models import EditedImage
+
+        self.media = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media)
+        self.settings_override.enable()
+
+        buffer = BytesIO()
+        Image.linear_gradient('L').resize((2400, 1600)).convert('RGB').save(buffer, format='JPEG')
+        self.image = EditedImage.objects.create(
+            original_image=SimpleUploadedFile('photo.jpg', buffer.getvalue())
+        )
+
+    def tearDown(self):
+        import shutil
+        self.settings_override.disable()
+        shutil.rmtree(self.media, ignore_errors=True)
+
+    def post(self, name, data):
+        import json
+        from django.urls import reverse
+        return self.client.post(
+            reverse(f'image_editor:{name}', args=[self.image.id]), json.dumps(data), content_type='application/json'
+        )
+
+    def edited_files(self):
+        import os
+        path = os.path.join(self.media, 'edited_images', 'edited')
+        return os.listdir(path) if os.path.isdir(path) else []
+
+    def test_edits_are_recorded_and_previewed_from_proxy(self):
+        from io import BytesIO
+        from PIL import Image
+        from django.urls import reverse
+
+        response = self.post('rotate_image', {'direction': 'right'})
+        self.assertEqual(response.status_code, 200)
+        # The proxy is at most 1200px: 2400x1600 becomes 1200x800, rotated 800x1200
+        self.assertEqual((response.json()['width'], response.json()['height']), (800, 1200))
+
+        response = self.post('crop_image', {'x': 0, 'y': 0, 'width': 400, 'height': 600})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['operations']), 2)
+
+        preview = self.client.get(reverse('image_editor:preview_image', args=[self.image.id]))
+        self.assertEqual(preview['Content-Type'], 'image/webp')
+        self.assertEqual(Image.open(BytesIO(preview.content)).size, (400, 600))
+        self.assertEqual(self.edited_files(), [])
+
+        cached = self.client.get(
+            reverse('image_editor:preview_image', args=[self.image.id]), HTTP_IF_NONE_MATCH=preview['ETag']
+        )
+        self.assertEqual(cached.status_code, 304)
+
+    def test_download_renders_full_resolution_once(self):
+        from io import BytesIO
+        from PIL import Image
+        from django.urls import reverse
+
+        self.post('rotate_image', {'direction': 'left'})
+        self.post('rotate_image', {'direction': 'left'})
+        self.post('rotate_image', {'direction': 'left'})
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.operations, [{'op': 'rotate', 'direction': 'right'}])
+
+        self.post('crop_image', {'x': 0, 'y': 0, 'width': 400, 'height': 600})
+        response = self.client.get(reverse('image_editor:download_image', args=[self.image.id]))
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(Image.open(BytesIO(response.content)).size, (800, 1200))
+
+        self.client.get(reverse('image_editor:download_image', args=[self.image.id]))
+        self.post('undo_operation', {})
+        self.client.get(reverse('image_editor:download_image', args=[self.image.id]))
+        self.assertEqual(len(self.edited_files()), 1)
+
+    def test_uploaded_edit_keeps_the_original(self):
+        from io import BytesIO
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.urls import reverse
+
+        original_name = self.image.original_image.name
+        buffer = BytesIO()
+        Image.new('RGB', (300, 200), 'red').save(buffer, format='JPEG')
+        response = self.client.post(
+            reverse('image_editor:update_image', args=[self.image.id]),
+            {'image': SimpleUploadedFile('edited.jpg', buffer.getvalue())},
+        )
+        self.assertEqual(response.status_code, 200)
+
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.original_image.name, original_name)
+        self.assertTrue(self.image.original_image.storage.exists(original_name))
+        self.assertTrue(self.image.is_rendered)
+
+        # The upload is what gets downloaded until the next operation
+        response = self.client.get(reverse('image_editor:download_image', args=[self.image.id]))
+        self.assertEqual(Image.open(BytesIO(response.content)).size, (300, 200))
+
+        self.post('rotate_image', {'direction': 'right'})
+        response = self.client.get(reverse('image_editor:download_image', args=[self.image.id]))
+        self.assertEqual(Image.open(BytesIO(response.content)).size, (1600, 2400))
+        self.assertEqual(len(self.edited_files()), 1)
+
+    def test_resize_uses_full_resolution_pixels(self):
+        response = self.post('resize_image', {'width': 1200})
+        self.assertEqual(response.json()['operations'], [{'op': 'resize', 'width': 1200, 'height': 800}])
+        # Preview is rendered at proxy scale (1200 / 2400)
+        self.assertEqual((response.json()['width'], response.json()['height']), (600, 400))
+        self.assertEqual(self.post('resize_image', {}).status_code, 400)
+
+
+class BatchOperationsTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from io import BytesIO
+        from PIL import Image
+        from django.contrib.auth import get_user_model
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.test import override_settings
+        from .models import EditedImage
+
+        self.media = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media, IMAGE_PROCESSING_WORKERS=0)
+        self.settings_override.enable()
+
+        self.images = []
+        for size in ((1000, 500), (600, 900)):
+            buffer = BytesIO()
+            Image.new('RGB', size, 'white').save(buffer, format='PNG')
+            self.images.append(EditedImage.objects.create(
+                original_image=SimpleUploadedFile('product.png', buffer.getvalue())
+            ))
+        self.staff = get_user_model().objects.create_user(email='editor@example.com', password='x', is_staff=True)
+
+    def tearDown(self):
+        import shutil
+        self.settings_override.disable()
+        shutil.rmtree(self.media, ignore_errors=True)
+
+    def post(self, data):
+        import json
+        from django.urls import reverse
+        return self.client.post(reverse('image_editor:batch_operations'), json.dumps(data), content_type='application/json')
+
+    def test_batch_applies_operations_and_reports_progress(self):
+        from PIL import Image
+
+        self.client.force_login(self.staff)
+        ids = [image.id for image in self.images]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post({
+                'ids': ids + [999],
+                'operations': [{'op': 'rotate', 'direction': 'right'}, {'op': 'crop', 'aspect': '4:5'}],
+            })
+        self.assertEqual(response.status_code, 202)
+
+        status = self.client.get(response.json()['statusUrl']).json()
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual((status['succeeded'], status['failed'], status['progress']), (2, 1, 1.0))
+        self.assertEqual(status['results']['999']['status'], 'failed')
+
+        first = self.images[0]
+        first.refresh_from_db()
+        self.assertTrue(first.is_rendered)
+        self.assertEqual(first.operations[0], {'op': 'rotate', 'direction': 'right'})
+        # 1000x500 rotated is 500x1000, centre-cropped to 4:5 -> 500x625
+        self.assertEqual(Image.open(first.edited_image.path).size, (500, 625))
+        self.assertEqual(status['results'][str(first.id)]['width'], 500)
+
+    def test_batch_renders_through_storage_without_local_paths(self):
+        from PIL import Image
+        from django.test import override_settings
+
+        self.client.force_login(self.staff)
+        storages = {
+            'default': {'BACKEND': 'image_editor.tests.RemoteStorage'},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        }
+        with override_settings(STORAGES=storages):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.post({'ids': [self.images[1].id], 'operations': [{'op': 'resize', 'width': 300}]})
+            status = self.client.get(response.json()['statusUrl']).json()
+            self.assertEqual((status['succeeded'], status['failed']), (1, 0))
+
+            image = self.images[1]
+            image.refresh_from_db()
+            with image.edited_image.open('rb') as f:
+                self.assertEqual(Image.open(f).size, (300, 450))
+
+    def test_batch_requires_staff_and_valid_operations(self):
+        self.assertEqual(self.post({'ids': [self.images[0].id], 'operations': [{'op': 'rotate'}]}).status_code, 403)
+        self.client.force_login(self.staff)
+        response = self.post({'ids': [self.images[0].id], 'operations': [{'op': 'blur'}]})
+        self.assertEqual(response.status_code, 400)
+        response = self.post({'items': [{'id': self.images[0].id, 'operations': [{'op': 'crop', 'box': [0.5, 0, 0.2, 1]}]}]})
+        self.assertEqual(response.status_code, 400)
+
+
+class InteractiveTilesTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+
+        self.media = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media, INTERACTIVE_TILES_BACKGROUND=False)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        import shutil
+        self.settings_override.disable()
+        shutil.rmtree(self.media, ignore_errors=True)
+
+    def create_image(self, size=(600, 300)):
+        from io import BytesIO
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from .models import InteractiveImage, InteractiveRegion
+
+        buffer = BytesIO()
+        Image.new('RGB', size, 'tan').save(buffer, format='JPEG')
+        with self.captureOnCommitCallbacks(execute=True):
+            image = InteractiveImage.objects.create(
+                name='Lookbook', image=SimpleUploadedFile('look.jpg', buffer.getvalue())
+            )
+        InteractiveRegion.objects.create(
+            interactive_image=image, region_id='watch', label='Watch', x_percent='0.25', y_percent='0.5'
+        )
+        return image
+
+    def test_manifest_lists_levels_tiles_and_regions(self):
+        import os
+        from PIL import Image
+        from django.urls import reverse
+
+        image = self.create_image()
+        response = self.client.get(reverse('image_editor:interactive_image_tiles', args=[image.id]))
+        self.assertEqual(response.status_code, 200)
+        manifest = response.json()
+
+        # 600px wide: levels 0 (1x1) .. 10 (600x300, 3x2 tiles)
+        self.assertEqual(manifest['maxLevel'], 10)
+        self.assertEqual(manifest['levels'][-1], {'level': 10, 'width': 600, 'height': 300, 'columns': 3, 'rows': 2})
+        self.assertEqual(manifest['levels'][0]['width'], 1)
+        self.assertEqual(manifest['regions'][0]['id'], 'watch')
+
+        tile_url = manifest['tileUrlTemplate'].format(level=10, column=0, row=0)
+        tile_path = os.path.join(self.media, tile_url.split('/media/', 1)[1])
+        # Interior tile edges carry one pixel of overlap with their neighbours
+        self.assertEqual(Image.open(tile_path).size, (257, 257))
+        self.assertTrue(os.path.exists(tile_path.replace('/10/0_0.webp', '.dzi')))
+
+    def test_replacing_the_image_replaces_the_pyramid(self):
+        import os
+        from io import BytesIO
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        image = self.create_image()
+        image.refresh_from_db()
+        old_version = image.tiles_version
+
+        buffer = BytesIO()
+        Image.new('RGB', (300, 300), 'navy').save(buffer, format='PNG')
+        image.image = SimpleUploadedFile('look2.png', buffer.getvalue())
+        with self.captureOnCommitCallbacks(execute=True):
+            image.save()
+        image.refresh_from_db()
+
+        self.assertEqual(image.tiles_status, 'ready')
+        self.assertNotEqual(image.tiles_version, old_version)
+        root = os.path.join(self.media, 'interactive_tiles', str(image.id))
+        old_files = [files for _, _, files in os.walk(os.path.join(root, old_version)) if files]
+        self.assertEqual(old_files, [])
+        self.assertFalse(os.path.exists(os.path.join(root, f'{old_version}.dzi')))
@@ -0,0 +1,214 @@
+"""
+Deep-zoom tile pyramids
+Interactive lookbook images are 4-8k pixels wide. Instead of sending the full image, each
+InteractiveImage gets a DZI-style pyramid of 256px WebP tiles, generated once after upload.
+Level N is the full resolution, every level below halves it down to a single pixel, so a
+client only fetches the tiles visible at its current zoom.
+"""
+import hashlib
+import logging
+import math
+import threading
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+TILE_OVERLAP = 1
+TILE_FORMAT = 'webp'
+TILE_QUALITY = 80
+TILES_DIR = 'interactive_tiles'
+
+STATUS_PENDING = 'pending'
+STATUS_READY = 'ready'
+STATUS_FAILED = 'failed'
+
+
+def run_in_background():
+    return getattr(settings, 'INTERACTIVE_TILES_BACKGROUND', True)
+
+
+def source_version(interactive_image):
+    """Changes whenever a different file is uploaded for the image"""
+    return hashlib.sha1(interactive_image.image.name.encode('utf-8')).hexdigest()[:12]
+
+
+def tiles_prefix(image_id, version):
+    return f"{TILES_DIR}/{image_id}/{version}"
+
+
+def max_level(width, height):
+    return math.ceil(math.log2(max(width, height, 1)))
+
+
+def level_size(width, height, level, top_level=None):
+    top_level = max_level(width, height) if top_level is None else top_level
+    scale = 2 ** (top_level - level)
+    return max(1, math.ceil(width / scale)), max(1, math.ceil(height / scale))
+
+
+def level_grid(width, height):
+    """[{'level', 'width', 'height', 'columns', 'rows'}] from the 1x1 level up to full size"""
+    top_level = max_level(width, height)
+    levels = []
+    for level in range(top_level + 1):
+        level_width, level_height = level_size(width, height, level, top_level)
+        levels.append({
+            'level': level,
+            'width': level_width,
+            'height': level_height,
+            'columns': math.ceil(level_width / TILE_SIZE),
+            'rows': math.ceil(level_height / TILE_SIZE),
+        })
+    return levels
+
+
+def dzi_descriptor(width, height):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+        f'Format="{TILE_FORMAT}" Overlap="{TILE_OVERLAP}" TileSize="{TILE_SIZE}">'
+        f'<Size Width="{width}" Height="{height}"/></Image>\n'
+    )
+
+
+def _tile_box(column, row, level_width, level_height):
+    """Tile rectangle including the overlap with its neighbours, clipped to the level"""
+    left = column * TILE_SIZE - (TILE_OVERLAP if column else 0)
+    top = row * TILE_SIZE - (TILE_OVERLAP if row else 0)
+    right = min((column + 1) * TILE_SIZE + TILE_OVERLAP, level_width)
+    bottom = min((row + 1) * TILE_SIZE + TILE_OVERLAP, level_height)
+    return left, top, right, bottom
+
+
+def generate_tiles(interactive_image, storage=None):
+    """
+    Decode the image once and write every level of the pyramid plus the .dzi descriptor.
+    Levels are produced by halving the previous one, so no level re-reads the original.
+    Returns (width, height, version).
+    """
+    from shop.utils import safe_open_image
+
+    storage = storage or default_storage
+    version = source_version(interactive_image)
+    prefix = tiles_prefix(interactive_image.pk, version)
+    # Start from an empty prefix so regenerated tiles keep their names
+    _delete_tree(storage, prefix)
+    if storage.exists(f"{prefix}.dzi"):
+        storage.delete(f"{prefix}.dzi")
+
+    with interactive_image.image.open('rb') as f:
+        img = safe_open_image(f)
+        img.load()
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+
+    width, height = img.size
+    for spec in reversed(level_grid(width, height)):
+        if img.size != (spec['width'], spec['height']):
+            img = img.resize((spec['width'], spec['height']), Image.Resampling.BOX)
+        for column in range(spec['columns']):
+            for row in range(spec['rows']):
+                tile = img.crop(_tile_box(column, row, spec['width'], spec['height']))
+                output = BytesIO()
+                tile.save(output, format='WEBP', quality=TILE_QUALITY, method=4)
+                storage.save(f"{prefix}/{spec['level']}/{column}_{row}.{TILE_FORMAT}", ContentFile(output.getvalue()))
+
+    # The descriptor is written last: its presence marks a complete pyramid
+    storage.save(f"{prefix}.dzi", ContentFile(dzi_descriptor(width, height).encode('utf-8')))
+    return width, height, version
+
+
+def _delete_tree(storage, path):
+    try:
+        directories, files = storage.listdir(path)
+    except (FileNotFoundError, NotImplementedError):
+        return
+    for name in files:
+        storage.delete(f"{path}/{name}")
+    for directory in directories:
+        _delete_tree(storage, f"{path}/{directory}")
+
+
+def delete_tiles(image_id, keep_version=None, storage=None):
+    """Remove the pyramids of an image (all of them, or all but keep_version)"""
+    storage = storage or default_storage
+    root = f"{TILES_DIR}/{image_id}"
+    try:
+        directories, files = storage.listdir(root)
+    except (FileNotFoundError, NotImplementedError):
+        return
+    for directory in directories:
+        if directory != keep_version:
+            _delete_tree(storage, f"{root}/{directory}")
+    for name in files:
+        if not keep_version or not name.startswith(f"{keep_version}."):
+            storage.delete(f"{root}/{name}")
+
+
+def build_tiles(image_id):
+    """Generate the pyramid for one image and record the result on the row"""
+    from .models import InteractiveImage
+
+    interactive_image = InteractiveImage.objects.filter(pk=image_id).first()
+    if interactive_image is None or not interactive_image.image:
+        return None
+
+    try:
+        width, height, version = generate_tiles(interactive_image)
+    except Exception as e:
+        logger.warning('Tile generation failed for interactive image %s: %s', image_id, e)
+        InteractiveImage.objects.filter(pk=image_id).update(tiles_status=STATUS_FAILED)
+        return None
+
+    # Only publish if the image was not replaced while the tiles were being cut
+    updated = InteractiveImage.objects.filter(pk=image_id, image=interactive_image.image.name).update(
+        width=width, height=height, tiles_version=version, tiles_status=STATUS_READY
+    )
+    if updated:
+        delete_tiles(image_id, keep_version=version)
+    return version
+
+
+def schedule_tiles(image_id):
+    """Generate tiles after the transaction commits, in a background thread unless disabled"""
+    def run():
+        try:
+            build_tiles(image_id)
+        finally:
+            connection.close()
+
+    def start():
+        if run_in_background():
+            threading.Thread(target=run, daemon=True).start()
+        else:
+            build_tiles(image_id)
+
+    transaction.on_commit(start)
+
+
+def tiles_manifest(interactive_image):
+    """Tile layout and URLs for a ready pyramid (None if it is not generated yet)"""
+    if interactive_image.tiles_status != STATUS_READY or not interactive_image.tiles_version:
+        return None
+
+    storage = default_storage
+    prefix = tiles_prefix(interactive_image.pk, interactive_image.tiles_version)
+    base_url = storage.url(f"{prefix}/")
+    return {
+        'width': interactive_image.width,
+        'height': interactive_image.height,
+        'tileSize': TILE_SIZE,
+        'overlap': TILE_OVERLAP,
+        'format': TILE_FORMAT,
+        'maxLevel': max_level(interactive_image.width, interactive_image.height),
+        'levels': level_grid(interactive_image.width, interactive_image.height),
+        'tileUrlTemplate': base_url + '{level}/{column}_{row}.' + TILE_FORMAT,
+        'dziUrl': storage.url(f"{prefix}.dzi"),
+    }
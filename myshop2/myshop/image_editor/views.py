@@ -7,6 +7,7 @@ from django.urls import reverse
 
 from .forms import ImageUploadForm
 from .models import EditedImage, InteractiveImage, InteractiveRegion
+from .operations import crop_operation, output_size, resize_operation, rotate_operation
 from shop.utils import safe_open_image
 
 from PIL import Image
@@ -14,6 +15,7 @@ import os
 import io
 import base64
 import json
+import mimetypes
 import warnings
 
 # Suppress ICC profile warnings
@@ -35,16 +37,26 @@ def edit_image(request, image_id):
     """View for editing an image."""
     image_obj = get_object_or_404(EditedImage, id=image_id)
     
-    # Use the edited image if it exists, otherwise use the original
-    image_to_display = image_obj.edited_image if image_obj.edited_image else image_obj.original_image
-    
+    # The editor always works on the preview: the downscaled proxy with the operations applied
     context = {
         'image': image_obj,
-        'image_url': image_to_display.url,
+        'image_url': reverse('image_editor:preview_image', args=[image_obj.id]),
     }
     
     return render(request, 'image_editor/edit.html', context)
 
+def _operation_response(image_obj):
+    """JSON returned after an edit: the new preview URL and the operation list"""
+    width, height = image_obj.preview_size()
+    return JsonResponse({
+        'success': True,
+        'imageUrl': reverse('image_editor:preview_image', args=[image_obj.id]),
+        'operations': image_obj.operations,
+        'version': image_obj.operations_version,
+        'width': width,
+        'height': height,
+    })
+
 @csrf_exempt
 def rotate_image(request, image_id):
     """API endpoint to rotate an image."""
@@ -60,42 +72,12 @@ def rotate_image(request, image_id):
         if direction not in ['left', 'right']:
             return JsonResponse({'error': 'Invalid rotation direction. Use "left" or "right".'}, status=400)
         
-        # Determine which image to rotate (edited if exists, otherwise original)
-        source_image = image_obj.edited_image if image_obj.edited_image else image_obj.original_image
-        
-        if not source_image:
+        if not image_obj.original_image:
             return JsonResponse({'error': 'No image found to rotate'}, status=404)
         
-        # Open the image with PIL
-        img = safe_open_image(source_image.path)
-        
-        # Rotate 90 degrees in specified direction
-        if direction == 'left':
-            rotated_img = img.rotate(90, expand=True)
-        else:  # default to right rotation
-            rotated_img = img.rotate(-90, expand=True)
-        
-        # Save the rotated image
-        output = io.BytesIO()
-        img_format = source_image.name.split('.')[-1].upper()
-        if img_format == 'JPG':
-            img_format = 'JPEG'
-        elif img_format not in ['JPEG', 'PNG', 'WEBP']:
-            img_format = 'JPEG'  # Default to JPEG for unsupported formats
-        
-        rotated_img.save(output, format=img_format, icc_profile=None)
-        output.seek(0)
-        
-        # Generate a filename for the edited image
-        filename = f"rotated_{os.path.basename(source_image.name)}"
-        
-        # Save the rotated image without deleting the original
-        image_obj.edited_image.save(filename, ContentFile(output.read()), save=True)
-        
-        return JsonResponse({
-            'success': True,
-            'imageUrl': image_obj.edited_image.url
-        })
+        # Only the operation is recorded; pixels are rendered for the preview on request
+        image_obj.add_operation(rotate_operation(direction))
+        return _operation_response(image_obj)
         
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON data'}, status=400)
@@ -106,7 +88,10 @@ def rotate_image(request, image_id):
 
 @csrf_exempt
 def crop_image(request, image_id):
-    """API endpoint to crop an image."""
+    """
+    API endpoint to crop an image.
+    Coordinates are pixels of the preview the editor displays.
+    """
     if request.method != 'POST':
         return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
     
@@ -119,78 +104,89 @@ def crop_image(request, image_id):
         width = int(float(data.get('width', 0)))
         height = int(float(data.get('height', 0)))
         
-        # Input validation
-        if width <= 0 or height <= 0:
-            return JsonResponse({'error': 'Invalid crop dimensions: width and height must be positive'}, status=400)
-        
-        # Determine which image to crop (edited if exists, otherwise original)
-        source_image = image_obj.edited_image if image_obj.edited_image else image_obj.original_image
-        
-        # Open the image with PIL
-        img = safe_open_image(source_image.path)
-        
-        img_width, img_height = img.size
-        
-        # Ensure crop coordinates are within image boundaries
-        if x < 0:
-            x = 0
-        if y < 0:
-            y = 0
-        if x + width > img_width:
-            width = img_width - x
-        if y + height > img_height:
-            height = img_height - y
-            
-        # Final validation after adjustments
-        if width <= 10 or height <= 10:
-            return JsonResponse({
-                'error': 'Crop area too small after adjustment to image boundaries'
-            }, status=400)
-        
-        # Perform the crop
-        cropped_img = img.crop((x, y, x + width, y + height))
+        # Validation and clamping to the image happen against the preview size
+        try:
+            operation = crop_operation(image_obj.preview_size(), x, y, width, height)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
         
-        # Save the cropped image
-        output = io.BytesIO()
-        img_format = source_image.name.split('.')[-1].upper()
-        if img_format == 'JPG':
-            img_format = 'JPEG'
+        image_obj.add_operation(operation)
+        return _operation_response(image_obj)
         
-        cropped_img.save(output, format=img_format, icc_profile=None)
-        output.seek(0)
-        
-        # Generate a filename for the edited image
-        filename = f"cropped_{os.path.basename(source_image.name)}"
-        
-        # Important: Don't delete the old file before saving the new one
-        # Just create a new file and update the edited_image field
-        image_obj.edited_image.save(filename, ContentFile(output.read()), save=True)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON data'}, status=400)
+    except ValueError as e:
+        return JsonResponse({'error': f'Invalid value in crop data: {str(e)}'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@csrf_exempt
+def resize_image(request, image_id):
+    """API endpoint to resize an image to a width and/or height in full-resolution pixels."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+    
+    image_obj = get_object_or_404(EditedImage, id=image_id)
+    
+    try:
+        data = json.loads(request.body)
+        width = int(data['width']) if data.get('width') else None
+        height = int(data['height']) if data.get('height') else None
         
-        return JsonResponse({
-            'success': True,
-            'imageUrl': image_obj.edited_image.url
-        })
+        full_size = output_size(image_obj.full_size(), image_obj.operations)
+        image_obj.add_operation(resize_operation(full_size, width, height))
+        return _operation_response(image_obj)
         
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON data'}, status=400)
     except ValueError as e:
-        return JsonResponse({'error': f'Invalid value in crop data: {str(e)}'}, status=400)
+        return JsonResponse({'error': str(e)}, status=400)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
-def download_image(request, image_id):
-    """View to download the edited image."""
+@csrf_exempt
+def undo_operation(request, image_id):
+    """API endpoint to drop the last edit operation."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+    
+    image_obj = get_object_or_404(EditedImage, id=image_id)
+    image_obj.undo_operation()
+    return _operation_response(image_obj)
+
+def preview_image(request, image_id):
+    """The current edit rendered on the downscaled proxy."""
     image_obj = get_object_or_404(EditedImage, id=image_id)
     
-    # Determine which image to download (edited if exists, otherwise original)
-    source_image = image_obj.edited_image if image_obj.edited_image else image_obj.original_image
+    etag = f'"{image_obj.operations_version}"'
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponse(status=304)
+    else:
+        try:
+            response = HttpResponse(image_obj.render_preview(), content_type='image/webp')
+        except IOError:
+            return HttpResponse("Cannot process the image file", status=500)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+def download_image(request, image_id):
+    """View to download the edited image, rendered at full resolution."""
+    image_obj = get_object_or_404(EditedImage, id=image_id)
     
-    if not source_image:
+    if not image_obj.original_image:
         return HttpResponse("No image available for download", status=404)
     
-    # Open the file
-    with open(source_image.path, 'rb') as f:
-        response = HttpResponse(f.read(), content_type='image/jpeg')  # Adjust content type as needed
+    # Unedited images are served as uploaded; edits are rendered once per operation list, and an
+    # edited file uploaded through update_image stands in for that render
+    if image_obj.operations or image_obj.is_rendered:
+        source_image = image_obj.render()
+    else:
+        source_image = image_obj.original_image
+    
+    with source_image.open('rb') as f:
+        content_type = mimetypes.guess_type(source_image.name)[0] or 'image/jpeg'
+        response = HttpResponse(f.read(), content_type=content_type)
         
     # Set filename in HTTP header
     filename = os.path.basename(source_image.name)
@@ -200,7 +196,13 @@ def download_image(request, image_id):
 
 @csrf_exempt
 def update_image(request, image_id):
-    """API endpoint to update an existing image."""
+    """
+    API endpoint to update an existing image.
+
+    With an uploaded 'image' the file (edited client-side) is stored as edited_image for the
+    current operations; the original is kept, so later operations still apply to it. Without
+    one, the current operations are rendered at full resolution into edited_image.
+    """
     if request.method != 'POST':
         return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
     
@@ -210,18 +212,23 @@ def update_image(request, image_id):
         # Get the new image from the request
         new_image = request.FILES.get('image')
         if not new_image:
-            return JsonResponse({'error': 'No image provided'}, status=400)
+            if not image_obj.original_image:
+                return JsonResponse({'error': 'No image provided'}, status=400)
+            edited = image_obj.render()
+            return JsonResponse({
+                'success': True,
+                'imageUrl': edited.url
+            })
         
-        # Delete the old image file if it exists
+        # Replace the previous edited file, keeping the original
         if image_obj.edited_image:
-            try:
-                os.remove(image_obj.edited_image.path)
-            except:
-                pass  # Ignore if file doesn't exist
+            image_obj.edited_image.delete(save=False)
         
         # Save the new image with the same filename as the original
-        original_filename = os.path.basename(image_obj.original_image.name)
-        image_obj.edited_image.save(original_filename, new_image, save=True)
+        original_filename = os.path.basename(image_obj.original_image.name or '') or new_image.name
+        image_obj.edited_image.save(original_filename, new_image, save=False)
+        image_obj.rendered_version = image_obj.operations_version
+        image_obj.save(update_fields=['edited_image', 'rendered_version'])
         
         return JsonResponse({
             'success': True,
@@ -232,6 +239,74 @@ def update_image(request, image_id):
         return JsonResponse({'error': str(e)}, status=500)
 
 
+@csrf_exempt
+def batch_operations(request):
+    """
+    API endpoint to apply operations to many images at once.
+
+    Body: {"items": [{"id": 1, "operations": [...]}, ...]} or {"ids": [1, 2], "operations": [...]}
+    Operations: rotate (direction), crop (box fractions or aspect like "4:5"), resize (width/height).
+    Returns 202 with a status URL to poll.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff access required'}, status=403)
+    
+    from .batch import get_max_items, start_batch
+    from .operations import validate_operation
+    
+    try:
+        data = json.loads(request.body)
+        if 'items' in data:
+            raw_items = [(item.get('id'), item.get('operations') or data.get('operations') or []) for item in data['items']]
+        else:
+            raw_items = [(image_id, data.get('operations') or []) for image_id in data.get('ids', [])]
+        
+        if not raw_items:
+            return JsonResponse({'error': 'No images given'}, status=400)
+        if len(raw_items) > get_max_items():
+            return JsonResponse({'error': f'At most {get_max_items()} images per batch'}, status=400)
+        
+        items = []
+        for image_id, operations in raw_items:
+            if not operations:
+                return JsonResponse({'error': f'No operations for image {image_id}'}, status=400)
+            items.append((int(image_id), [validate_operation(op) for op in operations]))
+        if len({image_id for image_id, _ in items}) != len(items):
+            return JsonResponse({'error': 'Each image may only appear once per batch'}, status=400)
+        
+        batch = start_batch(items)
+        return JsonResponse({
+            'success': True,
+            'batch_id': batch.id,
+            'total': batch.total,
+            'statusUrl': reverse('image_editor:batch_status', args=[batch.id]),
+        }, status=202)
+        
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON data'}, status=400)
+    except (ValueError, TypeError, AttributeError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+def batch_status(request, batch_id):
+    """Progress and per-image results of a batch."""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff access required'}, status=403)
+    
+    from .models import EditBatch
+    batch = get_object_or_404(EditBatch, id=batch_id)
+    return JsonResponse({
+        'batch_id': batch.id,
+        'status': batch.status,
+        'total': batch.total,
+        'succeeded': batch.succeeded,
+        'failed': batch.failed,
+        'progress': batch.progress,
+        'results': batch.results,
+    })
+
+
 # Interactive Image Coordinate Mapper Views
 
 def test_interactive_setup(request):
@@ -292,7 +367,7 @@ def upload_interactive_image(request):
         
         # Create InteractiveImage instance
         interactive_image = InteractiveImage.objects.create(
-            name=name or None,
+            name=name,
             image=image_file
         )
         
@@ -362,28 +437,32 @@ def save_interactive_regions(request, image_id):
         return JsonResponse({'error': str(e)}, status=500)
 
 
+def _region_data(region):
+    return {
+        'id': region.region_id,
+        'label': region.label,
+        'xPercent': float(region.x_percent),
+        'yPercent': float(region.y_percent),
+        'widthPercent': float(region.width_percent) if region.width_percent else None,
+        'heightPercent': float(region.height_percent) if region.height_percent else None,
+        'color': region.color,
+        'icon': region.icon,
+        'order': region.order
+    }
+
+
 def get_interactive_image(request, image_id):
     """API endpoint to get interactive image with its regions."""
     try:
         interactive_image = get_object_or_404(InteractiveImage, id=image_id)
-        regions = interactive_image.regions.all()
-        
-        regions_data = [{
-            'id': region.region_id,
-            'label': region.label,
-            'xPercent': float(region.x_percent),
-            'yPercent': float(region.y_percent),
-            'widthPercent': float(region.width_percent) if region.width_percent else None,
-            'heightPercent': float(region.height_percent) if region.height_percent else None,
-            'color': region.color,
-            'icon': region.icon,
-            'order': region.order
-        } for region in regions]
+        regions_data = [_region_data(region) for region in interactive_image.regions.all()]
         
         return JsonResponse({
             'id': interactive_image.id,
             'name': interactive_image.name,
             'imageUrl': interactive_image.image.url,
+            'tilesStatus': interactive_image.tiles_status,
+            'tilesUrl': reverse('image_editor:interactive_image_tiles', args=[interactive_image.id]),
             'regions': regions_data,
             'createdAt': interactive_image.created_at.isoformat()
         })
@@ -392,6 +471,41 @@ def get_interactive_image(request, image_id):
         return JsonResponse({'error': str(e)}, status=500)
 
 
+def interactive_image_tiles(request, image_id):
+    """
+    API endpoint with the deep-zoom manifest of an interactive image: pyramid levels, a tile
+    URL template and the regions, so clients only download the tiles they display.
+    Returns 202 with the plain image URL while the pyramid is still being generated.
+    """
+    from .tiles import STATUS_FAILED, schedule_tiles, tiles_manifest
+    
+    interactive_image = get_object_or_404(InteractiveImage, id=image_id)
+    manifest = tiles_manifest(interactive_image)
+    if manifest is None:
+        if interactive_image.tiles_status == STATUS_FAILED:
+            return JsonResponse({
+                'status': interactive_image.tiles_status,
+                'imageUrl': interactive_image.image.url,
+            }, status=200)
+        if interactive_image.tiles_status != 'pending':
+            schedule_tiles(interactive_image.id)
+        return JsonResponse({
+            'status': 'pending',
+            'imageUrl': interactive_image.image.url,
+        }, status=202)
+    
+    response = JsonResponse(dict(
+        manifest,
+        id=interactive_image.id,
+        name=interactive_image.name,
+        status=interactive_image.tiles_status,
+        imageUrl=interactive_image.image.url,
+        regions=[_region_data(region) for region in interactive_image.regions.all()],
+    ))
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
 def api_interactive_images(request):
     """API endpoint to list all interactive images."""
     images = InteractiveImage.objects.all().order_by('-created_at')
@@ -400,6 +514,8 @@ def api_interactive_images(request):
         'id': img.id,
         'name': img.name or f'Image {img.id}',
         'imageUrl': img.image.url,
+        'tilesStatus': img.tiles_status,
+        'tilesUrl': reverse('image_editor:interactive_image_tiles', args=[img.id]),
         'regionCount': img.regions.count(),
         'createdAt': img.created_at.isoformat()
     } for img in images]
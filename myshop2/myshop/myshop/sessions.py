@@ -0,0 +1,64 @@
+"""
+Sliding Session Engine
+Cache-backed sessions (database fallback) that only re-save when they are close to expiring,
+instead of writing the session row on every request.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.contrib.sessions.middleware import SessionMiddleware
+
+
+class SessionStore(CachedDBStore):
+    """
+    cached_db session store with coarse-grained sliding expiry.
+
+    Every save stamps the session with the time it was written. A session that is read
+    but not modified is only re-saved once SESSION_REFRESH_AFTER seconds have passed since
+    that stamp, which keeps the expiry sliding without one UPDATE per request.
+    """
+
+    refresh_key = '_session_refreshed_at'
+
+    @classmethod
+    def get_refresh_after(cls):
+        default = max(settings.SESSION_COOKIE_AGE // 14, 60)
+        return getattr(settings, 'SESSION_REFRESH_AFTER', default)
+
+    def needs_refresh(self):
+        """Return True if this unmodified session should be re-saved to slide its expiry"""
+        if not self.session_key or self.modified:
+            return False
+        session = self._get_session()
+        if not session:
+            return False
+        refreshed_at = session.get(self.refresh_key)
+        if refreshed_at is None:
+            return True
+        return time.time() - refreshed_at >= self.get_refresh_after()
+
+    def save(self, must_create=False):
+        # Stamp only sessions that carry data so empty sessions stay empty
+        if getattr(self, '_session_cache', None):
+            self._session_cache[self.refresh_key] = int(time.time())
+        super().save(must_create=must_create)
+
+
+class SlidingSessionMiddleware(SessionMiddleware):
+    """
+    Drop-in replacement for SessionMiddleware, meant to run with SESSION_SAVE_EVERY_REQUEST = False.
+    Marks the session as modified when its refresh interval has elapsed so that the regular
+    save/cookie logic slides the expiry forward.
+    """
+
+    def process_response(self, request, response):
+        session = getattr(request, 'session', None)
+        if session is not None and hasattr(session, 'needs_refresh'):
+            try:
+                if session.needs_refresh():
+                    session.modified = True
+            except Exception:
+                # Never fail a response because of a refresh check
+                pass
+        return super().process_response(request, response)
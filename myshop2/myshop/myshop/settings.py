@@ -68,7 +68,7 @@ MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',  # Added CORS middleware
     'shop.middleware.GlobalRateLimitMiddleware',  # Global rate limiting for all endpoints
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'myshop.sessions.SlidingSessionMiddleware',  # SessionMiddleware with coarse sliding expiry
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -170,6 +170,18 @@ CACHES = {
         'LOCATION': 'unique-snowflake',
     }
 }
+# Login delays and counters must be shared by all workers; use Redis when it is configured
+if os.environ.get('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+        'OPTIONS': {'CLIENT_CLASS': 'django_redis.client.DefaultClient'},
+    }
+
+# Where login failure counts live: 'cache' sliding-window counters need the shared Redis cache;
+# with the per-process LocMemCache each worker would count (and limit) separately, so they are
+# read from the LoginAttempt table instead ('database')
+LOGIN_FAILURE_COUNTS = 'cache' if os.environ.get('REDIS_URL') else 'database'
 
 # File Upload Settings
 DATA_UPLOAD_MAX_MEMORY_SIZE = 20971520  # 20MB
@@ -217,7 +229,7 @@ ACCOUNT_EMAIL_CONFIRMATION_ANONYMOUS_REDIRECT_URL = '/accounts/login/'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.SessionAuthentication',  # For admin users
-        'rest_framework_simplejwt.authentication.JWTAuthentication',  # For API users
+        'accounts.authentication.CachedJWTAuthentication',  # For API users (JWT, cached user lookup)
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.AllowAny',
@@ -246,10 +258,24 @@ SIMPLE_JWT = {
     'LEEWAY': 60,  # Allow up to 60 seconds of clock skew
 }
 
+# Seconds a JWT-authenticated user is served from the cache instead of the database. Saves drop
+# the entry, which reaches every worker only with a shared cache (Redis); with the per-process
+# LocMemCache entries live at most JWT_USER_CACHE_LOCAL_TTL, the delay before token invalidation
+# or deactivation reaches the other workers.
+JWT_USER_CACHE_TTL = 60
+JWT_USER_CACHE_LOCAL_TTL = 5
+
+# UserSession activity (last_activity, ip_address) is kept in memory per request, copied to the
+# cache at most once a minute per session and written with one bulk_update every 5 minutes
+SESSION_ACTIVITY_CACHE_INTERVAL = 60
+SESSION_ACTIVITY_FLUSH_INTERVAL = 300
+
 # Session Configuration for better authentication persistence
 SESSION_COOKIE_AGE = 1209600  # 2 weeks in seconds
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False  # Keep session alive after browser close
-SESSION_SAVE_EVERY_REQUEST = True  # Refresh session on every request
+SESSION_ENGINE = 'myshop.sessions'  # Cache-backed sessions with database fallback
+SESSION_SAVE_EVERY_REQUEST = False  # Only save sessions whose data actually changed
+SESSION_REFRESH_AFTER = 86400  # Re-save unmodified sessions at most once a day to slide expiry
 SESSION_COOKIE_HTTPONLY = True  # Prevent JavaScript access to session cookies
 SESSION_COOKIE_SAMESITE = 'Lax'  # CSRF protection
 SESSION_COOKIE_SECURE = False  # Set to False for local development
@@ -257,6 +283,45 @@ CSRF_COOKIE_SECURE = False  # Set to False for local development
 CSRF_COOKIE_SAMESITE = 'Lax'
 CSRF_COOKIE_HTTPONLY = False  # Allow JavaScript access for AJAX requests
 
+# Category attribute propagation to subcategories:
+# 'sync' runs inside the saving request, 'deferred' runs after commit in a background thread
+CATEGORY_ATTRIBUTE_PROPAGATION = os.environ.get('CATEGORY_ATTRIBUTE_PROPAGATION', 'sync')
+
+# Product/variant image uploads are stored as originals and compressed to WebP after commit.
+# IMAGE_PROCESSING_WORKERS sizes the one image process pool each server process starts, shared
+# with image editor batches (0 workers = process inline at commit time)
+IMAGE_PROCESSING_ASYNC = True
+IMAGE_PROCESSING_WORKERS = int(os.environ.get('IMAGE_PROCESSING_WORKERS', '2'))
+
+# Responsive derivatives served in srcset lists, generated lazily on first request.
+# 'avif' is only used when Pillow was built with AVIF support.
+IMAGE_DERIVATIVE_WIDTHS = [160, 320, 640, 1280]
+IMAGE_DERIVATIVE_FORMATS = ['webp']
+
+# Maximum Hamming distance (out of 64 bits) between dHashes for two images to count as near duplicates
+PERCEPTUAL_HASH_THRESHOLD = 6
+
+# Image editor batch operations: batch size limit (renders run in the IMAGE_PROCESSING_WORKERS pool)
+IMAGE_EDITOR_BATCH_MAX_ITEMS = 100
+
+# Deep-zoom tile pyramids for interactive images are cut in a background thread after upload
+INTERACTIVE_TILES_BACKGROUND = True
+
+# Direct supplier image uploads: presigned S3 POSTs when media is stored on S3, resumable chunks otherwise.
+# Staged files live under uploads/ until finalized (the orphaned media sweep removes abandoned ones).
+DIRECT_UPLOAD_MAX_SIZE = 20 * 1024 * 1024
+DIRECT_UPLOAD_CHUNK_SIZE = 1024 * 1024
+DIRECT_UPLOAD_EXPIRY = 60 * 60
+
+# Catalog imports started over the admin API read their images only from this directory
+# (the request's image_root is a subdirectory of it); the import_catalog command is not limited
+CATALOG_IMPORT_IMAGE_ROOT = os.environ.get('CATALOG_IMPORT_IMAGE_ROOT', os.path.join(BASE_DIR, 'catalog_images'))
+
+# With LOGIN_FAILURE_COUNTS = 'cache' the LoginAttempt audit rows are written by a background
+# thread in batches (the database mode always writes them in the request). Set to False to write
+# each row in the request instead.
+LOGIN_ATTEMPT_LOG_ASYNC = os.environ.get('LOGIN_ATTEMPT_LOG_ASYNC', 'true').lower() == 'true'
+
 # Security settings
 if 'RENDER' in os.environ:
     SECURE_SSL_REDIRECT = True
@@ -424,16 +489,22 @@ LOGS_DIR = BASE_DIR / 'logs'
 if not LOGS_DIR.exists():
     LOGS_DIR.mkdir(parents=True, exist_ok=True)
 
-# S3 Storage Configuration
-if 'RENDER' in os.environ:
-    # Use S3 for media files in production
-    DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+# S3 Storage Configuration (USE_S3=true enables it outside Render, e.g. against a local MinIO)
+USE_S3 = 'RENDER' in os.environ or os.environ.get('USE_S3', '').lower() == 'true'
+if USE_S3:
+    # Use S3 for media files in production (Django 5 reads STORAGES; DEFAULT_FILE_STORAGE is gone)
+    STORAGES = {
+        'default': {'BACKEND': 'storages.backends.s3boto3.S3Boto3Storage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    }
     
     # S3 Configuration
     AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID')
     AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
     AWS_STORAGE_BUCKET_NAME = os.environ.get('AWS_STORAGE_BUCKET_NAME')
     AWS_S3_REGION_NAME = os.environ.get('AWS_S3_REGION_NAME', 'us-east-1')
+    # S3-compatible stand-in (MinIO, LocalStack); unset for AWS itself
+    AWS_S3_ENDPOINT_URL = os.environ.get('AWS_S3_ENDPOINT_URL')
     
     # Optional: Improve performance and reduce costs
     AWS_S3_FILE_OVERWRITE = True
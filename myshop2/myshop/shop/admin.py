@@ -113,7 +113,8 @@ class NewAttributeValueAdmin(admin.ModelAdmin):
 class ProductImageInline(admin.TabularInline):
     model = ProductImage
     extra = 1
-    fields = ['image', 'is_primary', 'order']
+    fields = ['image', 'is_primary', 'order', 'processing_status']
+    readonly_fields = ['processing_status']
     max_num = 10  # محدودیت تعداد تصاویر
     validate_max = True  # اعمال محدودیت
     ordering = ['order']  # مرتب‌سازی بر اساس فیلد order
@@ -154,7 +155,8 @@ class ProductVariantInline(admin.TabularInline):
 class ProductVariantImageInline(admin.TabularInline):
     model = ProductVariantImage
     extra = 1
-    fields = ['image', 'is_primary', 'order']
+    fields = ['image', 'is_primary', 'order', 'processing_status']
+    readonly_fields = ['processing_status']
     max_num = 10  # محدودیت تعداد تصاویر برای هر نوع محصول
     validate_max = True  # اعمال محدودیت
     ordering = ['order']  # مرتب‌سازی بر اساس فیلد order
@@ -181,7 +183,8 @@ class ProductVariantImageInline(admin.TabularInline):
 class ProductImageInlineAdmin(admin.TabularInline):
     model = ProductImage
     extra = 1
-    fields = ['image', 'is_primary', 'order']
+    fields = ['image', 'is_primary', 'order', 'processing_status']
+    readonly_fields = ['processing_status']
     max_num = 10  # محدودیت تعداد تصاویر
     validate_max = True  # اعمال محدودیت
     ordering = ['order']  # مرتب‌سازی بر اساس فیلد order
@@ -790,27 +793,22 @@ class ProductAdmin(admin.ModelAdmin):
             obj.legacy_attribute_set.all().delete()
 
         # Save only submitted and non-empty legacy attributes
-        for key, value in request.POST.items():
-            if key.startswith('attr_') and value.strip():
-                attr_key = key.replace('attr_', '')
-                
-                # Check if this is a flexible attribute
-                if obj.category and obj.category.is_subcategory():
-                    try:
-                        # Try to find the attribute in the flexible system
-                        attribute = Attribute.objects.get(key=attr_key)
-                        # This is a flexible attribute, save it properly
-                        obj.set_attribute_value(attr_key, value)
-                        continue
-                    except Attribute.DoesNotExist:
-                        pass
-                
-                # Fall back to legacy system
-                ProductAttribute.objects.create(
-                    product=obj,
-                    key=attr_key,
-                    value=value
-                )
+        submitted = {
+            key.replace('attr_', ''): value
+            for key, value in request.POST.items()
+            if key.startswith('attr_') and value.strip()
+        }
+        legacy_keys = list(submitted)
+
+        # Flexible attributes are written in one batch; unknown keys fall back to the legacy system
+        if submitted and obj.category and obj.category.is_subcategory():
+            outcomes = Product.bulk_set_attribute_values({obj: submitted})
+            legacy_keys = [o['attribute_key'] for o in outcomes if o['status'] == 'error']
+
+        ProductAttribute.objects.bulk_create([
+            ProductAttribute(product=obj, key=attr_key, value=submitted[attr_key])
+            for attr_key in legacy_keys
+        ])
 
     def save_related(self, request, form, formsets, change):
         super().save_related(request, form, formsets, change)
@@ -990,6 +988,49 @@ class ProductImageAdmin(admin.ModelAdmin):
     list_display = ['product', 'image', 'is_primary', 'order', 'created_at']
     list_filter = ['is_primary', 'created_at']
     search_fields = ['product__name']
+    readonly_fields = ['perceptual_hash', 'perceptual_group']
+    exclude = ['phash_band0', 'phash_band1', 'phash_band2', 'phash_band3']
+    change_list_template = 'admin/shop/productimage/change_list.html'
+
+    def get_urls(self):
+        from django.urls import path
+        urls = super().get_urls()
+        custom_urls = [
+            path(
+                'near-duplicates/',
+                admin.site.admin_view(self.near_duplicates_view),
+                name='shop_productimage_near_duplicates',
+            ),
+        ]
+        return custom_urls + urls
+
+    def near_duplicates_view(self, request):
+        """Groups of visually similar product and variant images across the catalog"""
+        from .perceptual_hash import near_duplicate_report
+        from .storage import content_addressed_storage
+
+        try:
+            limit = min(int(request.GET.get('limit', 50)), 500)
+        except ValueError:
+            limit = 50
+        groups = near_duplicate_report(limit=limit)
+
+        product_ids = {image['product_id'] for group in groups for image in group['images']}
+        names = dict(Product.objects.filter(id__in=product_ids).values_list('id', 'name'))
+        storage = content_addressed_storage()
+        for group in groups:
+            for image in group['images']:
+                image['product_name'] = names.get(image['product_id'], '')
+                image['url'] = storage.url(image['image'])
+
+        context = dict(
+            self.admin_site.each_context(request),
+            title='تصاویر مشابه',
+            opts=self.model._meta,
+            groups=groups,
+            limit=limit,
+        )
+        return render(request, 'admin/shop/productimage/near_duplicates.html', context)
     
     def get_form(self, request, obj=None, **kwargs):
         form = super().get_form(request, obj, **kwargs)
@@ -1017,8 +1058,9 @@ class OrderItemInline(admin.TabularInline):
 class OrderAdmin(admin.ModelAdmin):
     list_display = ['id', 'first_name', 'last_name', 'email',
                    'address', 'postal_code', 'city', 'paid',
-                   'get_total_cost_display', 'created', 'updated']
+                   'item_count', 'get_total_cost_display', 'created', 'updated']
     list_filter = ['paid', 'created', 'updated']
+    readonly_fields = ['total', 'item_count']
     inlines = [OrderItemInline]
     search_fields = ['first_name', 'last_name', 'email']
     
@@ -1027,6 +1069,7 @@ class OrderAdmin(admin.ModelAdmin):
             return f"{float(obj.get_total_cost()):,.0f} تومان"
         return "-"
     get_total_cost_display.short_description = 'Total Cost'
+    get_total_cost_display.admin_order_field = 'total'
 
 
 class OrderItemAdmin(admin.ModelAdmin):
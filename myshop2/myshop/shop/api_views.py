@@ -1,9 +1,11 @@
+import copy
+import csv
 from django.http import JsonResponse
 from django.db.models import Q
 from django.db import models
 from django.shortcuts import get_object_or_404
 from .models import Product, Attribute, NewAttributeValue, Category, ProductAttributeValue, CategoryGroup, CategoryGender, SpecialOffer, SpecialOfferProduct, ProductVariant
-from decimal import InvalidOperation
+from decimal import Decimal, InvalidOperation
 from django.views.decorators.http import require_GET
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
@@ -11,6 +13,7 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from .serializers import ProductSerializer, SpecialOfferSerializer
+from .image_derivatives import build_srcset
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.pagination import PageNumberPagination
@@ -972,7 +975,7 @@ def api_products_by_gender_category(request):
                 'category_name': product.category.name,
                 'category_label': product.category.get_display_name(),
                 'gender': product_gender,
-                'image_url': get_product_image_url(product, request),
+                **get_product_image_fields(product, request),
                 'attributes': get_product_attributes(product),
                 'created_at': get_unix_timestamp(product.created_at),
                 'supplier': product.supplier.name if product.supplier else None
@@ -1235,7 +1238,10 @@ def api_unified_products(request):
                 'images': [
                     {
                         'url': request.build_absolute_uri(img.image.url),
-                        'is_primary': img.is_primary
+                        'is_primary': img.is_primary,
+                        'processing_status': img.processing_status,
+                        'placeholder': img.placeholder,
+                        **build_srcset('product', img, request)
                     } for img in product.images.all()
                 ] if hasattr(product, 'images') else [],
                 'attributes': get_product_attributes(product),
@@ -1526,7 +1532,7 @@ def api_category_products(request, category_id):
                 'category_name': product.category.name,
                 'category_label': product.category.get_display_name(),
                 'gender': product_gender,
-                'image_url': get_product_image_url(product, request),
+                **get_product_image_fields(product, request),
                 'attributes': get_product_attributes(product),
                 'created_at': get_unix_timestamp(product.created_at),
                 'supplier': product.supplier.name if product.supplier else None
@@ -1632,7 +1638,7 @@ def api_subcategory_products(request, parent_category_id):
                 'category_parent_id': product.category.parent.id if product.category.parent else None,
                 'category_parent_name': product.category.parent.name if product.category.parent else None,
                 'gender': product_gender,
-                'image_url': get_product_image_url(product, request),
+                **get_product_image_fields(product, request),
                 'attributes': get_product_attributes(product),
                 'created_at': get_unix_timestamp(product.created_at),
                 'supplier': product.supplier.name if product.supplier else None
@@ -1780,7 +1786,7 @@ def api_hierarchical_category_products(request, category_path):
                 'category_name': product.category.name,
                 'category_label': product.category.get_display_name(),
                 'gender': product_gender,
-                'image_url': get_product_image_url(product, request),
+                **get_product_image_fields(product, request),
                 'attributes': get_product_attributes(product),
                 'created_at': get_unix_timestamp(product.created_at),
                 'supplier': product.supplier.name if product.supplier else None
@@ -4045,6 +4051,7 @@ class SpecialOfferDetailAPIView(APIView):
                             'offer_type': offer.offer_type,
                             'display_style': offer.display_style,
                             'banner_image_url': request.build_absolute_uri(offer.banner_image.url) if offer.banner_image else None,
+                            'banner_placeholder': offer.banner_placeholder,
                             'banner_action_type': offer.banner_action_type,
                             'banner_action_target': offer.banner_action_target,
                             'banner_external_url': offer.banner_external_url,
@@ -4405,6 +4412,7 @@ class AdminSpecialOffersAPIView(APIView):
                     'remaining_time': offer.get_remaining_time(),
                     'is_currently_valid': offer.is_currently_valid(),
                     'banner_image_url': request.build_absolute_uri(offer.banner_image.url) if offer.banner_image else None,
+                    'banner_placeholder': offer.banner_placeholder,
                     'products': []  # We'll populate this separately
                 }
                 
@@ -4832,6 +4840,85 @@ class ProductsWithSaleInfoAPIView(APIView):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+# -----------------------------
+# Catalog Import APIs
+# -----------------------------
+
+class AdminCatalogImportAPIView(APIView):
+    """
+    Admin endpoint to bulk-import a CSV/JSON catalog.
+    The upload is stored and imported in the background; poll AdminCatalogImportStatusAPIView for progress.
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        import os
+        import tempfile
+        import uuid
+        from django.conf import settings
+        from suppliers.models import Supplier
+        from .catalog_import import start_catalog_import_job
+
+        upload = request.FILES.get('file')
+        if not upload:
+            return Response({'success': False, 'error': 'file is required'}, status=status.HTTP_400_BAD_REQUEST)
+        extension = os.path.splitext(upload.name)[1].lower()
+        if extension not in ['.csv', '.json']:
+            return Response({'success': False, 'error': 'file must be .csv or .json'}, status=status.HTTP_400_BAD_REQUEST)
+
+        supplier = None
+        supplier_id = request.data.get('supplier_id')
+        if supplier_id:
+            try:
+                supplier = Supplier.objects.get(id=supplier_id)
+            except (Supplier.DoesNotExist, ValueError):
+                return Response({'success': False, 'error': 'Supplier not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            batch_size = max(1, int(request.data.get('batch_size', 200)))
+        except (TypeError, ValueError):
+            return Response({'success': False, 'error': 'batch_size must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Images are read from CATALOG_IMPORT_IMAGE_ROOT (or a subdirectory of it) and nowhere else
+        image_base = os.path.realpath(settings.CATALOG_IMPORT_IMAGE_ROOT)
+        image_root = os.path.realpath(os.path.join(image_base, request.data.get('image_root') or ''))
+        if image_root != image_base and not image_root.startswith(image_base + os.sep):
+            return Response({'success': False, 'error': 'image_root must be inside the catalog image directory'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Keep uploads outside MEDIA_ROOT so catalog files are never publicly served
+        import_dir = os.path.join(tempfile.gettempdir(), 'catalog_imports')
+        os.makedirs(import_dir, exist_ok=True)
+        path = os.path.join(import_dir, f'{uuid.uuid4().hex}{extension}')
+        with open(path, 'wb') as f:
+            for chunk in upload.chunks():
+                f.write(chunk)
+
+        job_id = start_catalog_import_job(
+            path,
+            supplier=supplier,
+            batch_size=batch_size,
+            image_root=image_root,
+            confine_images=True,
+            checkpoint_path=f'{path}.checkpoint.json',
+            dry_run=str(request.data.get('dry_run', '')).lower() in ['1', 'true'],
+        )
+        return Response({'success': True, 'job_id': job_id}, status=status.HTTP_202_ACCEPTED)
+
+
+class AdminCatalogImportStatusAPIView(APIView):
+    """Progress of a catalog import started through AdminCatalogImportAPIView"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, job_id):
+        from .catalog_import import get_catalog_import_job
+
+        job = get_catalog_import_job(job_id)
+        if job is None:
+            return Response({'success': False, 'error': 'Import job not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'success': True, 'job': job})
+
+
 # -----------------------------
 # Session-based Basket APIs
 # -----------------------------
@@ -4840,20 +4927,29 @@ BASKET_SESSION_KEY = 'basket_v1'
 
 
 def _get_session_basket(request):
-    """Return mutable basket dict from session; ensure structure exists."""
-    basket = request.session.get(BASKET_SESSION_KEY)
-    if not basket or not isinstance(basket, dict):
-        basket = {'items': {}, 'currency': 'toman', 'updated_at': timezone.now().isoformat()}
-        request.session[BASKET_SESSION_KEY] = basket
+    """Return a mutable copy of the session basket; ensure structure exists.
+
+    The copy is not written back here, so reading the basket never dirties the session.
+    """
+    stored = request.session.get(BASKET_SESSION_KEY)
+    if not stored or not isinstance(stored, dict):
+        stored = {}
+    basket = copy.deepcopy(stored)
     basket.setdefault('items', {})
     basket['currency'] = 'toman'
     return basket
 
 
 def _save_session_basket(request, basket):
+    """Write the basket back only if its items changed. Returns True if the session was updated."""
+    stored = request.session.get(BASKET_SESSION_KEY)
+    if isinstance(stored, dict) and stored.get('items', {}) == basket.get('items', {}):
+        return False
+    if not isinstance(stored, dict) and not basket.get('items'):
+        return False
     basket['updated_at'] = timezone.now().isoformat()
     request.session[BASKET_SESSION_KEY] = basket
-    request.session.modified = True
+    return True
 
 
 def _serialize_basket(basket):
@@ -4926,12 +5022,15 @@ def get_product_image_url(product):
 # Orders API
 # -----------------------------
 
-def serialize_order(order):
+def serialize_order(order, request=None):
     items = []
-    subtotal = 0.0
-    for it in order.items.select_related('product').all():
+    # Reuse items__product when the caller prefetched it; otherwise join the products in one query
+    if 'items' in getattr(order, '_prefetched_objects_cache', {}):
+        order_items = order.items.all()
+    else:
+        order_items = order.items.select_related('product')
+    for it in order_items:
         line = float(it.price) * it.quantity
-        subtotal += line
         items.append({
             'id': it.id,
             'product': {
@@ -4957,8 +5056,8 @@ def serialize_order(order):
         'updated': order.updated.isoformat(),
         'paid': order.paid,
         'totals': {
-            'grand_total': subtotal,
-            'item_count': sum(i['quantity'] for i in items),
+            'grand_total': float(order.total),
+            'item_count': order.item_count,
         },
         'items': items,
     }
@@ -4972,6 +5071,8 @@ def api_orders_list(request):
     q = request.GET.get('q', '').strip()
     status_paid = request.GET.get('paid')  # 'true' | 'false' | None
     sort = request.GET.get('sort', '-created')  # '-created', 'created', '-total', 'total'
+    min_total = request.GET.get('min_total')
+    max_total = request.GET.get('max_total')
     page = int(request.GET.get('page', 1))
     limit = int(request.GET.get('limit', 20))
 
@@ -4982,22 +5083,25 @@ def api_orders_list(request):
         )
     if status_paid in ['true', 'false']:
         orders = orders.filter(paid=(status_paid == 'true'))
-
-    # Sorting
-    if sort in ['created', '-created', 'updated', '-updated']:
-        orders = orders.order_by(sort)
-    elif sort in ['total', '-total']:
-        # Annotate totals via Python after fetch; simple approach due to model simplicity
-        orders = list(orders)
-        orders.sort(key=lambda o: float(sum(i.price * i.quantity for i in o.items.all())), reverse=sort == '-total')
+    try:
+        if min_total:
+            orders = orders.filter(total__gte=Decimal(min_total))
+        if max_total:
+            orders = orders.filter(total__lte=Decimal(max_total))
+    except InvalidOperation:
+        return Response({'success': False, 'error': 'min_total and max_total must be numbers'}, status=400)
+
+    # Sorting - total is a denormalized, indexed column so this stays in the database
+    if sort in ['created', '-created', 'updated', '-updated', 'total', '-total']:
+        orders = orders.order_by(sort, '-id')
     else:
-        orders = orders.order_by('-created')
+        orders = orders.order_by('-created', '-id')
 
     # Pagination
-    paginator = Paginator(orders, limit)
+    paginator = Paginator(orders.prefetch_related('items__product'), limit)
     page_obj = paginator.get_page(page)
 
-    data = [serialize_order(o) for o in page_obj]
+    data = [serialize_order(o, request) for o in page_obj]
     return Response({
         'success': True,
         'orders': data,
@@ -5016,10 +5120,10 @@ def api_orders_detail(request, order_id):
     from .models import Order
     
     try:
-        order = Order.objects.get(id=order_id)
+        order = Order.objects.prefetch_related('items__product').get(id=order_id)
     except Order.DoesNotExist:
         return Response({'success': False, 'error': 'Order not found'}, status=404)
-    return Response({'success': True, 'order': serialize_order(order)})
+    return Response({'success': True, 'order': serialize_order(order, request)})
 
 
 @api_view(['POST'])
@@ -5027,7 +5131,7 @@ def api_orders_update_paid(request, order_id):
     from .models import Order
     
     try:
-        order = Order.objects.get(id=order_id)
+        order = Order.objects.prefetch_related('items__product').get(id=order_id)
     except Order.DoesNotExist:
         return Response({'success': False, 'error': 'Order not found'}, status=404)
     paid = request.data.get('paid')
@@ -5035,22 +5139,169 @@ def api_orders_update_paid(request, order_id):
         return Response({'success': False, 'error': 'paid is required'}, status=400)
     order.paid = bool(paid) if isinstance(paid, bool) else str(paid).lower() == 'true'
     order.save(update_fields=['paid', 'updated'])
-    return Response({'success': True, 'order': serialize_order(order)})
+    return Response({'success': True, 'order': serialize_order(order, request)})
+
+
+ORDER_EXPORT_CHUNK_SIZE = 500
+ORDER_EXPORT_BUFFER_SIZE = 64 * 1024
+ORDER_EXPORT_CSV_HEADER = [
+    'id', 'first_name', 'last_name', 'email', 'created', 'paid', 'item_count', 'grand_total',
+    'item_id', 'product_id', 'product_name', 'price', 'quantity', 'item_subtotal',
+]
+
+
+class _EchoBuffer:
+    """Pseudo-buffer for csv.writer: write() returns the row instead of storing it"""
+    def write(self, value):
+        return value
+
+
+def _parse_export_date(value, end=False):
+    """Parse YYYY-MM-DD into an aware datetime (start of day, or start of next day when end=True)"""
+    from datetime import datetime, time, timedelta
+    from django.utils.dateparse import parse_date
+
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError(f"Invalid date '{value}', expected YYYY-MM-DD")
+    if end:
+        parsed += timedelta(days=1)
+    return timezone.make_aware(datetime.combine(parsed, time.min))
+
+
+def _orders_export_queryset(request):
+    """Build the filtered export queryset; filters map onto the created/paid indexes"""
+    from django.db.models import Prefetch
+    from .models import Order, OrderItem
+
+    orders = Order.objects.all()
+    status_paid = request.GET.get('paid')
+    if status_paid in ['true', 'false']:
+        orders = orders.filter(paid=(status_paid == 'true'))
+    date_from = request.GET.get('date_from')
+    date_to = request.GET.get('date_to')
+    if date_from:
+        orders = orders.filter(created__gte=_parse_export_date(date_from))
+    if date_to:
+        orders = orders.filter(created__lt=_parse_export_date(date_to, end=True))
+
+    items = OrderItem.objects.select_related('product').only(
+        'id', 'order_id', 'price', 'quantity', 'product__id', 'product__name'
+    ).order_by('id')
+    return orders.order_by('-created', '-id').prefetch_related(Prefetch('items', queryset=items))
+
+
+def _iter_orders_csv(orders):
+    """Yield CSV text with one row per order line (orders without lines get one empty-line row)"""
+    writer = csv.writer(_EchoBuffer())
+    yield writer.writerow(ORDER_EXPORT_CSV_HEADER)
+    for o in orders:
+        order_cols = [o.id, o.first_name, o.last_name, o.email, o.created.isoformat(), o.paid, o.item_count, o.total]
+        lines = o.items.all()
+        if not lines:
+            yield writer.writerow(order_cols + [''] * 6)
+            continue
+        for it in lines:
+            yield writer.writerow(order_cols + [
+                it.id, it.product.id, it.product.name, it.price, it.quantity, it.price * it.quantity,
+            ])
+
+
+def _iter_orders_ndjson(orders):
+    """Yield one JSON document per order, with its lines nested"""
+    import json
+
+    for o in orders:
+        yield json.dumps({
+            'id': o.id,
+            'first_name': o.first_name,
+            'last_name': o.last_name,
+            'email': o.email,
+            'created': o.created.isoformat(),
+            'paid': o.paid,
+            'item_count': o.item_count,
+            'grand_total': float(o.total),
+            'items': [
+                {
+                    'id': it.id,
+                    'product_id': it.product.id,
+                    'product_name': it.product.name,
+                    'price': float(it.price),
+                    'quantity': it.quantity,
+                    'subtotal': float(it.price * it.quantity),
+                } for it in o.items.all()
+            ],
+        }, ensure_ascii=False) + '\n'
+
+
+def _buffered_bytes(chunks, buffer_size=ORDER_EXPORT_BUFFER_SIZE, compress=False):
+    """Join small text chunks into ~buffer_size byte blocks, optionally gzip-compressing them"""
+    import zlib
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= buffer_size:
+            block = b''.join(buffer)
+            buffer, size = [], 0
+            block = compressor.compress(block) if compressor else block
+            if block:
+                yield block
+    block = b''.join(buffer)
+    if compressor:
+        block = compressor.compress(block) + compressor.flush()
+    if block:
+        yield block
+
+
+@api_view(['GET'])
+def api_orders_export(request):
+    """
+    Stream orders with their lines as CSV or NDJSON.
+    Parameters:
+        - output: 'csv' (default) or 'ndjson'
+        - paid: 'true' | 'false'
+        - date_from / date_to: inclusive YYYY-MM-DD range on created
+        - gzip: '1' to gzip the stream
+    Orders are read with .iterator() in chunks (lines prefetched per chunk), so memory
+    stays flat regardless of how many orders are exported.
+    """
+    return _orders_export_response(request)
 
 
 @api_view(['GET'])
 def api_orders_export_csv(request):
-    from .models import Order
-    import csv
-    from io import StringIO
-    
-    sio = StringIO()
-    writer = csv.writer(sio)
-    writer.writerow(['id','first_name','last_name','email','created','paid','item_count','grand_total'])
-    for o in Order.objects.all().order_by('-created'):
-        total = sum(i.price * i.quantity for i in o.items.all())
-        writer.writerow([o.id, o.first_name, o.last_name, o.email, o.created.isoformat(), o.paid, o.items.count(), total])
-    return Response({'success': True, 'content_type': 'text/csv', 'filename': 'orders.csv', 'data': sio.getvalue()})
+    """Backward-compatible CSV export URL; streams the same output as api_orders_export"""
+    return _orders_export_response(request)
+
+
+def _orders_export_response(request):
+    from django.http import StreamingHttpResponse
+
+    output = request.GET.get('output', 'csv').lower()
+    if output not in ['csv', 'ndjson']:
+        return Response({'success': False, 'error': "output must be 'csv' or 'ndjson'"}, status=400)
+    try:
+        orders = _orders_export_queryset(request)
+    except ValueError as e:
+        return Response({'success': False, 'error': str(e)}, status=400)
+
+    use_gzip = request.GET.get('gzip', '').lower() in ['1', 'true']
+    rows = orders.iterator(chunk_size=ORDER_EXPORT_CHUNK_SIZE)
+    if output == 'csv':
+        chunks, content_type, filename = _iter_orders_csv(rows), 'text/csv; charset=utf-8', 'orders.csv'
+    else:
+        chunks, content_type, filename = _iter_orders_ndjson(rows), 'application/x-ndjson; charset=utf-8', 'orders.ndjson'
+    if use_gzip:
+        content_type, filename = 'application/gzip', filename + '.gz'
+
+    response = StreamingHttpResponse(_buffered_bytes(chunks, compress=use_gzip), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
 
 
 # ========================================
@@ -5301,10 +5552,23 @@ def api_variants_by_attributes(request):
         }, status=500)
 
 
-def get_product_image_url(product, request=None):
+def get_product_image_fields(product, request=None):
+    """Card image fields: absolute URL and the inline placeholder, from one image lookup"""
+    try:
+        first_image = product.images.filter(is_primary=True).first() or product.images.first()
+    except Exception:
+        first_image = None
+    return {
+        'image_url': get_product_image_url(product, request, first_image=first_image),
+        'image_placeholder': first_image.placeholder if first_image else '',
+    }
+
+
+def get_product_image_url(product, request=None, first_image=None):
     """Get product image URL with full absolute URL"""
     try:
-        first_image = product.images.filter(is_primary=True).first()
+        if first_image is None:
+            first_image = product.images.filter(is_primary=True).first()
         if not first_image:
             first_image = product.images.first()
         if first_image and first_image.image:
@@ -0,0 +1,258 @@
+"""
+Category Attribute Propagation
+Set-based sync of CategoryAttribute and AttributeValue rows from a category to all of its
+descendants: the parent and child value sets are diffed in memory and written with a handful
+of bulk statements, instead of get_or_create() per value per subcategory.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Category, CategoryAttribute, AttributeValue
+
+logger = logging.getLogger(__name__)
+
+# Fields of a child attribute that are kept identical to the parent attribute
+ATTRIBUTE_SYNC_FIELDS = ('type', 'required', 'display_order', 'label_fa')
+
+_local = threading.local()
+
+
+def is_propagating():
+    """Return True while this thread is writing propagated rows (signals should not cascade)"""
+    return getattr(_local, 'propagating', False)
+
+
+@contextmanager
+def _propagating():
+    previous = is_propagating()
+    _local.propagating = True
+    try:
+        yield
+    finally:
+        _local.propagating = previous
+
+
+def is_deferred():
+    return getattr(settings, 'CATEGORY_ATTRIBUTE_PROPAGATION', 'sync') == 'deferred'
+
+
+def _empty_stats():
+    return {
+        'attributes_created': 0,
+        'attributes_updated': 0,
+        'values_created': 0,
+        'values_updated': 0,
+    }
+
+
+def get_descendant_ids(category_id, children_map=None):
+    """
+    Return the ids of all descendants of a category.
+    Walks the tree one level per query, or entirely in memory when a {parent_id: [child_ids]} map is given.
+    """
+    seen = set()
+    frontier = [category_id]
+    while frontier:
+        if children_map is not None:
+            children = [child for parent in frontier for child in children_map.get(parent, ())]
+        else:
+            children = list(Category.objects.filter(parent_id__in=frontier).order_by().values_list('id', flat=True))
+        frontier = [child for child in children if child not in seen and child != category_id]
+        seen.update(frontier)
+    return list(seen)
+
+
+def sync_attributes(parent_attrs, target_category_ids, dry_run=False):
+    """
+    Mirror parent_attrs (and their values) onto every category in target_category_ids.
+
+    Missing attributes and values are created with bulk_create(ignore_conflicts=True), drifted
+    attribute fields and value ordering are fixed with bulk_update(). Additive only: values that
+    exist on a child but not on the parent are left alone. Returns a stats dict.
+    """
+    stats = _empty_stats()
+    parent_attrs = list(parent_attrs)
+    target_category_ids = list(target_category_ids)
+    if not parent_attrs or not target_category_ids:
+        return stats
+
+    parents_by_key = {attr.key: attr for attr in parent_attrs}
+
+    # key -> {value: display_order} for the parent side
+    parent_values = {key: {} for key in parents_by_key}
+    for key, value, order in AttributeValue.objects.filter(
+        attribute__in=parent_attrs
+    ).values_list('attribute__key', 'value', 'display_order'):
+        parent_values[key][value] = order
+
+    with transaction.atomic(), _propagating():
+        child_attrs = {
+            (attr.category_id, attr.key): attr
+            for attr in CategoryAttribute.objects.filter(
+                category_id__in=target_category_ids, key__in=parents_by_key.keys()
+            )
+        }
+
+        attrs_to_create = []
+        attrs_to_update = []
+        for category_id in target_category_ids:
+            for key, parent_attr in parents_by_key.items():
+                child_attr = child_attrs.get((category_id, key))
+                if child_attr is None:
+                    attrs_to_create.append(CategoryAttribute(
+                        category_id=category_id,
+                        key=key,
+                        **{name: getattr(parent_attr, name) for name in ATTRIBUTE_SYNC_FIELDS}
+                    ))
+                    continue
+                changed = False
+                for name in ATTRIBUTE_SYNC_FIELDS:
+                    if getattr(child_attr, name) != getattr(parent_attr, name):
+                        setattr(child_attr, name, getattr(parent_attr, name))
+                        changed = True
+                if changed:
+                    attrs_to_update.append(child_attr)
+
+        stats['attributes_created'] = len(attrs_to_create)
+        stats['attributes_updated'] = len(attrs_to_update)
+
+        if dry_run:
+            # New attributes would receive every parent value
+            for attr in attrs_to_create:
+                stats['values_created'] += len(parent_values[attr.key])
+            existing_ids = {attr.id: attr.key for attr in child_attrs.values()}
+        else:
+            if attrs_to_create:
+                CategoryAttribute.objects.bulk_create(attrs_to_create, ignore_conflicts=True)
+            if attrs_to_update:
+                CategoryAttribute.objects.bulk_update(attrs_to_update, ATTRIBUTE_SYNC_FIELDS)
+            if attrs_to_create:
+                # ignore_conflicts leaves pks unset, so read the ids back in one query
+                existing_ids = dict(CategoryAttribute.objects.filter(
+                    category_id__in=target_category_ids, key__in=parents_by_key.keys()
+                ).values_list('id', 'key'))
+            else:
+                existing_ids = {attr.id: attr.key for attr in child_attrs.values()}
+
+        child_values = {}
+        for value_obj in AttributeValue.objects.filter(
+            attribute_id__in=existing_ids.keys()
+        ).only('id', 'attribute_id', 'value', 'display_order'):
+            child_values[(value_obj.attribute_id, value_obj.value)] = value_obj
+
+        values_to_create = []
+        values_to_update = []
+        for attr_id, key in existing_ids.items():
+            for value, order in parent_values[key].items():
+                value_obj = child_values.get((attr_id, value))
+                if value_obj is None:
+                    values_to_create.append(AttributeValue(attribute_id=attr_id, value=value, display_order=order))
+                elif value_obj.display_order != order:
+                    value_obj.display_order = order
+                    values_to_update.append(value_obj)
+
+        stats['values_created'] += len(values_to_create)
+        stats['values_updated'] = len(values_to_update)
+
+        if not dry_run:
+            if values_to_create:
+                AttributeValue.objects.bulk_create(values_to_create, ignore_conflicts=True)
+            if values_to_update:
+                AttributeValue.objects.bulk_update(values_to_update, ['display_order'])
+
+    return stats
+
+
+def propagate_attributes(attribute_ids):
+    """Sync the given CategoryAttribute ids to the descendants of their categories"""
+    stats = _empty_stats()
+    attrs_by_category = {}
+    for attr in CategoryAttribute.objects.filter(id__in=attribute_ids):
+        attrs_by_category.setdefault(attr.category_id, []).append(attr)
+
+    for category_id, attrs in attrs_by_category.items():
+        descendant_ids = get_descendant_ids(category_id)
+        for name, count in sync_attributes(attrs, descendant_ids).items():
+            stats[name] += count
+    return stats
+
+
+def propagate_category_attributes(category_id, descendant_ids=None, dry_run=False):
+    """Sync every attribute defined on a category to all of its descendants"""
+    if descendant_ids is None:
+        descendant_ids = get_descendant_ids(category_id)
+    attrs = CategoryAttribute.objects.filter(category_id=category_id)
+    return sync_attributes(attrs, descendant_ids, dry_run=dry_run)
+
+
+def inherit_from_parent(category):
+    """Copy the parent's attributes and values onto a newly created category"""
+    attrs = CategoryAttribute.objects.filter(category_id=category.parent_id)
+    return sync_attributes(attrs, [category.id])
+
+
+def remove_value_from_descendants(category_id, key, value):
+    """Delete a value from the matching attribute on every descendant of a category"""
+    descendant_ids = get_descendant_ids(category_id)
+    if not descendant_ids:
+        return 0
+    with transaction.atomic(), _propagating():
+        deleted, _ = AttributeValue.objects.filter(
+            attribute__category_id__in=descendant_ids,
+            attribute__key=key,
+            value=value,
+        ).delete()
+    return deleted
+
+
+def _run_in_background(func, *args):
+    def _run():
+        try:
+            func(*args)
+        except Exception:
+            logger.exception('Category attribute propagation failed: %s%r', func.__name__, args)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=_run, daemon=True)
+    thread.start()
+
+
+def _flush_pending_attributes():
+    pending = getattr(_local, 'pending_attribute_ids', None)
+    if not pending:
+        return
+    attribute_ids = list(pending)
+    pending.clear()
+    _run_in_background(propagate_attributes, attribute_ids)
+
+
+def schedule_attribute_propagation(attribute_id):
+    """
+    Propagate an attribute to its category's descendants.
+
+    Runs immediately by default. With CATEGORY_ATTRIBUTE_PROPAGATION = 'deferred' the attribute
+    is queued and all attributes touched in the same transaction (e.g. an admin page saving an
+    attribute and its inline values) are synced together in a background thread after commit.
+    """
+    if not is_deferred():
+        propagate_attributes([attribute_id])
+        return
+
+    pending = getattr(_local, 'pending_attribute_ids', None)
+    if pending is None:
+        pending = _local.pending_attribute_ids = set()
+    pending.add(attribute_id)
+    transaction.on_commit(_flush_pending_attributes)
+
+
+def schedule_value_removal(category_id, key, value):
+    """Remove a deleted parent value from descendants, now or after commit depending on settings"""
+    if not is_deferred():
+        remove_value_from_descendants(category_id, key, value)
+        return
+    transaction.on_commit(lambda: _run_in_background(remove_value_from_descendants, category_id, key, value))
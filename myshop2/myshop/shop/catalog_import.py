@@ -0,0 +1,502 @@
+"""
+Catalog Import Pipeline
+Bulk-imports products (attributes, variants and images) from CSV or JSON files.
+
+Rows are validated and written in batches with bulk_create, images are hashed and
+compressed in a process pool, and progress is checkpointed after every committed
+batch so an interrupted import can be resumed.
+
+JSON input is a list of product objects (or {"products": [...]}):
+    {"sku": "W-100", "name": "...", "price_toman": 1250000, "category_id": 12,
+     "description": "...", "stock_quantity": 5,
+     "attributes": {"brand": "Casio"},
+     "variants": [{"sku": "W-100-RED", "price_toman": 1300000, "attributes": {"color": "red"}}],
+     "images": ["casio/w100-1.jpg", "casio/w100-2.jpg"]}
+
+CSV input uses one row per product with the same column names. Attribute columns are
+prefixed with "attr_" (attr_brand), images are separated by "|" and variants is a JSON list.
+"""
+import csv
+import json
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+
+from .models import (
+    ATTRIBUTE_DIGIT_MAP as DIGIT_MAP, Category, Product, ProductImage, ProductVariant,
+    normalize_attribute_value,
+)
+from .utils import process_image_path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 200
+MAX_REPORTED_ERRORS = 500
+JOB_CACHE_TIMEOUT = 60 * 60 * 24
+IMAGE_UPLOAD_DIR = 'product_images/'
+
+
+class CatalogImportError(Exception):
+    """Raised when the import file itself cannot be read"""
+
+
+# ----------------------------------------------------------------------------
+# Reading
+# ----------------------------------------------------------------------------
+
+def read_catalog(path, file_format=None):
+    """Read all product rows from a CSV or JSON file"""
+    file_format = (file_format or os.path.splitext(path)[1].lstrip('.')).lower()
+    try:
+        if file_format == 'json':
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                data = data.get('products', [])
+            if not isinstance(data, list):
+                raise CatalogImportError('JSON catalog must be a list of products')
+            return data
+        if file_format == 'csv':
+            with open(path, encoding='utf-8-sig', newline='') as f:
+                return [_csv_row_to_product(row) for row in csv.DictReader(f)]
+    except (OSError, ValueError) as e:
+        raise CatalogImportError(f'Could not read {path}: {e}')
+    raise CatalogImportError(f"Unsupported catalog format '{file_format}' (use csv or json)")
+
+
+def _csv_row_to_product(row):
+    product = {'attributes': {}}
+    for column, value in row.items():
+        if column is None:
+            continue
+        column = column.strip()
+        value = (value or '').strip()
+        if column.startswith('attr_'):
+            if value:
+                product['attributes'][column[len('attr_'):]] = value
+        elif column == 'images':
+            product['images'] = [p.strip() for p in value.split('|') if p.strip()]
+        elif column == 'variants':
+            product['variants'] = json.loads(value) if value else []
+        else:
+            product[column] = value
+    return product
+
+
+# ----------------------------------------------------------------------------
+# Validation
+# ----------------------------------------------------------------------------
+
+def _parse_decimal(value, field, errors, required=False):
+    if value is None or value == '':
+        if required:
+            errors.append(f'{field} is required')
+        return None
+    normalized = str(value).translate(DIGIT_MAP).replace(',', '').replace(' ', '').replace('\u200c', '')
+    try:
+        number = Decimal(normalized)
+    except InvalidOperation:
+        errors.append(f"{field} must be a number, got '{value}'")
+        return None
+    if number < 0:
+        errors.append(f'{field} must not be negative')
+        return None
+    return number
+
+
+def _parse_int(value, field, errors, default=0):
+    if value is None or value == '':
+        return default
+    try:
+        return int(str(value).translate(DIGIT_MAP))
+    except ValueError:
+        errors.append(f"{field} must be an integer, got '{value}'")
+        return default
+
+
+def _parse_bool(value, default=True):
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ['1', 'true', 'yes', 'on']
+
+
+class ImportContext:
+    """Lookups shared by all batches of one import run"""
+
+    def __init__(self, supplier=None, image_root=None, confine_images=False):
+        self.supplier = supplier
+        self.image_root = image_root
+        # Imports started over the API may only read images below image_root
+        self.confine_images = confine_images
+        self.categories_by_id = {}
+        self.categories_by_name = {}
+        for category in Category.objects.only('id', 'name'):
+            self.categories_by_id[category.id] = category
+            self.categories_by_name[category.name] = category
+        existing = Product.objects.filter(supplier=supplier).exclude(sku='')
+        self.existing_skus = set(existing.values_list('sku', flat=True))
+        self.seen_skus = set()
+
+    def resolve_category(self, row):
+        category_id = row.get('category_id')
+        if category_id not in (None, ''):
+            try:
+                return self.categories_by_id.get(int(str(category_id).translate(DIGIT_MAP)))
+            except ValueError:
+                return None
+        name = row.get('category')
+        return self.categories_by_name.get(name.strip()) if name else None
+
+    def resolve_image_path(self, path):
+        """Full path of an image, or None when a confined import points outside image_root"""
+        if self.confine_images:
+            root = os.path.realpath(self.image_root)
+            full_path = os.path.realpath(os.path.join(root, path))
+            return full_path if full_path.startswith(root + os.sep) else None
+        if self.image_root and not os.path.isabs(path):
+            return os.path.join(self.image_root, path)
+        return path
+
+
+def validate_row(index, row, context):
+    """Validate and clean one raw row. Returns (cleaned_row, errors, skipped)"""
+    errors = []
+    if not isinstance(row, dict):
+        return None, ['row must be an object'], False
+
+    sku = normalize_attribute_value(str(row.get('sku') or ''))
+    if not sku:
+        errors.append('sku is required')
+    elif sku in context.seen_skus:
+        errors.append(f"duplicate sku '{sku}' in file")
+    elif sku in context.existing_skus:
+        # Already imported (e.g. by an earlier, interrupted run)
+        return None, [], True
+
+    name = normalize_attribute_value(str(row.get('name') or ''))
+    if not name:
+        errors.append('name is required')
+    elif len(name) > Product._meta.get_field('name').max_length:
+        errors.append('name is too long')
+
+    category = context.resolve_category(row)
+    if category is None:
+        errors.append('category_id/category does not match an existing category')
+
+    price_toman = _parse_decimal(row.get('price_toman'), 'price_toman', errors, required=True)
+    cleaned = {
+        'index': index,
+        'sku': sku,
+        'name': name,
+        'category': category,
+        'price_toman': price_toman,
+        'price_usd': _parse_decimal(row.get('price_usd'), 'price_usd', errors),
+        'reduced_price_toman': _parse_decimal(row.get('reduced_price_toman'), 'reduced_price_toman', errors),
+        'description': row.get('description') or '',
+        'model': normalize_attribute_value(str(row.get('model') or '')),
+        'stock_quantity': _parse_int(row.get('stock_quantity'), 'stock_quantity', errors),
+        'is_active': _parse_bool(row.get('is_active')),
+        'attributes': {},
+        'variants': [],
+        'images': [],
+    }
+
+    attributes = row.get('attributes') or {}
+    if not isinstance(attributes, dict):
+        errors.append('attributes must be an object')
+    else:
+        cleaned['attributes'] = {str(k).strip(): normalize_attribute_value(str(v)) for k, v in attributes.items() if v not in (None, '')}
+
+    variants = row.get('variants') or []
+    if not isinstance(variants, list):
+        errors.append('variants must be a list')
+        variants = []
+    for position, variant in enumerate(variants):
+        if not isinstance(variant, dict) or not variant.get('sku'):
+            errors.append(f'variant {position} needs a sku')
+            continue
+        cleaned['variants'].append({
+            'sku': normalize_attribute_value(str(variant['sku'])),
+            'price_toman': _parse_decimal(variant.get('price_toman'), f'variant {position} price_toman', errors) or price_toman,
+            'stock_quantity': _parse_int(variant.get('stock_quantity'), f'variant {position} stock_quantity', errors),
+            'attributes': {str(k): normalize_attribute_value(str(v)) for k, v in (variant.get('attributes') or {}).items()},
+            'is_default': _parse_bool(variant.get('is_default'), default=False),
+            'is_active': _parse_bool(variant.get('is_active')),
+        })
+
+    images = row.get('images') or []
+    if isinstance(images, str):
+        images = [p.strip() for p in images.split('|') if p.strip()]
+    for path in images:
+        full_path = context.resolve_image_path(path)
+        if full_path is None:
+            errors.append(f"image outside the import directory: '{path}'")
+        elif not os.path.isfile(full_path):
+            errors.append(f"image not found: '{path}'")
+        else:
+            cleaned['images'].append(full_path)
+
+    if errors:
+        return None, errors, False
+    context.seen_skus.add(sku)
+    return cleaned, [], False
+
+
+# ----------------------------------------------------------------------------
+# Writing
+# ----------------------------------------------------------------------------
+
+def _process_images(rows, executor, max_size):
+    """Hash/compress every image of the batch (in the pool) and store the results.
+
+    Returns {(row index, position): (storage name, hash, placeholder)} and a list of per-image errors.
+    """
+    jobs = [(row['index'], position, path) for row in rows for position, path in enumerate(row['images'])]
+    if not jobs:
+        return {}, []
+
+    if executor is not None:
+        futures = [executor.submit(process_image_path, path, max_size) for _, _, path in jobs]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+    else:
+        results = []
+        for _, _, path in jobs:
+            try:
+                results.append(process_image_path(path, max_size))
+            except Exception as e:
+                results.append(e)
+
+    image_storage = ProductImage._meta.get_field('image').storage
+    stored, errors = {}, []
+    for (row_index, position, path), result in zip(jobs, results):
+        if isinstance(result, Exception):
+            errors.append({'row': row_index, 'errors': [f"image '{os.path.basename(path)}' failed: {result}"]})
+            continue
+        name = image_storage.save(IMAGE_UPLOAD_DIR + result['name'], ContentFile(result['content']))
+        stored[(row_index, position)] = (name, result['hash'], result.get('placeholder', ''))
+    return stored, errors
+
+
+def import_batch(rows, context, executor=None, max_image_size=1600):
+    """Write one batch of validated rows. Returns (created_count, image_count, warnings)"""
+    stored_images, warnings = _process_images(rows, executor, max_image_size)
+
+    with transaction.atomic():
+        products = []
+        for row in rows:
+            products.append(Product(
+                name=row['name'],
+                sku=row['sku'],
+                category=row['category'],
+                supplier=context.supplier,
+                description=row['description'],
+                model=row['model'],
+                price_toman=row['price_toman'],
+                price_usd=row['price_usd'],
+                reduced_price_toman=row['reduced_price_toman'],
+                stock_quantity=row['stock_quantity'],
+                is_active=row['is_active'],
+                # Keep the legacy price fields in sync the way Product.save() does
+                price=row['price_toman'],
+                price_currency='TOMAN',
+            ))
+        Product.objects.bulk_create(products, batch_size=DEFAULT_BATCH_SIZE)
+        products_by_index = {row['index']: product for row, product in zip(rows, products)}
+
+        outcomes = Product.bulk_set_attribute_values({
+            products_by_index[row['index']]: row['attributes'] for row in rows if row['attributes']
+        })
+        rows_by_product = {products_by_index[row['index']].pk: row for row in rows}
+        for outcome in outcomes:
+            if outcome['status'] == 'error':
+                row = rows_by_product[outcome['product_id']]
+                warnings.append({'row': row['index'], 'sku': row['sku'], 'errors': [f"{outcome['error']}, ignored"]})
+
+        variants = [
+            ProductVariant(product=products_by_index[row['index']], **variant)
+            for row in rows for variant in row['variants']
+        ]
+        ProductVariant.objects.bulk_create(variants, batch_size=DEFAULT_BATCH_SIZE)
+
+        images = []
+        for row in rows:
+            product = products_by_index[row['index']]
+            seen_hashes = set()
+            order = 0
+            for position in range(len(row['images'])):
+                stored = stored_images.get((row['index'], position))
+                if not stored:
+                    continue
+                # Same dedup rule as ProductImage.save(): one copy per product and hash
+                if stored[1] in seen_hashes:
+                    ProductImage._meta.get_field('image').storage.delete(stored[0])
+                    continue
+                seen_hashes.add(stored[1])
+                images.append(ProductImage(
+                    product=product, image=stored[0], image_hash=stored[1], placeholder=stored[2],
+                    is_primary=(order == 0), order=order,
+                ))
+                order += 1
+        ProductImage.objects.bulk_create(images, batch_size=DEFAULT_BATCH_SIZE)
+
+    context.existing_skus.update(row['sku'] for row in rows)
+    return len(products), len(images), warnings
+
+
+# ----------------------------------------------------------------------------
+# Checkpointing and driver
+# ----------------------------------------------------------------------------
+
+def load_checkpoint(checkpoint_path, source):
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('source') != os.path.abspath(source):
+        return None
+    return checkpoint
+
+
+def save_checkpoint(checkpoint_path, source, next_row, stats):
+    if not checkpoint_path:
+        return
+    tmp_path = checkpoint_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'source': os.path.abspath(source), 'next_row': next_row, 'stats': stats}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def run_catalog_import(path, supplier=None, file_format=None, batch_size=DEFAULT_BATCH_SIZE,
+                       workers=None, image_root=None, confine_images=False, checkpoint_path=None,
+                       resume=False, dry_run=False, max_image_size=1600, progress_callback=None):
+    """
+    Import a catalog file end to end.
+
+    Args:
+        path: CSV or JSON file
+        supplier: Supplier that owns the imported products (None for store products)
+        workers: size of the image process pool (0 processes images in-process)
+        image_root: base directory for relative image paths (defaults to the file's directory)
+        confine_images: reject image paths (absolute ones, '..') that leave image_root
+        checkpoint_path: JSON file updated after every committed batch
+        resume: continue from checkpoint_path instead of starting at the first row
+        dry_run: validate only; nothing is written
+        progress_callback: called with the stats dict after every batch
+
+    Returns:
+        dict: stats with total/processed/created/skipped/failed/images counts and errors
+    """
+    rows = read_catalog(path, file_format)
+    if image_root is None:
+        image_root = os.path.dirname(os.path.abspath(path))
+
+    stats = {'total': len(rows), 'processed': 0, 'created': 0, 'skipped': 0,
+             'failed': 0, 'images': 0, 'errors': [], 'dry_run': dry_run}
+    start = 0
+    if resume:
+        checkpoint = load_checkpoint(checkpoint_path, path)
+        if checkpoint:
+            start = checkpoint['next_row']
+            stats.update({k: v for k, v in checkpoint['stats'].items() if k in stats and k != 'total'})
+
+    context = ImportContext(supplier=supplier, image_root=image_root, confine_images=confine_images)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers != 0 and not dry_run else None
+
+    def record_errors(entries):
+        room = MAX_REPORTED_ERRORS - len(stats['errors'])
+        if room > 0:
+            stats['errors'].extend(entries[:room])
+
+    try:
+        for batch_start in range(start, len(rows), batch_size):
+            batch = rows[batch_start:batch_start + batch_size]
+            valid, batch_errors = [], []
+            for offset, raw in enumerate(batch):
+                index = batch_start + offset
+                cleaned, errors, skipped = validate_row(index, raw, context)
+                if skipped:
+                    stats['skipped'] += 1
+                elif errors:
+                    stats['failed'] += 1
+                    sku = raw.get('sku') if isinstance(raw, dict) else None
+                    batch_errors.append({'row': index, 'sku': sku, 'errors': errors})
+                else:
+                    valid.append(cleaned)
+            record_errors(batch_errors)
+
+            if valid and not dry_run:
+                created, images, warnings = import_batch(valid, context, executor, max_image_size)
+                stats['created'] += created
+                stats['images'] += images
+                record_errors(warnings)
+            elif dry_run:
+                stats['created'] += len(valid)
+
+            stats['processed'] = batch_start + len(batch)
+            if not dry_run:
+                save_checkpoint(checkpoint_path, path, stats['processed'], stats)
+            if progress_callback:
+                progress_callback(dict(stats))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    logger.info(
+        'Catalog import of %s finished: %s created, %s skipped, %s failed',
+        path, stats['created'], stats['skipped'], stats['failed'],
+    )
+    return stats
+
+
+# ----------------------------------------------------------------------------
+# Background jobs (admin endpoint)
+# ----------------------------------------------------------------------------
+
+def _job_cache_key(job_id):
+    return f'catalog_import_job_{job_id}'
+
+
+def get_catalog_import_job(job_id):
+    return cache.get(_job_cache_key(job_id))
+
+
+def start_catalog_import_job(path, **kwargs):
+    """
+    Run run_catalog_import in a background thread so the request returns immediately.
+    Progress is published to the cache and read back with get_catalog_import_job().
+    """
+    job_id = uuid.uuid4().hex
+    key = _job_cache_key(job_id)
+    cache.set(key, {'job_id': job_id, 'status': 'queued', 'stats': None}, JOB_CACHE_TIMEOUT)
+
+    def publish(status, stats=None, error=None):
+        cache.set(key, {'job_id': job_id, 'status': status, 'stats': stats, 'error': error}, JOB_CACHE_TIMEOUT)
+
+    def _run():
+        try:
+            publish('running')
+            stats = run_catalog_import(path, progress_callback=lambda st: publish('running', st), **kwargs)
+            publish('completed', stats)
+        except Exception as e:
+            logger.error(f'Catalog import job {job_id} failed: {e}')
+            publish('failed', error=str(e))
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=_run, daemon=True)
+    thread.start()
+    return job_id
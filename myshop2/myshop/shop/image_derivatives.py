@@ -0,0 +1,153 @@
+"""
+Responsive Image Derivatives
+Resized copies of product, variant and special-offer banner images at a fixed set of widths
+and formats. Derivatives are generated lazily the first time they are requested, stored next
+to the other media and then served straight from storage, so APIs can hand out srcset lists
+and clients download the smallest adequate size.
+"""
+import hashlib
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from PIL import Image, features
+
+from .utils import safe_open_image
+
+DEFAULT_WIDTHS = (160, 320, 640, 1280)
+DEFAULT_FORMATS = ('webp',)
+DERIVATIVE_DIR = 'derivatives'
+EXISTS_CACHE_TIMEOUT = 60 * 60 * 24
+
+FORMAT_OPTIONS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'avif': {'format': 'AVIF', 'quality': 60},
+    'jpg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+CONTENT_TYPES = {'webp': 'image/webp', 'avif': 'image/avif', 'jpg': 'image/jpeg'}
+
+
+class DerivativeError(Exception):
+    pass
+
+
+def _sources():
+    from .models import ProductImage, ProductVariantImage, SpecialOffer
+    return {
+        'product': (ProductImage, 'image'),
+        'variant': (ProductVariantImage, 'image'),
+        'offer': (SpecialOffer, 'banner_image'),
+    }
+
+
+def get_widths():
+    return tuple(sorted(getattr(settings, 'IMAGE_DERIVATIVE_WIDTHS', DEFAULT_WIDTHS)))
+
+
+def get_formats():
+    """Configured formats the installed Pillow can actually encode (AVIF needs libavif)"""
+    formats = []
+    for fmt in getattr(settings, 'IMAGE_DERIVATIVE_FORMATS', DEFAULT_FORMATS):
+        if fmt not in FORMAT_OPTIONS:
+            continue
+        if fmt in ('webp', 'avif') and not features.check(fmt):
+            continue
+        formats.append(fmt)
+    return formats
+
+
+def source_version(obj, field_name):
+    """Short token that changes whenever the source file is replaced"""
+    field_file = getattr(obj, field_name)
+    token = f"{field_file.name}:{getattr(obj, 'image_hash', '') or ''}"
+    return hashlib.sha1(token.encode('utf-8')).hexdigest()[:12]
+
+
+def derivative_name(kind, pk, version, width, fmt):
+    return f"{DERIVATIVE_DIR}/{kind}/{pk}/{version}/{width}.{fmt}"
+
+
+def render_derivative(field_file, width, fmt):
+    """Resize an image file to at most `width` pixels wide and encode it. Returns bytes."""
+    field_file.open('rb')
+    try:
+        img = safe_open_image(field_file, target_size=(width, None))
+        img.load()
+    finally:
+        field_file.close()
+
+    has_alpha = 'A' in img.getbands() or (img.mode == 'P' and 'transparency' in img.info)
+    target_mode = 'RGBA' if has_alpha and fmt != 'jpg' else 'RGB'
+    if img.mode != target_mode:
+        img = img.convert(target_mode)
+    if img.width > width:
+        img = img.resize((width, max(1, round(img.height * width / img.width))), Image.Resampling.LANCZOS)
+
+    output = BytesIO()
+    img.save(output, **FORMAT_OPTIONS[fmt])
+    return output.getvalue()
+
+
+def get_derivative(kind, pk, width, fmt, storage=None):
+    """
+    Return the storage name of a derivative, generating and storing it on first use.
+    Raises DerivativeError for unknown kinds, sizes, formats or missing sources.
+    """
+    sources = _sources()
+    if kind not in sources:
+        raise DerivativeError(f"Unknown image kind '{kind}'")
+    if width not in get_widths():
+        raise DerivativeError(f"Width {width} is not configured")
+    if fmt not in get_formats():
+        raise DerivativeError(f"Format '{fmt}' is not available")
+
+    model, field_name = sources[kind]
+    obj = model.objects.filter(pk=pk).first()
+    if obj is None or not getattr(obj, field_name):
+        raise DerivativeError(f"{model.__name__} {pk} has no image")
+
+    storage = storage or default_storage
+    name = derivative_name(kind, pk, source_version(obj, field_name), width, fmt)
+    cache_key = f"image_derivative:{name}"
+    if cache.get(cache_key) or storage.exists(name):
+        cache.set(cache_key, True, EXISTS_CACHE_TIMEOUT)
+        return name
+
+    try:
+        content = render_derivative(getattr(obj, field_name), width, fmt)
+    except Exception as e:
+        raise DerivativeError(f"Could not render {model.__name__} {pk}: {e}")
+    saved_name = storage.save(name, ContentFile(content))
+    if saved_name != name:
+        # Another request stored the same derivative first
+        storage.delete(saved_name)
+    cache.set(cache_key, True, EXISTS_CACHE_TIMEOUT)
+    return name
+
+
+def build_srcset(kind, obj, request=None, field_name='image'):
+    """
+    srcset payload for an image: {'srcset': '<url> 160w, ...', 'sources': [{'format', 'type', 'srcset'}]}.
+    URLs point at the lazy derivative endpoint, which redirects to the stored file.
+    """
+    if obj is None or not getattr(obj, field_name, None):
+        return {'srcset': '', 'sources': []}
+
+    version = source_version(obj, field_name)
+    sources = []
+    for fmt in get_formats():
+        entries = []
+        for width in get_widths():
+            url = reverse('shop:image_derivative', args=[kind, obj.pk, width, fmt]) + f"?v={version}"
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            entries.append(f"{url} {width}w")
+        sources.append({'format': fmt, 'type': CONTENT_TYPES[fmt], 'srcset': ', '.join(entries)})
+
+    # Plain srcset uses the most widely supported configured format
+    fallback = next((s for s in sources if s['format'] == 'webp'), sources[-1] if sources else None)
+    return {'srcset': fallback['srcset'] if fallback else '', 'sources': sources}
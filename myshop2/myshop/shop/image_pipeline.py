@@ -0,0 +1,94 @@
+"""
+Image Processing Pipeline
+Uploaded product and variant images are stored as originals with a 'pending' status and
+compressed to WebP after the upload transaction commits, in the shared process pool so the Pillow
+work neither blocks the request nor holds the GIL of the web worker.
+"""
+import logging
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from . import process_pool
+from .utils import process_image_bytes, process_image_path
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = 'pending'
+STATUS_PROCESSING = 'processing'
+STATUS_READY = 'ready'
+STATUS_FAILED = 'failed'
+
+DEFAULT_MAX_SIZE = 1600
+
+
+def is_enabled():
+    """True when new uploads should be compressed off-request"""
+    return getattr(settings, 'IMAGE_PROCESSING_ASYNC', False)
+
+
+def needs_processing(name):
+    return bool(name) and not name.lower().endswith('.webp')
+
+
+def schedule_image_processing(instance, max_size=DEFAULT_MAX_SIZE):
+    """Queue a saved ProductImage/ProductVariantImage for compression once the transaction commits"""
+    model, pk, name = type(instance), instance.pk, instance.image.name
+    transaction.on_commit(lambda: dispatch_image_processing(model, pk, name, max_size))
+
+
+def dispatch_image_processing(model, pk, name, max_size=DEFAULT_MAX_SIZE, wait=False):
+    """
+    Hand one stored original to the pool.
+    Local files are read by the worker process itself, remote storage is read here and passed as bytes.
+    """
+    storage = model._meta.get_field('image').storage
+    model.objects.filter(pk=pk).update(processing_status=STATUS_PROCESSING, processing_error='')
+
+    try:
+        try:
+            job = (process_image_path, storage.path(name), max_size)
+        except NotImplementedError:
+            with storage.open(name, 'rb') as f:
+                job = (process_image_bytes, f.read(), os.path.basename(name), max_size)
+    except Exception as e:
+        _mark_failed(model, pk, name, e)
+        return
+
+    process_pool.run_job(
+        job,
+        lambda result: _store_result(model, pk, name, result),
+        lambda error: _mark_failed(model, pk, name, error),
+        wait=wait,
+    )
+
+
+def _store_result(model, pk, name, result):
+    storage = model._meta.get_field('image').storage
+    placeholder = result.get('placeholder', '')
+    if result['name'] == os.path.basename(name):
+        model.objects.filter(pk=pk).update(processing_status=STATUS_READY, placeholder=placeholder)
+        return
+
+    new_name = storage.save(f"{os.path.dirname(name)}/{result['name']}", ContentFile(result['content']))
+    # Only swap the file if the row still points at the original we processed
+    updated = model.objects.filter(pk=pk, image=name).update(
+        image=new_name,
+        processing_status=STATUS_READY,
+        processing_error='',
+        placeholder=placeholder,
+    )
+    if updated:
+        storage.delete(name)
+    else:
+        storage.delete(new_name)
+
+
+def _mark_failed(model, pk, name, error):
+    logger.warning('Image processing failed for %s #%s (%s): %s', model.__name__, pk, name, error)
+    model.objects.filter(pk=pk, image=name).update(
+        processing_status=STATUS_FAILED,
+        processing_error=str(error)[:255],
+    )
@@ -0,0 +1,104 @@
+import time
+import tracemalloc
+from io import BytesIO
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image, ImageCms
+
+from shop.utils import compress_image, safe_open_image
+
+
+def _legacy_safe_open_image(image_path_or_file):
+    """The previous implementation: copy every pixel through a Python list to drop the ICC profile"""
+    img = Image.open(image_path_or_file)
+    if 'icc_profile' in img.info:
+        img_data = list(img.getdata())
+        new_img = Image.new(img.mode, img.size)
+        new_img.putdata(img_data)
+        return new_img
+    return img
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark safe_open_image/compress_image on a 12MP phone-style JPEG '
+        '(embedded ICC profile and EXIF orientation) against the old pixel-copy implementation'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Benchmark a real photo instead of a generated one')
+        parser.add_argument('--width', type=int, default=4032, help='Generated image width (default: 4032)')
+        parser.add_argument('--height', type=int, default=3024, help='Generated image height (default: 3024)')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per case, best time is reported (default: 3)')
+        parser.add_argument('--skip-legacy', action='store_true', help='Do not run the slow legacy implementation')
+
+    def handle(self, *args, **options):
+        if options['path']:
+            try:
+                with open(options['path'], 'rb') as f:
+                    data = f.read()
+            except OSError as e:
+                raise CommandError(str(e))
+            label = options['path']
+        else:
+            data = self.make_phone_photo(options['width'], options['height'])
+            label = f"generated {options['width']}x{options['height']} JPEG"
+        self.stdout.write(f"Benchmarking {label} ({len(data) / 1024 / 1024:.1f} MB), best of {options['repeat']}")
+
+        def open_full(module_func):
+            img = module_func(BytesIO(data))
+            img.load()
+            return img
+
+        def open_for_upload():
+            img = safe_open_image(BytesIO(data), target_size=(1600, 1600))
+            img.load()
+            return img
+
+        def compress():
+            upload = BytesIO(data)
+            upload.name = 'photo.jpg'
+            upload.size = len(data)
+            return compress_image(upload)
+
+        cases = []
+        if not options['skip_legacy']:
+            cases.append(('legacy getdata/putdata', lambda: open_full(_legacy_safe_open_image)))
+        cases += [
+            ('safe_open_image (full size)', lambda: open_full(safe_open_image)),
+            ('safe_open_image (draft for 1600px)', open_for_upload),
+            ('compress_image (end to end)', compress),
+        ]
+
+        for name, func in cases:
+            seconds, peak = self.measure(func, options['repeat'])
+            self.stdout.write(f"  {name:<38} {seconds * 1000:9.1f} ms   python peak {peak / 1024 / 1024:8.1f} MB")
+
+        self.stdout.write(self.style.SUCCESS('Done'))
+
+    def measure(self, func, repeat):
+        best = None
+        peak = 0
+        for _ in range(max(repeat, 1)):
+            tracemalloc.start()
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            best = elapsed if best is None else min(best, elapsed)
+        return best, peak
+
+    def make_phone_photo(self, width, height):
+        """Noisy gradient JPEG with an embedded ICC profile and EXIF orientation 6, like a portrait phone shot"""
+        gradient = Image.linear_gradient('L').resize((width, height))
+        noise = Image.effect_noise((width, height), 40)
+        img = Image.merge('RGB', (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        icc = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+
+        output = BytesIO()
+        img.save(output, format='JPEG', quality=90, exif=exif, icc_profile=icc)
+        return output.getvalue()
@@ -0,0 +1,73 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.models import ProductImage, ProductVariantImage
+from shop.perceptual_hash import regroup_near_duplicates
+
+
+class Command(BaseCommand):
+    help = (
+        'Compute perceptual hashes for product and variant images that do not have one yet, '
+        'and optionally rebuild the near-duplicate groups from a full pass over the catalog'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, help='Only hash this many images per model')
+        parser.add_argument(
+            '--regroup',
+            action='store_true',
+            help='Recompute perceptual_group for all images (merges groups split at upload time)',
+        )
+        parser.add_argument('--threshold', type=int, help='Hamming distance for --regroup (default: setting)')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without saving')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        hashed = failed = 0
+
+        for model in (ProductImage, ProductVariantImage):
+            queryset = model.objects.filter(perceptual_hash='').exclude(image='').order_by('pk')
+            if options.get('limit'):
+                queryset = queryset[:options['limit']]
+            if dry_run:
+                count = queryset.count()
+                hashed += count
+                self.stdout.write(f"{model.__name__}: {count} images need a perceptual hash")
+                continue
+
+            for image in queryset.iterator():
+                try:
+                    with image.image.open('rb'):
+                        image.assign_perceptual_hash()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(self.style.WARNING(f"{model.__name__} {image.pk}: {e}"))
+                    continue
+                if not image.perceptual_hash:
+                    failed += 1
+                    continue
+                # update() instead of save() so compression and duplicate checks do not rerun
+                model.objects.filter(pk=image.pk).update(
+                    perceptual_hash=image.perceptual_hash,
+                    phash_band0=image.phash_band0,
+                    phash_band1=image.phash_band1,
+                    phash_band2=image.phash_band2,
+                    phash_band3=image.phash_band3,
+                    perceptual_group=image.perceptual_group,
+                )
+                hashed += 1
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING(f"DRY RUN: {hashed} images would be hashed"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Hashed {hashed} images ({failed} failed)"))
+
+        if options['regroup']:
+            start = time.monotonic()
+            groups, images = regroup_near_duplicates(threshold=options.get('threshold'), dry_run=dry_run)
+            message = f"{groups} near-duplicate groups covering {images} images ({time.monotonic() - start:.1f}s)"
+            if dry_run:
+                self.stdout.write(self.style.WARNING(f"DRY RUN: {message}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"Regrouped: {message}"))
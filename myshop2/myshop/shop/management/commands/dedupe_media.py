@@ -0,0 +1,81 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop.models import ProductImage, ProductVariantImage
+from shop.storage import content_addressed_storage, is_content_addressed
+from shop.utils import hash_file
+
+
+class Command(BaseCommand):
+    help = (
+        'Move product and variant images stored under their upload names into content-addressed '
+        'storage, so identical files are kept once and reference counted'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, help='Only migrate this many rows')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Hash the files and report how much would be deduplicated',
+        )
+
+    def handle(self, *args, **options):
+        storage = content_addressed_storage()
+        backend = storage.backend
+        dry_run = options['dry_run']
+        limit = options.get('limit')
+
+        # Legacy names can be shared by several rows; only delete a file once nobody uses it
+        legacy_refs = defaultdict(int)
+        rows = []
+        for model in (ProductImage, ProductVariantImage):
+            for pk, name in model.objects.exclude(image='').values_list('pk', 'image'):
+                if name and not is_content_addressed(name):
+                    legacy_refs[name] += 1
+                    rows.append((model, pk, name))
+        if limit:
+            rows = rows[:limit]
+
+        migrated = missing = 0
+        seen_hashes = {}
+        duplicate_bytes = 0
+        for model, pk, name in rows:
+            if not backend.exists(name):
+                missing += 1
+                self.stderr.write(self.style.WARNING(f"{model.__name__} {pk}: file {name} is missing, skipped"))
+                continue
+
+            with backend.open(name, 'rb') as f:
+                if dry_run:
+                    digest = hash_file(f)
+                    size = backend.size(name)
+                    if digest in seen_hashes:
+                        duplicate_bytes += size
+                    seen_hashes[digest] = name
+                    migrated += 1
+                    continue
+
+                with transaction.atomic():
+                    new_name = storage.save(name, f)
+                    updated = model.objects.filter(pk=pk, image=name).update(image=new_name)
+                    if not updated:
+                        storage.delete(new_name)
+                        continue
+
+            migrated += 1
+            legacy_refs[name] -= 1
+            if legacy_refs[name] == 0:
+                backend.delete(name)
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING(
+                f"DRY RUN: {migrated} files would be migrated into {len(seen_hashes)} unique blobs, "
+                f"saving {duplicate_bytes / 1024 / 1024:.1f} MB ({missing} missing)"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Migrated {migrated} images into content-addressed storage ({missing} missing)"
+            ))
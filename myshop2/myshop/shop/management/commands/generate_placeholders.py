@@ -0,0 +1,99 @@
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+
+from shop.models import ProductImage, ProductVariantImage, SpecialOffer
+from shop.utils import make_placeholder
+
+BATCH_SIZE = 200
+
+
+def _placeholder(source):
+    """Worker: placeholder from a local path or the file bytes"""
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    return make_placeholder(source)
+
+
+def _source(field_file):
+    """Local path when the storage has one, so workers read the file themselves"""
+    try:
+        return field_file.path
+    except NotImplementedError:
+        with field_file.open('rb') as f:
+            return f.read()
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate the tiny inline placeholders shown while product, variant and special offer '
+        'banner images load, for rows that do not have one yet'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, help='Only process this many rows per model')
+        parser.add_argument('--workers', type=int, default=2, help='Worker processes (0 runs inline)')
+        parser.add_argument('--force', action='store_true', help='Regenerate existing placeholders too')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without saving')
+
+    def handle(self, *args, **options):
+        targets = (
+            (ProductImage, 'image', 'placeholder'),
+            (ProductVariantImage, 'image', 'placeholder'),
+            (SpecialOffer, 'banner_image', 'banner_placeholder'),
+        )
+        executor = ProcessPoolExecutor(max_workers=options['workers']) if options['workers'] > 0 else None
+        generated = failed = 0
+
+        try:
+            for model, image_field, placeholder_field in targets:
+                queryset = model.objects.exclude(**{image_field: ''}).exclude(**{f'{image_field}__isnull': True})
+                if not options['force']:
+                    queryset = queryset.filter(**{placeholder_field: ''})
+                queryset = queryset.order_by('pk').only('pk', image_field)
+                if options.get('limit'):
+                    queryset = queryset[:options['limit']]
+                if options['dry_run']:
+                    count = queryset.count()
+                    generated += count
+                    self.stdout.write(f"{model.__name__}: {count} placeholders to generate")
+                    continue
+
+                pending = []
+                for obj in queryset.iterator():
+                    try:
+                        source = _source(getattr(obj, image_field))
+                    except Exception as e:
+                        failed += 1
+                        self.stderr.write(self.style.WARNING(f"{model.__name__} {obj.pk}: {e}"))
+                        continue
+                    pending.append((obj.pk, executor.submit(_placeholder, source) if executor else source))
+                    # Bounded batches keep file bytes from remote storage out of memory
+                    if len(pending) >= BATCH_SIZE:
+                        done, errors = self._store(model, placeholder_field, pending, executor)
+                        generated, failed, pending = generated + done, failed + errors, []
+                done, errors = self._store(model, placeholder_field, pending, executor)
+                generated, failed = generated + done, failed + errors
+        finally:
+            if executor:
+                executor.shutdown()
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f"DRY RUN: {generated} placeholders would be generated"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Generated {generated} placeholders ({failed} failed)"))
+
+    def _store(self, model, placeholder_field, pending, executor):
+        generated = failed = 0
+        for pk, job in pending:
+            try:
+                value = job.result() if executor else _placeholder(job)
+            except Exception as e:
+                failed += 1
+                self.stderr.write(self.style.WARNING(f"{model.__name__} {pk}: {e}"))
+                continue
+            # update() instead of save() so compression and hashing do not rerun
+            model.objects.filter(pk=pk).update(**{placeholder_field: value})
+            generated += 1
+        return generated, failed
@@ -0,0 +1,103 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.catalog_import import CatalogImportError, DEFAULT_BATCH_SIZE, run_catalog_import
+from suppliers.models import Supplier
+
+
+class Command(BaseCommand):
+    help = 'Bulk-import products, attributes, variants and images from a CSV or JSON catalog file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path to the CSV or JSON catalog file')
+        parser.add_argument(
+            '--format',
+            dest='file_format',
+            choices=['csv', 'json'],
+            help='File format (defaults to the file extension)',
+        )
+        parser.add_argument(
+            '--supplier-id',
+            type=int,
+            help='Supplier that owns the imported products',
+        )
+        parser.add_argument(
+            '--image-root',
+            help='Base directory for relative image paths (defaults to the catalog file directory)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help=f'Rows validated and written per transaction (default: {DEFAULT_BATCH_SIZE})',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Image processing processes (default: CPU count, 0 = process images in-process)',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='Checkpoint file (default: <path>.checkpoint.json)',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Continue from the last committed batch recorded in the checkpoint file',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Validate the file without writing anything',
+        )
+
+    def handle(self, *args, **options):
+        supplier = None
+        if options['supplier_id']:
+            try:
+                supplier = Supplier.objects.get(id=options['supplier_id'])
+            except Supplier.DoesNotExist:
+                raise CommandError(f"Supplier with id {options['supplier_id']} does not exist.")
+
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+
+        checkpoint = options['checkpoint'] or f"{options['path']}.checkpoint.json"
+
+        def report(stats):
+            self.stdout.write(
+                f"{stats['processed']}/{stats['total']} rows - "
+                f"created: {stats['created']}, skipped: {stats['skipped']}, "
+                f"failed: {stats['failed']}, images: {stats['images']}"
+            )
+
+        try:
+            stats = run_catalog_import(
+                options['path'],
+                supplier=supplier,
+                file_format=options['file_format'],
+                batch_size=options['batch_size'],
+                workers=options['workers'],
+                image_root=options['image_root'],
+                checkpoint_path=checkpoint,
+                resume=options['resume'],
+                dry_run=options['dry_run'],
+                progress_callback=report,
+            )
+        except CatalogImportError as e:
+            raise CommandError(str(e))
+
+        for error in stats['errors']:
+            sku = f" (sku {error['sku']})" if error.get('sku') else ''
+            self.stderr.write(self.style.WARNING(f"Row {error['row']}{sku}: {'; '.join(error['errors'])}"))
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(
+                f"DRY RUN: {stats['created']} products valid, {stats['failed']} invalid, "
+                f"{stats['skipped']} already imported"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Imported {stats['created']} products with {stats['images']} images "
+                f"({stats['skipped']} already imported, {stats['failed']} failed)"
+            ))
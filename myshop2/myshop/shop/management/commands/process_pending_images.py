@@ -0,0 +1,59 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from shop import image_pipeline
+from shop.models import ProductImage, ProductVariantImage
+
+
+class Command(BaseCommand):
+    help = (
+        'Compress product and variant images left pending by the async pipeline '
+        '(e.g. after a server restart), optionally retrying failed ones'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retry-failed',
+            action='store_true',
+            help='Also reprocess images whose processing failed',
+        )
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=10,
+            help='Only pick up images uploaded at least this many minutes ago (default: 10)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='List the images that would be processed',
+        )
+
+    def handle(self, *args, **options):
+        statuses = [image_pipeline.STATUS_PENDING, image_pipeline.STATUS_PROCESSING]
+        if options['retry_failed']:
+            statuses.append(image_pipeline.STATUS_FAILED)
+        cutoff = timezone.now() - timedelta(minutes=options['min_age'])
+
+        processed = 0
+        for model in (ProductImage, ProductVariantImage):
+            images = model.objects.filter(processing_status__in=statuses, created_at__lte=cutoff)
+            for pk, name in images.values_list('pk', 'image'):
+                if options['dry_run']:
+                    self.stdout.write(f"[DRY RUN] Would process {model.__name__} {pk}: {name}")
+                else:
+                    image_pipeline.dispatch_image_processing(model, pk, name, wait=True)
+                processed += 1
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f"DRY RUN: {processed} images would be processed"))
+        else:
+            failed = sum(
+                model.objects.filter(processing_status=image_pipeline.STATUS_FAILED).count()
+                for model in (ProductImage, ProductVariantImage)
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f"Processed {processed} images ({failed} images currently marked as failed)"
+            ))
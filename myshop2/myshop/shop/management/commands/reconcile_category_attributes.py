@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.attribute_propagation import get_descendant_ids, propagate_category_attributes
+from shop.models import Category, CategoryAttribute
+
+
+class Command(BaseCommand):
+    help = (
+        'Re-sync inherited category attributes and values from every category to its descendants, '
+        'repairing drift left by failed or deferred propagation (additive, extra child values are kept)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--category', type=int, help='Only reconcile this category and its subtree')
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without changing anything')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+
+        # Load the whole tree once and walk it top-down, so that a category's own values have
+        # been repaired before they are pushed further down.
+        children_map = {}
+        roots = []
+        for category_id, parent_id in Category.objects.values_list('id', 'parent_id'):
+            if parent_id is None:
+                roots.append(category_id)
+            else:
+                children_map.setdefault(parent_id, []).append(category_id)
+
+        if options.get('category'):
+            if not Category.objects.filter(id=options['category']).exists():
+                raise CommandError(f"Category with id {options['category']} does not exist.")
+            roots = [options['category']]
+
+        with_attributes = set(CategoryAttribute.objects.values_list('category_id', flat=True).distinct())
+
+        totals = {}
+        processed = 0
+        visited = set()
+        queue = list(roots)
+        while queue:
+            category_id = queue.pop(0)
+            if category_id in visited:
+                continue
+            visited.add(category_id)
+            queue.extend(children_map.get(category_id, ()))
+            if category_id not in with_attributes:
+                continue
+
+            descendant_ids = get_descendant_ids(category_id, children_map=children_map)
+            if not descendant_ids:
+                continue
+
+            stats = propagate_category_attributes(category_id, descendant_ids=descendant_ids, dry_run=dry_run)
+            processed += 1
+            for name, count in stats.items():
+                totals[name] = totals.get(name, 0) + count
+            if any(stats.values()):
+                self.stdout.write(
+                    f"Category {category_id}: "
+                    f"{stats['attributes_created']} attributes missing, {stats['attributes_updated']} drifted, "
+                    f"{stats['values_created']} values missing, {stats['values_updated']} reordered"
+                )
+
+        summary = (
+            f"{processed} categories checked - "
+            f"attributes created: {totals.get('attributes_created', 0)}, "
+            f"updated: {totals.get('attributes_updated', 0)}, "
+            f"values created: {totals.get('values_created', 0)}, "
+            f"reordered: {totals.get('values_updated', 0)}"
+        )
+        if dry_run:
+            self.stdout.write(self.style.WARNING(f"DRY RUN: {summary}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Reconciled {summary}"))
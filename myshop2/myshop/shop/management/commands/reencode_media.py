@@ -0,0 +1,219 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+
+from image_editor.models import EditedImage
+from shop.image_pipeline import DEFAULT_MAX_SIZE
+from shop.models import ProductImage, ProductVariantImage, SpecialOffer
+from shop.utils import process_image_bytes, process_image_path
+
+# Editor files are the source of every later render, so they keep their full resolution
+FULL_RESOLUTION = 10000
+
+# (checkpoint key, model, image field, max size, {model field: result key} updated with the file)
+TARGETS = (
+    ('product', ProductImage, 'image', DEFAULT_MAX_SIZE, {'image_hash': 'hash', 'placeholder': 'placeholder'}),
+    ('variant', ProductVariantImage, 'image', DEFAULT_MAX_SIZE, {'image_hash': 'hash', 'placeholder': 'placeholder'}),
+    ('offer', SpecialOffer, 'banner_image', DEFAULT_MAX_SIZE, {'banner_placeholder': 'placeholder'}),
+    ('editor_original', EditedImage, 'original_image', FULL_RESOLUTION, {}),
+    ('editor_render', EditedImage, 'edited_image', FULL_RESOLUTION, {}),
+)
+
+
+def _job(storage, name, max_size):
+    """Pool arguments for one file: workers read local files themselves, remote ones get the bytes"""
+    try:
+        return process_image_path, storage.path(name), max_size
+    except NotImplementedError:
+        with storage.open(name, 'rb') as f:
+            return process_image_bytes, f.read(), os.path.basename(name), max_size
+
+
+class Command(BaseCommand):
+    help = (
+        'Re-encode product, variant, special offer and image editor files that predate WebP '
+        'compression to the current WebP profile, in a process pool, resumable from a checkpoint'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=getattr(settings, 'IMAGE_PROCESSING_WORKERS', 2),
+            help='Worker processes (0 re-encodes inline; default: IMAGE_PROCESSING_WORKERS)',
+        )
+        parser.add_argument('--batch-size', type=int, default=50, help='Files handed to the pool at a time')
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help='Seconds to pause between batches, to throttle the load beside production traffic',
+        )
+        parser.add_argument('--limit', type=int, help='Stop after this many files')
+        parser.add_argument(
+            '--only',
+            choices=[target[0] for target in TARGETS],
+            action='append',
+            help='Only process these kinds of files (repeatable)',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default='reencode_media.checkpoint.json',
+            help='File recording the last processed id per kind, so an interrupted run resumes',
+        )
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start over')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count the eligible files and project the size after re-encoding from a sample',
+        )
+        parser.add_argument('--sample', type=int, default=20, help='Files per kind re-encoded for --dry-run')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        targets = [t for t in TARGETS if not options['only'] or t[0] in options['only']]
+        workers = options['workers']
+        self.executor = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+        try:
+            if options['dry_run']:
+                self.project(targets, options)
+            else:
+                self.reencode(targets, options)
+        finally:
+            if self.executor:
+                self.executor.shutdown()
+
+    def eligible(self, model, field, after=0):
+        """(pk, name) rows of files not stored as WebP yet, in id order"""
+        return (
+            model.objects.filter(pk__gt=after)
+            .exclude(**{field: ''})
+            .exclude(**{f'{field}__isnull': True})
+            .exclude(**{f'{field}__iendswith': '.webp'})
+            .order_by('pk')
+            .values_list('pk', field)
+        )
+
+    def run_batch(self, storage, batch, max_size):
+        """Re-encode a batch; yields (pk, name, original size, result or exception) in batch order"""
+        pending = []
+        for pk, name in batch:
+            try:
+                size = storage.size(name)
+                job = _job(storage, name, max_size)
+                pending.append((pk, name, size, self.executor.submit(*job) if self.executor else job))
+            except Exception as e:
+                yield pk, name, 0, e
+        for pk, name, size, job in pending:
+            try:
+                result = job.result() if self.executor else job[0](*job[1:])
+            except Exception as e:
+                result = e
+            yield pk, name, size, result
+
+    def reencode(self, targets, options):
+        path = options['checkpoint']
+        checkpoint = {}
+        if not options['restart'] and os.path.exists(path):
+            with open(path) as f:
+                checkpoint = json.load(f)
+            self.stdout.write(f"Resuming from {path}: {checkpoint}")
+
+        remaining = options.get('limit')
+        replaced = kept = failed = 0
+        bytes_before = bytes_after = 0
+        for key, model, field, max_size, extra in targets:
+            storage = model._meta.get_field(field).storage
+            last_pk = checkpoint.get(key, 0)
+            while remaining is None or remaining > 0:
+                size = options['batch_size'] if remaining is None else min(options['batch_size'], remaining)
+                # Keyset pages instead of one open cursor, since rows are updated as we go
+                batch = list(self.eligible(model, field, after=last_pk)[:size])
+                if not batch:
+                    break
+                last_pk = batch[-1][0]
+
+                for pk, name, original_size, result in self.run_batch(storage, batch, max_size):
+                    if isinstance(result, Exception):
+                        failed += 1
+                        self.stderr.write(self.style.WARNING(f"{model.__name__} {pk} ({name}): {result}"))
+                        continue
+                    # Keep the original when the profile does not make it smaller (e.g. tiny PNG icons)
+                    if result['name'] == os.path.basename(name) or len(result['content']) >= original_size:
+                        kept += 1
+                        continue
+                    if self.replace(model, field, storage, pk, name, result, extra):
+                        replaced += 1
+                        bytes_before += original_size
+                        bytes_after += len(result['content'])
+
+                if remaining is not None:
+                    remaining -= len(batch)
+                checkpoint[key] = last_pk
+                with open(path, 'w') as f:
+                    json.dump(checkpoint, f)
+                self.stdout.write(f"{model.__name__}.{field}: up to id {last_pk}, {replaced} re-encoded so far")
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+
+        if remaining is None and os.path.exists(path):
+            # Everything was processed; the next run starts from the beginning again
+            os.remove(path)
+        saved = (bytes_before - bytes_after) / 1024 / 1024
+        self.stdout.write(self.style.SUCCESS(
+            f"Re-encoded {replaced} files, saving {saved:.1f} MB "
+            f"({kept} kept because WebP was not smaller, {failed} failed)"
+        ))
+
+    def replace(self, model, field, storage, pk, name, result, extra):
+        new_name = storage.save(f"{os.path.dirname(name)}/{result['name']}", ContentFile(result['content']))
+        updates = {model_field: result[key] for model_field, key in extra.items() if result.get(key)}
+        # Only swap the file if the row still points at the one we re-encoded
+        if model.objects.filter(pk=pk, **{field: name}).update(**{field: new_name}, **updates):
+            storage.delete(name)
+            return True
+        storage.delete(new_name)
+        return False
+
+    def project(self, targets, options):
+        total_files = total_before = total_after = 0
+        for key, model, field, max_size, _ in targets:
+            storage = model._meta.get_field(field).storage
+            files = before = sample_before = sample_after = 0
+            sample = []
+            for pk, name in self.eligible(model, field).iterator(chunk_size=2000):
+                try:
+                    size = storage.size(name)
+                except Exception:
+                    continue
+                files += 1
+                before += size
+                if len(sample) < options['sample']:
+                    sample.append((pk, name))
+
+            for pk, name, size, result in self.run_batch(storage, sample, max_size):
+                if isinstance(result, Exception) or not size:
+                    continue
+                sample_before += size
+                sample_after += min(size, len(result['content']))
+
+            ratio = sample_after / sample_before if sample_before else 1.0
+            after = int(before * ratio)
+            total_files += files
+            total_before += before
+            total_after += after
+            self.stdout.write(
+                f"{key}: {files} files, {before / 1024 / 1024:.1f} MB -> ~{after / 1024 / 1024:.1f} MB "
+                f"(ratio {ratio:.2f} from {len(sample)} samples)"
+            )
+
+        self.stdout.write(self.style.WARNING(
+            f"DRY RUN: {total_files} files would be re-encoded, "
+            f"{total_before / 1024 / 1024:.1f} MB -> ~{total_after / 1024 / 1024:.1f} MB"
+        ))
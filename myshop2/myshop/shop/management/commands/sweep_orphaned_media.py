@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.media_sweep import DEFAULT_GRACE_HOURS, QUARANTINE_DIR, SORT_CHUNK_SIZE, sweep_orphans
+
+
+class Command(BaseCommand):
+    help = (
+        'Find media files no model, media blob, derivative or tile pyramid references any more '
+        f'and move them under {QUARANTINE_DIR}/ (or delete them)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-hours',
+            type=float,
+            default=DEFAULT_GRACE_HOURS,
+            help=f'Leave files modified within this many hours alone (default: {DEFAULT_GRACE_HOURS})',
+        )
+        parser.add_argument(
+            '--prefix',
+            action='append',
+            dest='prefixes',
+            help='Only sweep this directory of the storage (repeatable, default: everything)',
+        )
+        parser.add_argument('--delete', action='store_true', help='Delete orphans instead of quarantining them')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=SORT_CHUNK_SIZE,
+            help='Names sorted in memory at a time before spilling to a temporary file',
+        )
+        parser.add_argument('--verbose-files', action='store_true', help='Print every orphaned file')
+        parser.add_argument('--dry-run', action='store_true', help='Report the orphaned files without touching them')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            action = 'report'
+        else:
+            action = 'delete' if options['delete'] else 'quarantine'
+
+        def on_file(name, size):
+            if options['verbose_files']:
+                self.stdout.write(f"{name} ({size} bytes)")
+
+        try:
+            stats = sweep_orphans(
+                grace_hours=options['grace_hours'],
+                action=action,
+                prefixes=[p.strip('/') for p in options['prefixes']] if options['prefixes'] else ('',),
+                chunk_size=options['chunk_size'],
+                on_file=on_file,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        summary = (
+            f"{stats['orphans']} orphaned files ({stats['bytes'] / 1024 / 1024:.1f} MB), "
+            f"{stats['recent']} within the grace period, {stats['failed']} failed"
+        )
+        if action == 'report':
+            self.stdout.write(self.style.WARNING(f"DRY RUN: {summary}"))
+        elif action == 'delete':
+            self.stdout.write(self.style.SUCCESS(f"Deleted {summary}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Quarantined under {QUARANTINE_DIR}/: {summary}"))
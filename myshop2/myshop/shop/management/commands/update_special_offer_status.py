@@ -1,10 +1,18 @@
+import time
+from datetime import timedelta
+
 from django.core.management.base import BaseCommand
+from django.db import close_old_connections
 from django.utils import timezone
-from shop.models import Product, SpecialOfferProduct
+
+from shop.special_offers import next_offer_boundary, refresh_special_offer_flags
 
 
 class Command(BaseCommand):
-    help = 'Update is_in_special_offers status for all products based on current active offers'
+    help = (
+        'Update is_in_special_offers status for all products based on current active offers. '
+        'With --watch, keep running and refresh again at every offer start/end.'
+    )
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -12,54 +20,48 @@ class Command(BaseCommand):
             action='store_true',
             help='Show what would be updated without making changes',
         )
+        parser.add_argument(
+            '--watch',
+            action='store_true',
+            help='Run as a scheduler: sleep until the next offer boundary, then refresh',
+        )
+        parser.add_argument(
+            '--max-sleep',
+            type=int,
+            default=300,
+            help='With --watch, re-check at least this often in seconds to pick up edited offers (default: 300)',
+        )
 
     def handle(self, *args, **options):
-        dry_run = options['dry_run']
+        if not options['watch']:
+            self.refresh(options['dry_run'])
+            return
+
+        max_sleep = max(options['max_sleep'], 1)
+        self.stdout.write(f"Watching special offers (re-checking at least every {max_sleep}s)")
+        while True:
+            close_old_connections()
+            self.refresh(options['dry_run'])
+
+            now = timezone.now()
+            boundary = next_offer_boundary(now)
+            delay = max_sleep
+            if boundary is not None:
+                # valid_until is inclusive, so wake just after the boundary
+                delay = min(delay, (boundary - now + timedelta(seconds=1)).total_seconds())
+                self.stdout.write(f"Next offer boundary at {boundary}")
+            time.sleep(max(delay, 0))
+
+    def refresh(self, dry_run):
         now = timezone.now()
-        
-        self.stdout.write(f"Checking all products for special offer status at {now}")
-        
-        total_products = 0
-        updated_products = 0
-        
-        for product in Product.objects.all():
-            total_products += 1
-            
-            # Check if product has any active special offers
-            has_active_offers = SpecialOfferProduct.objects.filter(
-                product=product,
-                offer__enabled=True,
-                offer__is_active=True,
-                offer__valid_from__lte=now,
-                offer__valid_until__gte=now
-            ).exists()
-            
-            # Check if update is needed
-            if product.is_in_special_offers != has_active_offers:
-                if dry_run:
-                    self.stdout.write(
-                        f"[DRY RUN] Would update {product.name} (ID: {product.id}): "
-                        f"{product.is_in_special_offers} -> {has_active_offers}"
-                    )
-                else:
-                    old_status = product.is_in_special_offers
-                    product.is_in_special_offers = has_active_offers
-                    product.save(update_fields=['is_in_special_offers'])
-                    self.stdout.write(
-                        f"Updated {product.name} (ID: {product.id}): {old_status} -> {has_active_offers}"
-                    )
-                
-                updated_products += 1
-        
+        turned_on, turned_off = refresh_special_offer_flags(now=now, dry_run=dry_run)
+
         if dry_run:
-            self.stdout.write(
-                self.style.WARNING(
-                    f"DRY RUN: Would update {updated_products} out of {total_products} products"
-                )
-            )
+            self.stdout.write(self.style.WARNING(
+                f"DRY RUN at {now}: would add {turned_on} products to and remove "
+                f"{turned_off} products from special offers"
+            ))
         else:
-            self.stdout.write(
-                self.style.SUCCESS(
-                    f"Successfully updated {updated_products} out of {total_products} products"
-                )
-            )
+            self.stdout.write(self.style.SUCCESS(
+                f"Special offer status at {now}: {turned_on} products added, {turned_off} removed"
+            ))
@@ -0,0 +1,191 @@
+"""
+Orphaned Media Sweeper
+Mark-and-sweep over the media storage: every file name referenced by a FileField/ImageField,
+a MediaBlob, a derivative source or a tile pyramid is marked, the storage is listed, and files
+nobody references that are older than a grace period are quarantined or deleted.
+
+Both sides are external-sorted (sorted chunks spilled to temporary files and merged with heapq)
+and then walked together once, so memory stays bounded by the chunk size however many
+millions of files the storage holds.
+
+Files under generated directories are matched by the directory that identifies their source:
+    derivatives/<kind>/<pk>/<version>/<width>.<fmt>   -> derivatives/<kind>/<pk>/<version>
+    interactive_tiles/<id>/<version>/<level>/...      -> interactive_tiles/<id>/<version>
+    interactive_tiles/<id>/<version>.dzi              -> interactive_tiles/<id>/<version>
+"""
+import heapq
+import tempfile
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.db import models
+from django.utils import timezone
+
+from image_editor import tiles
+from image_editor.tiles import TILES_DIR
+
+from .image_derivatives import DERIVATIVE_DIR, _sources as derivative_sources, source_version
+
+QUARANTINE_DIR = 'quarantine'
+SORT_CHUNK_SIZE = 200000
+DEFAULT_GRACE_HOURS = 24
+
+
+def reference_key(name):
+    """The name a stored file is marked by (its source directory for generated files)"""
+    parts = name.split('/')
+    if parts[0] == DERIVATIVE_DIR and len(parts) >= 5:
+        return '/'.join(parts[:4])
+    if parts[0] == TILES_DIR:
+        if len(parts) >= 4:
+            return '/'.join(parts[:3])
+        if len(parts) == 3 and parts[2].endswith('.dzi'):
+            return f"{TILES_DIR}/{parts[1]}/{parts[2][:-len('.dzi')]}"
+    return name
+
+
+def _file_fields():
+    for model in apps.get_models():
+        if model._meta.proxy or not model._meta.managed:
+            continue
+        for field in model._meta.concrete_fields:
+            if isinstance(field, models.FileField):
+                yield model, field.name
+
+
+def referenced_names():
+    """Every marked name, unsorted and possibly repeated; streamed from the database"""
+    from image_editor.models import InteractiveImage
+    from .models import MediaBlob
+
+    for model, field_name in _file_fields():
+        rows = model._default_manager.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+        yield from rows.values_list(field_name, flat=True).iterator(chunk_size=5000)
+
+    # A blob with references is in use even if the rows pointing at it are being saved right now
+    yield from MediaBlob.objects.filter(ref_count__gt=0).values_list('name', flat=True).iterator(chunk_size=5000)
+
+    for kind, (model, field_name) in derivative_sources().items():
+        fields = ['pk', field_name] + (['image_hash'] if hasattr(model, 'image_hash') else [])
+        for obj in model.objects.exclude(**{field_name: ''}).only(*fields).iterator(chunk_size=5000):
+            if getattr(obj, field_name):
+                yield f"{DERIVATIVE_DIR}/{kind}/{obj.pk}/{source_version(obj, field_name)}"
+
+    for obj in InteractiveImage.objects.exclude(image='').only('pk', 'image', 'tiles_version').iterator(chunk_size=5000):
+        if obj.tiles_version:
+            yield tiles.tiles_prefix(obj.pk, obj.tiles_version)
+        # Tiles of a new upload are written before tiles_version is published
+        yield tiles.tiles_prefix(obj.pk, tiles.source_version(obj))
+
+
+def list_storage(storage, path=''):
+    """Every file name under `path`, walking directories one listing at a time"""
+    try:
+        directories, files = storage.listdir(path)
+    except FileNotFoundError:
+        return
+    for name in files:
+        yield f"{path}/{name}" if path else name
+    for directory in directories:
+        sub_path = f"{path}/{directory}" if path else directory
+        if sub_path == QUARANTINE_DIR:
+            continue
+        yield from list_storage(storage, sub_path)
+
+
+def _spill(chunk):
+    spill = tempfile.TemporaryFile(mode='w+', encoding='utf-8')
+    for line in sorted(chunk):
+        spill.write(line + '\n')
+    spill.seek(0)
+    return spill
+
+
+def external_sort(lines, chunk_size=SORT_CHUNK_SIZE):
+    """Sorted, de-duplicated stream of `lines` (strings without newlines) in bounded memory"""
+    spills = []
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            spills.append(_spill(chunk))
+            chunk = []
+    try:
+        if spills:
+            spills.append(_spill(chunk))
+            stream = heapq.merge(*((line.rstrip('\n') for line in spill) for spill in spills))
+        else:
+            stream = iter(sorted(chunk))
+        previous = None
+        for line in stream:
+            if line != previous:
+                yield line
+                previous = line
+    finally:
+        for spill in spills:
+            spill.close()
+
+
+def find_orphans(storage=None, prefixes=('',), chunk_size=SORT_CHUNK_SIZE):
+    """
+    Yield (name, key) for stored files whose reference key nobody marked, in key order.
+    `prefixes` limits the listing to some directories.
+    """
+    storage = storage or default_storage
+    references = external_sort(referenced_names(), chunk_size)
+    listed = external_sort(
+        (f"{reference_key(name)}\t{name}" for prefix in prefixes for name in list_storage(storage, prefix)),
+        chunk_size,
+    )
+
+    reference = next(references, None)
+    if reference is None:
+        # An empty mark phase means a wrong database, not an empty catalog
+        raise ValueError('No referenced media found, refusing to sweep')
+    for line in listed:
+        key, name = line.split('\t', 1)
+        while reference is not None and reference < key:
+            reference = next(references, None)
+        if reference != key:
+            yield name, key
+
+
+def quarantine_name(name, stamp):
+    return f"{QUARANTINE_DIR}/{stamp}/{name}"
+
+
+def sweep_orphans(grace_hours=DEFAULT_GRACE_HOURS, action='quarantine', prefixes=('',), storage=None,
+                  chunk_size=SORT_CHUNK_SIZE, on_file=None):
+    """
+    Quarantine (move under quarantine/<timestamp>/), delete, or with action='report' only count
+    the orphaned files older than `grace_hours`. Files uploaded within the grace period are
+    skipped, since their rows may not be committed yet.
+
+    Returns {'orphans', 'bytes', 'recent', 'failed'}; on_file(name, size) is called per orphan.
+    """
+    storage = storage or default_storage
+    cutoff = timezone.now() - timedelta(hours=grace_hours)
+    stamp = timezone.now().strftime('%Y%m%d%H%M%S')
+    stats = {'orphans': 0, 'bytes': 0, 'recent': 0, 'failed': 0}
+
+    for name, _ in find_orphans(storage, prefixes, chunk_size):
+        try:
+            if storage.get_modified_time(name) > cutoff:
+                stats['recent'] += 1
+                continue
+            size = storage.size(name)
+            if action == 'quarantine':
+                with storage.open(name, 'rb') as f:
+                    storage.save(quarantine_name(name, stamp), f)
+                storage.delete(name)
+            elif action == 'delete':
+                storage.delete(name)
+        except Exception:
+            stats['failed'] += 1
+            continue
+        stats['orphans'] += 1
+        stats['bytes'] += size
+        if on_file:
+            on_file(name, size)
+    return stats
@@ -4,11 +4,10 @@ Applies rate limiting to all API endpoints with configurable limits per URL patt
 """
 import re
 import logging
-from django.core.cache import cache
 from django.http import JsonResponse
-from rest_framework.response import Response
-from rest_framework import status
+from django.utils.text import slugify
 from accounts.utils import get_client_ip
+from .rate_limiting import hit, rate_limit_headers
 
 logger = logging.getLogger('security')
 
@@ -73,14 +72,15 @@ class GlobalRateLimitMiddleware:
     
     def __init__(self, get_response):
         self.get_response = get_response
-        # Compile regex patterns for performance
-        self.rate_limit_patterns = [
-            (re.compile(pattern), max_req, window, desc)
-            for pattern, max_req, window, desc in self.RATE_LIMIT_RULES
-        ]
-        self.excluded_patterns = [
-            re.compile(pattern) for pattern in self.EXCLUDED_PATTERNS
-        ]
+        # One alternation per list, matched in a single pass; the first rule that matches wins,
+        # as with the ordered scan. The named group that matched identifies the rule.
+        self.rules = {}
+        alternatives = []
+        for index, (pattern, max_req, window, desc) in enumerate(self.RATE_LIMIT_RULES):
+            self.rules[f'rule{index}'] = (slugify(desc), max_req, window, desc)
+            alternatives.append(f'(?P<rule{index}>{pattern})')
+        self.rate_limit_pattern = re.compile('|'.join(alternatives))
+        self.excluded_pattern = re.compile('|'.join(f'(?:{pattern})' for pattern in self.EXCLUDED_PATTERNS))
     
     def __call__(self, request):
         try:
@@ -90,100 +90,65 @@ class GlobalRateLimitMiddleware:
             
             # Get rate limit for this URL
             rate_limit = self._get_rate_limit(request.path)
-            
-            if rate_limit:
-                max_requests, window_seconds, description = rate_limit
-                
-                # Check rate limit
-                error_response = self._check_rate_limit(
-                    request, 
-                    max_requests, 
-                    window_seconds, 
-                    description
-                )
-                
-                if error_response:
-                    return error_response
-            
-            # Continue with the request
-            return self.get_response(request)
         except Exception as e:
             # If middleware fails completely, log and continue (fail open)
             logger.error(f"Critical error in rate limit middleware: {str(e)}")
             return self.get_response(request)
+        
+        if not rate_limit:
+            return self.get_response(request)
+        
+        # Check rate limit
+        result = self._check_rate_limit(request, *rate_limit)
+        if result is not None and not result.allowed:
+            return self._too_many_requests(result)
+        
+        # Continue with the request
+        response = self.get_response(request)
+        if result is not None:
+            for header, value in rate_limit_headers(result).items():
+                response.setdefault(header, value)
+        return response
     
     def _is_excluded(self, path):
         """Check if URL path should be excluded from rate limiting"""
-        for pattern in self.excluded_patterns:
-            if pattern.match(path):
-                return True
-        return False
+        return self.excluded_pattern.match(path) is not None
     
     def _get_rate_limit(self, path):
         """
         Get rate limit configuration for a given URL path.
-        Returns (max_requests, window_seconds, description) or None
+        Returns (rule_id, max_requests, window_seconds, description) or None
         """
-        # Check patterns in order (most specific first)
-        for pattern, max_req, window, desc in self.rate_limit_patterns:
-            if pattern.match(path):
-                return (max_req, window, desc)
-        return None
+        match = self.rate_limit_pattern.match(path)
+        if match is None:
+            return None
+        return self.rules[match.lastgroup]
     
-    def _check_rate_limit(self, request, max_requests, window_seconds, description):
+    def _check_rate_limit(self, request, rule_id, max_requests, window_seconds, description):
         """
-        Check if request exceeds rate limit.
-        Returns error response if rate limited, None otherwise.
+        Count the request against the rule for this client IP (one counter per rule, not per path).
+        Returns the hit() result, or None if the cache is unavailable (fail open).
         """
         try:
-            # Get client IP
             client_ip = get_client_ip(request)
-            
-            # Create cache key based on IP and path
-            cache_key = f'rate_limit_middleware_{client_ip}_{request.path}'
-            
-            # Get current request count (with error handling)
-            try:
-                request_count = cache.get(cache_key, 0)
-            except Exception as e:
-                # If cache fails, log and allow request (fail open)
-                logger.error(f"Cache error in rate limiting: {str(e)}")
-                return None
-            
-            # Check if limit exceeded
-            if request_count >= max_requests:
-                logger.warning(
-                    f"Rate limit exceeded: {description} - "
-                    f"IP: {client_ip}, Path: {request.path}, "
-                    f"Count: {request_count}/{max_requests}"
-                )
-                
-                # Return appropriate response based on request type
-                if request.headers.get('Content-Type') == 'application/json' or \
-                   request.path.startswith('/api/') or \
-                   request.path.startswith('/shop/api/') or \
-                   request.path.startswith('/accounts/token/') or \
-                   request.path.startswith('/suppliers/auth/'):
-                    # API request - return JSON
-                    return JsonResponse({
-                        'detail': f'Too many requests. Limit: {max_requests} requests per {window_seconds} seconds.'
-                    }, status=429)
-                else:
-                    # Regular request - return JSON anyway for consistency
-                    return JsonResponse({
-                        'detail': f'Too many requests. Please try again later.'
-                    }, status=429)
-            
-            # Increment counter (with error handling)
-            try:
-                cache.set(cache_key, request_count + 1, window_seconds)
-            except Exception as e:
-                # If cache fails, log but allow request (fail open)
-                logger.error(f"Cache error setting rate limit: {str(e)}")
-            
-            return None
+            result = hit(rule_id, f'ip:{client_ip}', max_requests, window_seconds)
         except Exception as e:
-            # If anything fails, log and allow request (fail open)
-            logger.error(f"Error in rate limit middleware: {str(e)}")
+            # If cache fails, log and allow request (fail open)
+            logger.error(f"Cache error in rate limiting: {str(e)}")
             return None
-
+        
+        if not result.allowed:
+            logger.warning(
+                f"Rate limit exceeded: {description} - "
+                f"IP: {client_ip}, Path: {request.path}, "
+                f"Limit: {max_requests}/{window_seconds}s"
+            )
+        return result
+    
+    def _too_many_requests(self, result):
+        response = JsonResponse({
+            'detail': f'Too many requests. Limit: {result.limit} requests per {result.window} seconds.'
+        }, status=429)
+        for header, value in rate_limit_headers(result).items():
+            response[header] = value
+        return response
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.1 on 2026-10-19 04:59
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_order_totals(apps, schema_editor):
+    Order = apps.get_model('shop', 'Order')
+    OrderItem = apps.get_model('shop', 'OrderItem')
+
+    # One UPDATE with correlated subqueries instead of re-summing every order in Python
+    items = OrderItem.objects.filter(order=OuterRef('pk')).values('order')
+    total = items.annotate(
+        s=Sum(F('price') * F('quantity'), output_field=DecimalField(max_digits=14, decimal_places=2))
+    ).values('s')
+    item_count = items.annotate(s=Sum('quantity')).values('s')
+
+    Order.objects.update(
+        total=Coalesce(Subquery(total), Value(0), output_field=DecimalField(max_digits=14, decimal_places=2)),
+        item_count=Coalesce(Subquery(item_count), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0047_cart_session_key_alter_cart_customer_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['paid', '-created'], name='shop_order_paid_created_idx'),
+        ),
+        migrations.RunPython(backfill_order_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-19 05:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0048_order_total_item_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-created'], name='shop_order_created_idx'),
+        ),
+    ]
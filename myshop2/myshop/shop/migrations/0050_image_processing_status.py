@@ -0,0 +1,33 @@
+# Generated by Django 5.2.1 on 2026-10-19 05:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0049_order_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='processing_error',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='processing_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='productvariantimage',
+            name='processing_error',
+            field=models.CharField(blank=True, max_length=255, verbose_name='خطای پردازش'),
+        ),
+        migrations.AddField(
+            model_name='productvariantimage',
+            name='processing_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=20, verbose_name='وضعیت پردازش'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.1 on 2026-10-19 05:19
+
+import shop.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0050_image_processing_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('sha256', models.CharField(db_index=True, max_length=64)),
+                ('size', models.BigIntegerField(default=0)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Media Blob',
+                'verbose_name_plural': 'Media Blobs',
+            },
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(storage=shop.storage.content_addressed_storage, upload_to='product_images/'),
+        ),
+        migrations.AlterField(
+            model_name='productvariantimage',
+            name='image',
+            field=models.ImageField(storage=shop.storage.content_addressed_storage, upload_to='variant_images/', verbose_name='تصویر'),
+        ),
+    ]
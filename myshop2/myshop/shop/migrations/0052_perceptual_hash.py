@@ -0,0 +1,73 @@
+# Generated by Django 5.2.1 on 2026-10-19 05:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0051_content_addressed_media'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='perceptual_group',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='perceptual_hash',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='phash_band0',
+            field=models.PositiveIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='phash_band1',
+            field=models.PositiveIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='phash_band2',
+            field=models.PositiveIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='phash_band3',
+            field=models.PositiveIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='productvariantimage',
+            name='perceptual_group',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='productvariantimage',
+            name='perceptual_hash',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='productvariantimage',
+            name='phash_band0',
+            field=models.PositiveIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='productvariantimage',
+            name='phash_band1',
+            field=models.PositiveIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='productvariantimage',
+            name='phash_band2',
+            field=models.PositiveIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='productvariantimage',
+            name='phash_band3',
+            field=models.PositiveIntegerField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-19 05:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0052_perceptual_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='placeholder',
+            field=models.CharField(blank=True, default='', help_text='Tiny WebP data URI shown while the image loads', max_length=1000),
+        ),
+        migrations.AddField(
+            model_name='productvariantimage',
+            name='placeholder',
+            field=models.CharField(blank=True, default='', help_text='Tiny WebP data URI shown while the image loads', max_length=1000, verbose_name='پیش\u200cنمایش'),
+        ),
+        migrations.AddField(
+            model_name='specialoffer',
+            name='banner_placeholder',
+            field=models.CharField(blank=True, default='', max_length=1000, verbose_name='پیش\u200cنمایش بنر'),
+        ),
+    ]
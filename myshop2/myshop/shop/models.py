@@ -12,6 +12,7 @@ from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 # Use Django's built-in JSONField for compatibility with both SQLite and PostgreSQL
 from django.db.models import JSONField
+from .storage import content_addressed_storage
 
 
 # New models for improved category system (must be defined before Category model)
@@ -386,6 +387,22 @@ class Tag(models.Model):
                 self.slug = f"tag-{name_hash}-{random_part}"
         super().save(*args, **kwargs)
 
+ATTRIBUTE_DIGIT_MAP = str.maketrans('۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩', '01234567890123456789')
+
+
+def normalize_attribute_value(value):
+    """
+    Normalize attribute input text: remove zero-width characters (ZWNJ/ZWJ),
+    convert Persian/Arabic digits to ASCII and collapse whitespace.
+    Non-string values are returned unchanged.
+    """
+    if not isinstance(value, str):
+        return value
+    value = value.replace('\u200c', '').replace('\u200d', '')
+    value = value.translate(ATTRIBUTE_DIGIT_MAP)
+    return ' '.join(value.split()).strip()
+
+
 def persian_slugify(text):
     """
     Custom slugify function that works with Persian text.
@@ -413,7 +430,60 @@ def persian_slugify(text):
     return ""
 
 
-class Product(models.Model):
+class DirtyFieldsMixin:
+    """
+    Tracks which concrete fields changed since the instance was loaded from the database.
+
+    from_db() keeps a snapshot of the loaded values and save() refreshes it, so post_save
+    receivers still see the fields that were just written in changed_fields.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            name: value for name, value in zip(field_names, values)
+            if value is not models.DEFERRED
+        }
+        return instance
+
+    @property
+    def has_db_snapshot(self):
+        return getattr(self, '_loaded_values', None) is not None
+
+    @property
+    def changed_fields(self):
+        """Names of fields whose value differs from the snapshot (all fields if there is none)"""
+        loaded = getattr(self, '_loaded_values', None)
+        changed = set()
+        for field in self._meta.concrete_fields:
+            if loaded is None:
+                changed.add(field.name)
+            elif field.attname in loaded and loaded[field.attname] != getattr(self, field.attname):
+                changed.add(field.name)
+        return changed
+
+    def _update_snapshot(self, field_names=None):
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            loaded = self._loaded_values = {}
+        deferred = self.get_deferred_fields()
+        for field in self._meta.concrete_fields:
+            if field_names is not None and field.name not in field_names and field.attname not in field_names:
+                continue
+            if field.attname not in deferred:
+                loaded[field.attname] = getattr(self, field.attname)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._update_snapshot(kwargs.get('update_fields'))
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self._update_snapshot(fields)
+
+
+class Product(DirtyFieldsMixin, models.Model):
     CURRENCY_CHOICES = [
         ('TOMAN', 'تومان'),
         ('USD', 'دلار')
@@ -536,20 +606,7 @@ class Product(models.Model):
     def set_attribute_value(self, attribute_key, value):
         """Set the value of a specific attribute for this product"""
         try:
-            # Normalize the input value
-            if isinstance(value, str):
-                # Remove zero-width characters
-                value = value.replace('\u200c', '').replace('\u200d', '')
-                
-                # Normalize Arabic/Persian digits to standard digits
-                digit_map = str.maketrans(
-                    '۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩',
-                    '01234567890123456789'
-                )
-                value = value.translate(digit_map)
-                
-                # Replace multiple whitespaces with a single space and strip
-                value = ' '.join(value.split()).strip()
+            value = normalize_attribute_value(value)
 
             attribute = Attribute.objects.get(key=attribute_key)
             
@@ -576,6 +633,76 @@ class Product(models.Model):
         except Attribute.DoesNotExist:
             raise ValueError(f"Attribute with key '{attribute_key}' does not exist")
 
+    @classmethod
+    def bulk_set_attribute_values(cls, assignments):
+        """
+        Set many attribute values for many products in three queries.
+
+        Values are normalized like set_attribute_value(), attributes and predefined values are
+        resolved with one query each, and rows are upserted with a single bulk_create.
+
+        Args:
+            assignments: {product or product id: {attribute_key: value}}
+
+        Returns:
+            list: one dict per (product, key) with product_id, attribute_key, value and
+                  status ('predefined', 'custom' or 'error') plus error message
+        """
+        results = []
+        for product, values in assignments.items():
+            product_id = getattr(product, 'pk', product)
+            for key, value in values.items():
+                if value is not None and not isinstance(value, str):
+                    value = str(value)
+                results.append({
+                    'product_id': product_id,
+                    'attribute_key': key,
+                    'value': normalize_attribute_value(value),
+                    'status': None,
+                    'error': None,
+                })
+        if not results:
+            return results
+
+        attributes = {a.key: a for a in Attribute.objects.filter(key__in={r['attribute_key'] for r in results})}
+        wanted_ids = {attributes[r['attribute_key']].id for r in results if r['attribute_key'] in attributes}
+        wanted_values = {r['value'] for r in results if r['value'] is not None}
+        predefined = {}
+        if wanted_ids and wanted_values:
+            predefined = {
+                (v.attribute_id, v.value): v.id
+                for v in NewAttributeValue.objects.filter(attribute_id__in=wanted_ids, value__in=wanted_values).only('id', 'attribute_id', 'value')
+            }
+
+        rows = {}
+        for result in results:
+            attribute = attributes.get(result['attribute_key'])
+            if attribute is None:
+                result['status'] = 'error'
+                result['error'] = f"Attribute with key '{result['attribute_key']}' does not exist"
+                continue
+            if result['product_id'] is None:
+                result['status'] = 'error'
+                result['error'] = 'Product must be saved before setting attributes'
+                continue
+            value_id = predefined.get((attribute.id, result['value']))
+            # Later assignments for the same product/attribute win, as with repeated set_attribute_value calls
+            rows[(result['product_id'], attribute.id)] = ProductAttributeValue(
+                product_id=result['product_id'],
+                attribute_id=attribute.id,
+                attribute_value_id=value_id,
+                custom_value=None if value_id else result['value'],
+            )
+            result['status'] = 'predefined' if value_id else 'custom'
+
+        ProductAttributeValue.objects.bulk_create(
+            list(rows.values()),
+            update_conflicts=True,
+            unique_fields=['product', 'attribute'],
+            update_fields=['attribute_value', 'custom_value'],
+        )
+        return results
+
     def get_attributes_dict(self):
         """Get all attribute values as a dictionary"""
         attributes = {}
@@ -614,15 +741,19 @@ class Product(models.Model):
         self.save(update_fields=['is_new_arrival'])
 
     def save(self, *args, **kwargs):
-        # Check if category is being changed
-        if self.pk:  # Only for existing products
-            try:
-                old_product = Product.objects.get(pk=self.pk)
-                if old_product.category_id != self.category_id:
-                    # Category has changed, clean up invalid attributes
-                    self._cleanup_attributes_on_category_change()
-            except Product.DoesNotExist:
-                pass  # New product, no cleanup needed
+        # Check if category is being changed (skipped when update_fields leaves category alone)
+        update_fields = kwargs.get('update_fields')
+        category_saved = update_fields is None or 'category' in update_fields or 'category_id' in update_fields
+        if self.pk and category_saved:  # Only for existing products
+            if self.has_db_snapshot and 'category_id' in self._loaded_values:
+                category_changed = 'category' in self.changed_fields
+            else:
+                # Not loaded from the database, or loaded with category deferred: compare against the stored row
+                old_category_id = Product.objects.filter(pk=self.pk).values_list('category_id', flat=True).first()
+                category_changed = old_category_id is not None and old_category_id != self.category_id
+            if category_changed:
+                # Category has changed, clean up invalid attributes
+                self._cleanup_attributes_on_category_change()
         
         # Migration: Move data from old price field to new ones
         if self.price is not None and self.price_toman == 0:  # If price_toman is default but price exists
@@ -741,13 +872,78 @@ class ProductVariant(models.Model):
     variant_images_preview.short_description = 'Images'
 
 
-class ProductImage(models.Model):
+class MediaBlob(models.Model):
+    """A file in content-addressed storage and the number of image rows that use it"""
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.BigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Media Blob'
+        verbose_name_plural = 'Media Blobs'
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} refs)"
+
+
+class PerceptualHashFields(models.Model):
+    """
+    dHash of an image split into indexed 16-bit bands for near-duplicate lookups
+    (see shop.perceptual_hash). perceptual_group is shared by images that were within the
+    similarity threshold of each other when they were uploaded, so the admin report is a
+    GROUP BY instead of a scan of the whole library.
+    """
+    perceptual_hash = models.CharField(max_length=16, blank=True, default='')
+    phash_band0 = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+    phash_band1 = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+    phash_band2 = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+    phash_band3 = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+    perceptual_group = models.CharField(max_length=16, blank=True, default='', db_index=True)
+
+    class Meta:
+        abstract = True
+
+    def assign_perceptual_hash(self):
+        """Hash the current image and join the group of the closest similar image, if any"""
+        from . import perceptual_hash
+
+        if not self.image:
+            return
+        try:
+            value = perceptual_hash.dhash_file(self.image)
+        except Exception as e:
+            print(f"Error calculating perceptual hash: {e}")
+            return
+
+        for field, field_value in perceptual_hash.band_fields(value).items():
+            setattr(self, field, field_value)
+        exclude = [(self.perceptual_kind, self.pk)] if self.pk else []
+        match = perceptual_hash.find_similar_images(value, exclude=exclude, limit=1)
+        self.perceptual_group = (match and match[0]['group']) or self.perceptual_hash
+
+
+IMAGE_PROCESSING_STATUS_CHOICES = [
+    ('pending', 'Pending'),
+    ('processing', 'Processing'),
+    ('ready', 'Ready'),
+    ('failed', 'Failed'),
+]
+
+
+class ProductImage(PerceptualHashFields):
+    perceptual_kind = 'product'
+
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
-    image = models.ImageField(upload_to='product_images/')
+    image = models.ImageField(upload_to='product_images/', storage=content_addressed_storage)
     is_primary = models.BooleanField(default=False)
     order = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     image_hash = models.CharField(max_length=64, blank=True, null=True)
+    processing_status = models.CharField(max_length=20, choices=IMAGE_PROCESSING_STATUS_CHOICES, default='ready')
+    processing_error = models.CharField(max_length=255, blank=True)
+    placeholder = models.CharField(max_length=1000, blank=True, default='', help_text='Tiny WebP data URI shown while the image loads')
 
     class Meta:
         ordering = ['-is_primary', 'order', 'created_at']
@@ -763,24 +959,28 @@ class ProductImage(models.Model):
 
     def calculate_image_hash(self):
         """Calculate a hash of the image content to identify duplicates"""
-        import hashlib
         if not self.image:
             return None
             
         try:
-            # Read image content
-            self.image.seek(0)
-            image_content = self.image.read()
-            # Calculate SHA-256 hash
-            hash_object = hashlib.sha256(image_content)
-            hex_dig = hash_object.hexdigest()
-            # Reset file pointer
-            self.image.seek(0)
-            return hex_dig
+            # Stream the file in chunks instead of reading it into memory
+            from .utils import hash_file
+            return hash_file(self.image)
         except Exception as e:
             print(f"Error calculating image hash: {e}")
             return None
 
+    def calculate_placeholder(self):
+        """Tiny WebP data URI for list payloads; '' if the image cannot be read"""
+        if not self.image:
+            return ''
+        try:
+            from .utils import make_placeholder
+            return make_placeholder(self.image)
+        except Exception as e:
+            print(f"Error calculating image placeholder: {e}")
+            return ''
+
     def _compress_image(self):
         """Compress the image if it's not already in webp format"""
         if not self.image:
@@ -824,9 +1024,26 @@ class ProductImage(models.Model):
                 # Instead of creating a duplicate, return the existing one
                 return duplicate
         
-        # Compress the image if requested and if it's new
-        if compress and is_new:
+        # Perceptual hash from the upload itself; it survives the WebP re-encode
+        if is_new and not self.perceptual_hash:
+            self.assign_perceptual_hash()
+
+        # Compress the image if requested and if it's new; with the async pipeline the
+        # original is stored now and compressed by a worker after commit
+        from . import image_pipeline
+        process_later = (
+            compress and is_new
+            and image_pipeline.is_enabled()
+            and image_pipeline.needs_processing(self.image.name)
+        )
+        if process_later:
+            self.processing_status = image_pipeline.STATUS_PENDING
+        elif compress and is_new:
             self._compress_image()
+
+        # The pipeline computes the placeholder itself; otherwise do it now
+        if is_new and not process_later and not self.placeholder:
+            self.placeholder = self.calculate_placeholder()
             
         # Recalculate hash if compression was applied
         if not self.image_hash:
@@ -834,6 +1051,8 @@ class ProductImage(models.Model):
         
         # Save to database
         super().save(*args, **kwargs)
+        if process_later:
+            image_pipeline.schedule_image_processing(self)
         return self
 
     @classmethod
@@ -855,8 +1074,9 @@ class ProductImage(models.Model):
             order=order
         )
         
-        # Calculate image hash
+        # Calculate image hash once; save() reuses it
         image_hash = instance.calculate_image_hash()
+        instance.image_hash = image_hash
         
         # Check for duplicate by hash
         if image_hash:
@@ -874,11 +1094,13 @@ class ProductImage(models.Model):
         return instance
 
 
-class ProductVariantImage(models.Model):
+class ProductVariantImage(PerceptualHashFields):
     """
     Images specific to product variants (e.g., red iPhone images vs blue iPhone images)
     Each variant can have its own set of images showing the specific color/size combination
     """
+    perceptual_kind = 'variant'
+
     variant = models.ForeignKey(
         ProductVariant, 
         on_delete=models.CASCADE, 
@@ -887,6 +1109,7 @@ class ProductVariantImage(models.Model):
     )
     image = models.ImageField(
         upload_to='variant_images/',
+        storage=content_addressed_storage,
         verbose_name='تصویر'
     )
     is_primary = models.BooleanField(
@@ -910,6 +1133,20 @@ class ProductVariantImage(models.Model):
         verbose_name='هش تصویر',
         help_text='هش یکتا برای تشخیص تصاویر تکراری'
     )
+    processing_status = models.CharField(
+        max_length=20,
+        choices=IMAGE_PROCESSING_STATUS_CHOICES,
+        default='ready',
+        verbose_name='وضعیت پردازش'
+    )
+    processing_error = models.CharField(max_length=255, blank=True, verbose_name='خطای پردازش')
+    placeholder = models.CharField(
+        max_length=1000,
+        blank=True,
+        default='',
+        verbose_name='پیش‌نمایش',
+        help_text='Tiny WebP data URI shown while the image loads'
+    )
 
     class Meta:
         ordering = ['-is_primary', 'order', 'created_at']
@@ -927,24 +1164,28 @@ class ProductVariantImage(models.Model):
 
     def calculate_image_hash(self):
         """Calculate a hash of the image content to identify duplicates"""
-        import hashlib
         if not self.image:
             return None
             
         try:
-            # Read image content
-            self.image.seek(0)
-            image_content = self.image.read()
-            # Calculate SHA-256 hash
-            hash_object = hashlib.sha256(image_content)
-            hex_dig = hash_object.hexdigest()
-            # Reset file pointer
-            self.image.seek(0)
-            return hex_dig
+            # Stream the file in chunks instead of reading it into memory
+            from .utils import hash_file
+            return hash_file(self.image)
         except Exception as e:
             print(f"Error calculating variant image hash: {e}")
             return None
 
+    def calculate_placeholder(self):
+        """Tiny WebP data URI for list payloads; '' if the image cannot be read"""
+        if not self.image:
+            return ''
+        try:
+            from .utils import make_placeholder
+            return make_placeholder(self.image)
+        except Exception as e:
+            print(f"Error calculating variant image placeholder: {e}")
+            return ''
+
     def _compress_image(self):
         """Compress the image if it's not already in webp format"""
         if not self.image:
@@ -991,9 +1232,26 @@ class ProductVariantImage(models.Model):
                 # Only return existing if it's an exact duplicate (same order too)
                 return duplicate
         
-        # Compress the image if requested and if it's new
-        if compress and is_new:
+        # Perceptual hash from the upload itself; it survives the WebP re-encode
+        if is_new and not self.perceptual_hash:
+            self.assign_perceptual_hash()
+
+        # Compress the image if requested and if it's new; with the async pipeline the
+        # original is stored now and compressed by a worker after commit
+        from . import image_pipeline
+        process_later = (
+            compress and is_new
+            and image_pipeline.is_enabled()
+            and image_pipeline.needs_processing(self.image.name)
+        )
+        if process_later:
+            self.processing_status = image_pipeline.STATUS_PENDING
+        elif compress and is_new:
             self._compress_image()
+
+        # The pipeline computes the placeholder itself; otherwise do it now
+        if is_new and not process_later and not self.placeholder:
+            self.placeholder = self.calculate_placeholder()
             
         # Recalculate hash if compression was applied
         if not self.image_hash:
@@ -1001,6 +1259,8 @@ class ProductVariantImage(models.Model):
         
         # Save to database
         super().save(*args, **kwargs)
+        if process_later:
+            image_pipeline.schedule_image_processing(self)
         return self
 
     @classmethod
@@ -1022,8 +1282,9 @@ class ProductVariantImage(models.Model):
             order=order
         )
         
-        # Calculate image hash
+        # Calculate image hash once; save() reuses it
         image_hash = instance.calculate_image_hash()
+        instance.image_hash = image_hash
         
         # Check for exact duplicate: same variant, same hash, AND same order
         if image_hash:
@@ -1065,15 +1326,35 @@ class Order(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     paid = models.BooleanField(default=False)
+    # Denormalized from items (kept in sync by OrderItem signals) so sorting/filtering stays in SQL
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0, db_index=True)
+    item_count = models.PositiveIntegerField(default=0)
 
     class Meta:
         ordering = ('-created',)
+        indexes = [
+            models.Index(fields=['paid', '-created'], name='shop_order_paid_created_idx'),
+            models.Index(fields=['-created'], name='shop_order_created_idx'),
+        ]
 
     def __str__(self):
         return f'Order {self.id}'
 
     def get_total_cost(self):
-        return sum(item.get_cost() for item in self.items.all())
+        return self.total
+
+    def calculate_totals(self):
+        """Sum total and item count from the order items in a single query"""
+        totals = self.items.aggregate(
+            total=models.Sum(models.F('price') * models.F('quantity'), output_field=models.DecimalField(max_digits=14, decimal_places=2)),
+            item_count=models.Sum('quantity'),
+        )
+        return totals['total'] or 0, totals['item_count'] or 0
+
+    def update_totals(self):
+        """Recalculate the denormalized total/item_count columns from the order items"""
+        self.total, self.item_count = self.calculate_totals()
+        Order.objects.filter(pk=self.pk).update(total=self.total, item_count=self.item_count)
 
 
 class CategoryAttribute(models.Model):
@@ -1406,6 +1687,7 @@ class SpecialOffer(models.Model):
     
     # Banner settings
     banner_image = models.ImageField(upload_to='special_offers/banners/', blank=True, null=True, verbose_name='تصویر بنر')
+    banner_placeholder = models.CharField(max_length=1000, blank=True, default='', verbose_name='پیش‌نمایش بنر')
     banner_action_type = models.CharField(max_length=20, choices=ACTION_TYPES, default='none', verbose_name='نوع عملیات بنر')
     banner_action_target = models.CharField(max_length=500, blank=True, verbose_name='هدف عملیات بنر')
     banner_external_url = models.URLField(blank=True, verbose_name='لینک خارجی')
@@ -1436,6 +1718,19 @@ class SpecialOffer(models.Model):
     def __str__(self):
         return f"{self.title} ({self.get_offer_type_display()})"
     
+    def save(self, *args, **kwargs):
+        # A newly assigned banner file has not been written to storage yet; existing banners
+        # are filled in by the generate_placeholders command
+        if not self.banner_image:
+            self.banner_placeholder = ''
+        elif not self.banner_image._committed:
+            try:
+                from .utils import make_placeholder
+                self.banner_placeholder = make_placeholder(self.banner_image)
+            except Exception as e:
+                print(f"Error calculating banner placeholder: {e}")
+        super().save(*args, **kwargs)
+    
     def is_currently_valid(self):
         """Check if the offer is currently valid"""
         now = timezone.now()
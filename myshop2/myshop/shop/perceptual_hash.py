@@ -0,0 +1,290 @@
+"""
+Perceptual Image Hashing
+64-bit difference hashes (dHash) of product and variant images, so re-encoded, resized or
+recompressed copies of the same supplier photo can be found even though their SHA-256 differs.
+
+Lookups use multi-index hashing: the hash is split into four 16-bit bands stored in indexed
+columns. Two hashes within Hamming distance r share at least one band that differs by at most
+r // 4 bits, so a query only has to fetch rows whose band matches one of a few enumerated
+values, then checks the full distance in Python.
+
+Every image also carries a perceptual_group, inherited from the closest match at upload time,
+so the admin report only has to group rows by that column. regroup_near_duplicates() rebuilds
+exact (transitive) groups offline from the management command.
+"""
+from collections import Counter, defaultdict
+from itertools import combinations
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from PIL import Image
+
+from .utils import safe_open_image
+
+HASH_BITS = 64
+BAND_COUNT = 4
+BAND_BITS = HASH_BITS // BAND_COUNT
+BAND_MASK = (1 << BAND_BITS) - 1
+BAND_FIELDS = tuple(f'phash_band{i}' for i in range(BAND_COUNT))
+
+DEFAULT_THRESHOLD = 6
+
+
+def get_threshold():
+    return getattr(settings, 'PERCEPTUAL_HASH_THRESHOLD', DEFAULT_THRESHOLD)
+
+
+def dhash_image(img):
+    """dHash of a PIL image: compare horizontally adjacent pixels of a 9x8 grayscale thumbnail"""
+    if 'A' in img.getbands() or (img.mode == 'P' and 'transparency' in img.info):
+        # Flatten onto white so cut-outs hash like the same product shot on a white background
+        img = img.convert('RGBA')
+        background = Image.new('RGBA', img.size, (255, 255, 255, 255))
+        img = Image.alpha_composite(background, img)
+    pixels = img.convert('L').resize((9, 8), Image.Resampling.BOX).tobytes()
+
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            value = (value << 1) | (pixels[offset + col] < pixels[offset + col + 1])
+    return value
+
+
+def dhash_file(file_obj):
+    """dHash of an image file or upload; JPEGs are decoded at reduced scale. Rewinds the file."""
+    if hasattr(file_obj, 'seek'):
+        file_obj.seek(0)
+    try:
+        img = safe_open_image(file_obj, target_size=(64, 64), convert_icc=False)
+        img.load()
+        return dhash_image(img)
+    finally:
+        if hasattr(file_obj, 'seek'):
+            file_obj.seek(0)
+
+
+def to_hex(value):
+    return f'{value:016x}'
+
+
+def from_hex(text):
+    return int(text, 16)
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def split_bands(value):
+    """The four 16-bit bands of a hash, most significant first"""
+    return tuple(
+        (value >> (BAND_BITS * (BAND_COUNT - 1 - i))) & BAND_MASK
+        for i in range(BAND_COUNT)
+    )
+
+
+def band_fields(value):
+    """Model field values for a hash (or cleared fields for None)"""
+    if value is None:
+        return dict({'perceptual_hash': ''}, **{field: None for field in BAND_FIELDS})
+    return dict({'perceptual_hash': to_hex(value)}, **dict(zip(BAND_FIELDS, split_bands(value))))
+
+
+def band_neighbours(band, radius):
+    """All band values within `radius` bits of `band`"""
+    values = [band]
+    for flips in range(1, radius + 1):
+        for bits in combinations(range(BAND_BITS), flips):
+            flipped = band
+            for bit in bits:
+                flipped ^= 1 << bit
+            values.append(flipped)
+    return values
+
+
+def _image_models():
+    from .models import ProductImage, ProductVariantImage
+    return (
+        ('product', ProductImage, 'product_id'),
+        ('variant', ProductVariantImage, 'variant__product_id'),
+    )
+
+
+def find_similar_images(value, threshold=None, exclude=None, limit=20):
+    """
+    Product and variant images whose perceptual hash is within `threshold` bits of `value`.
+
+    `exclude` is an iterable of (kind, id) pairs to leave out (e.g. the image being checked).
+    Returns dicts with kind, id, product_id, image name, group and distance, closest first.
+    """
+    threshold = get_threshold() if threshold is None else threshold
+    radius = threshold // BAND_COUNT
+    excluded = set(exclude or ())
+
+    query = Q()
+    for field, band in zip(BAND_FIELDS, split_bands(value)):
+        query |= Q(**{f'{field}__in': band_neighbours(band, radius)})
+
+    matches = []
+    for kind, model, product_field in _image_models():
+        rows = model.objects.filter(query).values_list(
+            'id', product_field, 'image', 'perceptual_hash', 'perceptual_group'
+        )
+        for pk, product_id, name, text, group in rows:
+            if (kind, pk) in excluded or not text:
+                continue
+            distance = hamming(value, from_hex(text))
+            if distance <= threshold:
+                matches.append({
+                    'kind': kind,
+                    'id': pk,
+                    'product_id': product_id,
+                    'image': name,
+                    'group': group,
+                    'distance': distance,
+                })
+
+    matches.sort(key=lambda m: (m['distance'], m['kind'], m['id']))
+    return matches[:limit] if limit else matches
+
+
+def group_near_duplicates(entries, threshold=None):
+    """
+    Cluster (key, hash) pairs whose hashes are within `threshold` bits of each other
+    (transitively). Returns clusters of keys with more than one member, largest first.
+
+    Identical hashes are collapsed before the band index is built, so copies of the same file
+    shared by many rows only cost one lookup. This is a full pass over the library and is
+    meant for the management command, not for requests.
+    """
+    threshold = get_threshold() if threshold is None else threshold
+    radius = threshold // BAND_COUNT
+
+    keys_by_hash = defaultdict(list)
+    for key, value in entries:
+        keys_by_hash[value].append(key)
+    hashes = list(keys_by_hash)
+
+    buckets = [defaultdict(list) for _ in range(BAND_COUNT)]
+    for index, value in enumerate(hashes):
+        for band_index, band in enumerate(split_bands(value)):
+            buckets[band_index][band].append(index)
+
+    parent = list(range(len(hashes)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    neighbour_cache = {}
+    for index, value in enumerate(hashes):
+        for band_index, band in enumerate(split_bands(value)):
+            if radius:
+                neighbours = neighbour_cache.get(band)
+                if neighbours is None:
+                    neighbours = neighbour_cache[band] = band_neighbours(band, radius)
+            else:
+                neighbours = (band,)
+            for neighbour in neighbours:
+                for other in buckets[band_index].get(neighbour, ()):
+                    if other > index and (value ^ hashes[other]).bit_count() <= threshold:
+                        root_a, root_b = find(index), find(other)
+                        if root_a != root_b:
+                            parent[root_b] = root_a
+
+    clusters = defaultdict(list)
+    for index, value in enumerate(hashes):
+        clusters[find(index)].extend(keys_by_hash[value])
+    groups = [keys for keys in clusters.values() if len(keys) > 1]
+    groups.sort(key=len, reverse=True)
+    return groups
+
+
+def regroup_near_duplicates(threshold=None, dry_run=False):
+    """
+    Recompute perceptual_group for every hashed image from a full clustering pass, merging
+    groups that upload-time assignment kept apart. Returns (groups, images in groups).
+    """
+    models = {kind: model for kind, model, _ in _image_models()}
+    entries = []
+    current = {}
+    for kind, model in models.items():
+        queryset = model.objects.exclude(perceptual_hash='').values_list('id', 'perceptual_hash', 'perceptual_group')
+        for pk, text, group in queryset.iterator(chunk_size=5000):
+            entries.append(((kind, pk), from_hex(text)))
+            current[(kind, pk)] = (text, group)
+
+    groups = group_near_duplicates(entries, threshold)
+    if dry_run:
+        return len(groups), sum(len(group) for group in groups)
+
+    # Every image starts in its own group, keyed by its own hash; clusters take the key of
+    # their smallest hash so reruns are stable
+    updates = defaultdict(lambda: defaultdict(list))
+    grouped = set()
+    for group in groups:
+        key = min(current[member][0] for member in group)
+        for kind, pk in group:
+            grouped.add((kind, pk))
+            if current[(kind, pk)][1] != key:
+                updates[kind][key].append(pk)
+    for member, (text, group) in current.items():
+        if member not in grouped and group != text:
+            updates[member[0]][text].append(member[1])
+
+    with transaction.atomic():
+        for kind, by_key in updates.items():
+            for key, ids in by_key.items():
+                models[kind].objects.filter(pk__in=ids).update(perceptual_group=key)
+    return len(groups), len(grouped)
+
+
+def near_duplicate_report(limit=50):
+    """
+    The largest perceptual groups with more than one image, for the admin report.
+    Returns dicts with the group key, image count, distinct product count and the images.
+    """
+    image_models = _image_models()
+    sizes = Counter()
+    for _, model, _ in image_models:
+        counts = (
+            model.objects.exclude(perceptual_group='')
+            .values_list('perceptual_group')
+            .annotate(n=Count('id'))
+            .order_by()
+        )
+        for group, n in counts:
+            sizes[group] += n
+
+    top = [group for group, n in sizes.most_common() if n > 1]
+    if limit:
+        top = top[:limit]
+
+    members = defaultdict(list)
+    for kind, model, product_field in image_models:
+        rows = model.objects.filter(perceptual_group__in=top).values_list(
+            'perceptual_group', 'id', product_field, 'image', 'perceptual_hash'
+        )
+        for group, pk, product_id, name, text in rows:
+            members[group].append({
+                'kind': kind,
+                'id': pk,
+                'product_id': product_id,
+                'image': name,
+                'hash': text,
+                'distance': hamming(from_hex(group), from_hex(text)),
+            })
+
+    return [
+        {
+            'group': group,
+            'count': sizes[group],
+            'products': len({m['product_id'] for m in members[group]}),
+            'images': sorted(members[group], key=lambda m: (m['distance'], m['kind'], m['id'])),
+        }
+        for group in top
+    ]
@@ -0,0 +1,87 @@
+"""
+Shared Image Process Pool
+One ProcessPoolExecutor per server worker process for off-request Pillow work (product image
+compression, image editor batches), sized by IMAGE_PROCESSING_WORKERS. Jobs are plain
+(function, *args) tuples of picklable values; results are handed back to a callback.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_worker_count():
+    """Pool size; 0 runs jobs inline in the calling thread"""
+    return getattr(settings, 'IMAGE_PROCESSING_WORKERS', 2)
+
+
+def get_executor():
+    global _executor, _executor_pid
+    with _executor_lock:
+        # Pools do not survive a fork, so each server worker process gets its own
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ProcessPoolExecutor(max_workers=get_worker_count())
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def reset_executor():
+    global _executor
+    with _executor_lock:
+        _executor = None
+
+
+def run_job(job, on_result, on_error, wait=False):
+    """
+    Run job = (function, *args) in the pool and pass its result to on_result, or any exception
+    to on_error. Without workers, or with wait=True, the callbacks run in the calling thread;
+    otherwise in the pool's result thread, whose database connection is closed afterwards.
+    """
+    if get_worker_count() <= 0:
+        try:
+            on_result(job[0](*job[1:]))
+        except Exception as e:
+            on_error(e)
+        return
+
+    try:
+        future = get_executor().submit(*job)
+    except Exception as e:
+        if isinstance(e, BrokenProcessPool):
+            reset_executor()
+        on_error(e)
+        return
+
+    if wait:
+        _on_done(future, on_result, on_error, close_connection=False)
+    else:
+        future.add_done_callback(lambda f: _on_done(f, on_result, on_error))
+
+
+def _on_done(future, on_result, on_error, close_connection=True):
+    try:
+        try:
+            result = future.result()
+        except BrokenProcessPool as e:
+            reset_executor()
+            on_error(e)
+            return
+        except Exception as e:
+            on_error(e)
+            return
+        on_result(result)
+    except Exception:
+        logger.exception('Handling a process pool result failed')
+    finally:
+        if close_connection:
+            connection.close()
@@ -1,9 +1,17 @@
 """
 Rate Limiting Utilities for Cart Endpoints
 Provides IP-based and Device ID-based rate limiting with proper security measures
+
+Limits are sliding window counters in the shared cache, keyed by rule id plus client identity
+(ip:<address>, device:<id>, user:<pk>). The current fixed window is counted with an atomic incr
+and the previous window is weighted by how much of it still overlaps the last `window` seconds,
+so concurrent workers never lose hits and the window is not pushed back by every request.
 """
+import math
+import time
 import uuid
 import logging
+from collections import namedtuple
 from django.core.cache import cache
 from rest_framework.response import Response
 from rest_framework import status
@@ -39,15 +47,64 @@ def validate_device_id(device_id):
         return False, None
 
 
-def check_rate_limit(request, max_requests_per_minute=50, window_seconds=60):
+RateLimitResult = namedtuple('RateLimitResult', 'allowed limit remaining reset retry_after window')
+
+
+def hit(rule_id, identity, limit, window_seconds, now=None):
+    """
+    Count one request of `identity` against rule `rule_id` (at most `limit` per `window_seconds`).
+    Rejected requests are not counted, so a client that keeps retrying is let in again on time.
+    """
+    now = time.time() if now is None else now
+    index, elapsed = divmod(now, window_seconds)
+    key = f'rate_limit:{rule_id}:{identity}:{int(index)}'
+    timeout = window_seconds * 2  # The window is read again as the previous one
+
+    try:
+        current = cache.incr(key)
+    except ValueError:
+        # First request of the window (add() loses the race to a concurrent first request)
+        current = 1 if cache.add(key, 1, timeout=timeout) else cache.incr(key)
+    previous = cache.get(f'rate_limit:{rule_id}:{identity}:{int(index) - 1}', 0)
+
+    used = previous * (1 - elapsed / window_seconds) + current
+    reset = math.ceil(window_seconds - elapsed)
+    if used <= limit:
+        return RateLimitResult(True, limit, int(limit - used), reset, 0, window_seconds)
+
+    cache.decr(key)
+    current -= 1
+    if previous and current < limit:
+        # Wait until the previous window has decayed enough for one more request
+        retry_after = math.ceil(window_seconds * (1 - (limit - current - 1) / previous) - elapsed)
+    else:
+        retry_after = reset
+    return RateLimitResult(False, limit, 0, reset, max(1, retry_after), window_seconds)
+
+
+def rate_limit_headers(result):
+    """RateLimit-* headers (IETF draft) for a hit() result, plus Retry-After when rejected"""
+    headers = {
+        'RateLimit-Limit': str(result.limit),
+        'RateLimit-Remaining': str(result.remaining),
+        'RateLimit-Reset': str(result.reset),
+        'RateLimit-Policy': f'{result.limit};w={result.window}',
+    }
+    if not result.allowed:
+        headers['Retry-After'] = str(result.retry_after)
+    return headers
+
+
+def check_rate_limit(request, max_requests_per_minute=50, window_seconds=60, rule_id='cart'):
     """
-    Check rate limit for both IP address and device ID.
+    Check rate limit for both IP address and device ID (or user for authenticated requests).
     Returns error response if rate limit exceeded, None otherwise.
     
     Args:
         request: Django request object
         max_requests_per_minute: Maximum requests allowed per minute
         window_seconds: Time window in seconds (default 60 = 1 minute)
+        rule_id: Name of the limit, so each endpoint has its own counters
         
     Returns:
         Response object if rate limited, None if OK
@@ -68,32 +125,19 @@ def check_rate_limit(request, max_requests_per_minute=50, window_seconds=60):
             }, status=status.HTTP_400_BAD_REQUEST)
         device_id = normalized_device_id
     
-    # Rate limit by IP address
-    ip_cache_key = f'rate_limit_ip_{client_ip}'
-    ip_count = cache.get(ip_cache_key, 0)
-    
-    if ip_count >= max_requests_per_minute:
-        logger.warning(f"Rate limit exceeded for IP: {client_ip}")
-        return Response({
-            'detail': 'Too many requests, please try again later.'
-        }, status=status.HTTP_429_TOO_MANY_REQUESTS)
-    
-    # Increment IP counter
-    cache.set(ip_cache_key, ip_count + 1, window_seconds)
+    identities = [f'ip:{client_ip}']
+    if request.user.is_authenticated:
+        identities.append(f'user:{request.user.pk}')
+    elif device_id:
+        identities.append(f'device:{device_id}')
     
-    # Rate limit by device ID (for guest users)
-    if device_id and not request.user.is_authenticated:
-        device_cache_key = f'rate_limit_device_{device_id}'
-        device_count = cache.get(device_cache_key, 0)
-        
-        if device_count >= max_requests_per_minute:
-            logger.warning(f"Rate limit exceeded for device ID: {device_id[:8]}...")
+    for identity in identities:
+        result = hit(rule_id, identity, max_requests_per_minute, window_seconds)
+        if not result.allowed:
+            logger.warning(f"Rate limit exceeded for {rule_id}: {identity[:20]}")
             return Response({
                 'detail': 'Too many requests, please try again later.'
-            }, status=status.HTTP_429_TOO_MANY_REQUESTS)
-        
-        # Increment device ID counter
-        cache.set(device_cache_key, device_count + 1, window_seconds)
+            }, status=status.HTTP_429_TOO_MANY_REQUESTS, headers=rate_limit_headers(result))
     
     # Rate limit passed
     return None
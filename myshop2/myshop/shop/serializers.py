@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from django.db import models
 from .models import Product, ProductAttributeValue, ProductAttribute, Category, Wishlist, SpecialOffer, SpecialOfferProduct, ProductVariant
+from .image_derivatives import build_srcset
 
 class LegacyProductAttributeSerializer(serializers.ModelSerializer):
     class Meta:
@@ -31,6 +32,9 @@ class ProductAttributeValueSerializer(serializers.ModelSerializer):
 class ProductImageSerializer(serializers.Serializer):
     url = serializers.CharField()
     is_primary = serializers.BooleanField()
+    placeholder = serializers.CharField(required=False)
+    srcset = serializers.CharField(required=False)
+    sources = serializers.ListField(child=serializers.DictField(), required=False)
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -141,7 +145,10 @@ class ProductSerializer(serializers.ModelSerializer):
             url = image.image.url
             if request and not url.startswith(('http://', 'https://')):
                 url = request.build_absolute_uri(url)
-            images.append({'url': url, 'is_primary': image.is_primary})
+            images.append(dict(
+                {'url': url, 'is_primary': image.is_primary, 'placeholder': image.placeholder},
+                **build_srcset('product', image, request)
+            ))
         
         # If no direct product images, try to get from variants
         if not images:
@@ -156,7 +163,10 @@ class ProductSerializer(serializers.ModelSerializer):
                     url = first_variant_image.image.url
                     if request and not url.startswith(('http://', 'https://')):
                         url = request.build_absolute_uri(url)
-                    images.append({'url': url, 'is_primary': True})
+                    images.append(dict(
+                        {'url': url, 'is_primary': True, 'placeholder': first_variant_image.placeholder},
+                        **build_srcset('variant', first_variant_image, request)
+                    ))
         
         return images
 
@@ -386,12 +396,13 @@ class SpecialOfferSerializer(serializers.ModelSerializer):
     remaining_time = serializers.SerializerMethodField()
     is_currently_valid = serializers.SerializerMethodField()
     banner_image_url = serializers.SerializerMethodField()
+    banner_srcset = serializers.SerializerMethodField()
     
     class Meta:
         model = SpecialOffer
         fields = [
             'id', 'title', 'description', 'offer_type', 'display_style',
-            'banner_image_url', 'banner_action_type', 'banner_action_target', 'banner_external_url',
+            'banner_image_url', 'banner_placeholder', 'banner_srcset', 'banner_action_type', 'banner_action_target', 'banner_external_url',
             'valid_from', 'valid_until', 'enabled', 'is_active', 'display_order',
             'products', 'remaining_time', 'is_currently_valid'
         ]
@@ -411,4 +422,8 @@ class SpecialOfferSerializer(serializers.ModelSerializer):
             if request:
                 return request.build_absolute_uri(obj.banner_image.url)
             return obj.banner_image.url
-        return None 
\ No newline at end of file
+        return None
+    
+    def get_banner_srcset(self, obj):
+        """Resized banner variants for srcset"""
+        return build_srcset('offer', obj, self.context.get('request'), field_name='banner_image') 
\ No newline at end of file
@@ -1,74 +1,18 @@
-from typing import Iterable
-
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.utils import timezone
-
-from .models import Category, CategoryAttribute, AttributeValue, SpecialOfferProduct, Product, SpecialOffer
-
-
-def _iter_descendant_categories(category: Category) -> Iterable[Category]:
-    """Yield all descendant categories for the given category.
-
-    Uses the model's helper method to gather all subcategories recursively.
-    """
-    # The Category model already provides a recursive method
-    for descendant in category.get_all_subcategories():
-        yield descendant
 
-
-def _ensure_child_attribute(parent_attr: CategoryAttribute, child_category: Category) -> CategoryAttribute:
-    """Get or create the mirrored attribute on a child category matching the parent's key.
-
-    Also keeps core attribute fields in sync with the parent.
-    """
-    child_attr, created = CategoryAttribute.objects.get_or_create(
-        category=child_category,
-        key=parent_attr.key,
-        defaults={
-            'type': parent_attr.type,
-            'required': parent_attr.required,
-            'display_order': parent_attr.display_order,
-            'label_fa': parent_attr.label_fa,
-        },
-    )
-
-    # If already existed, update fields to match parent for consistency
-    # Only update when there is a difference to avoid unnecessary saves
-    if not created:
-        fields_to_update = {}
-        if child_attr.type != parent_attr.type:
-            fields_to_update['type'] = parent_attr.type
-        if child_attr.required != parent_attr.required:
-            fields_to_update['required'] = parent_attr.required
-        if child_attr.display_order != parent_attr.display_order:
-            fields_to_update['display_order'] = parent_attr.display_order
-        if child_attr.label_fa != parent_attr.label_fa:
-            fields_to_update['label_fa'] = parent_attr.label_fa
-
-        if fields_to_update:
-            for name, value in fields_to_update.items():
-                setattr(child_attr, name, value)
-            child_attr.save(update_fields=list(fields_to_update.keys()))
-
-    return child_attr
-
-
-def _sync_attribute_values(parent_attr: CategoryAttribute, child_attr: CategoryAttribute) -> None:
-    """Ensure all values from parent attribute exist on the child attribute with same ordering.
-
-    This is an additive sync; it does not remove extra values on the child.
-    """
-    parent_values = AttributeValue.objects.filter(attribute=parent_attr)
-    for pval in parent_values:
-        cval, created = AttributeValue.objects.get_or_create(
-            attribute=child_attr,
-            value=pval.value,
-            defaults={'display_order': pval.display_order},
-        )
-        if not created and cval.display_order != pval.display_order:
-            cval.display_order = pval.display_order
-            cval.save(update_fields=['display_order'])
+from .models import (
+    Category, CategoryAttribute, AttributeValue, SpecialOfferProduct, SpecialOffer, Order, OrderItem,
+    ProductImage, ProductVariantImage,
+)
+from .attribute_propagation import (
+    inherit_from_parent,
+    is_propagating,
+    schedule_attribute_propagation,
+    schedule_value_removal,
+)
+from .special_offers import refresh_special_offer_flags
+from .storage import is_content_addressed
 
 
 @receiver(post_save, sender=CategoryAttribute)
@@ -78,10 +22,9 @@ def propagate_category_attribute_to_children(sender, instance: CategoryAttribute
     - On create: create the same attribute for all descendants and copy its values.
     - On update: update the fields on descendants and sync values additively.
     """
-    parent_category = instance.category
-    for child_category in _iter_descendant_categories(parent_category):
-        child_attr = _ensure_child_attribute(instance, child_category)
-        _sync_attribute_values(instance, child_attr)
+    if kwargs.get('raw', False) or is_propagating():
+        return
+    schedule_attribute_propagation(instance.pk)
 
 
 @receiver(post_save, sender=AttributeValue)
@@ -90,24 +33,9 @@ def propagate_attribute_value_to_children(sender, instance: AttributeValue, crea
 
     Keeps value records (by value text) present on all child attributes.
     """
-    parent_attr = instance.attribute
-    parent_category = parent_attr.category
-
-    for child_category in _iter_descendant_categories(parent_category):
-        try:
-            child_attr = CategoryAttribute.objects.get(category=child_category, key=parent_attr.key)
-        except CategoryAttribute.DoesNotExist:
-            # Create the child attribute if missing, then sync
-            child_attr = _ensure_child_attribute(parent_attr, child_category)
-
-        cval, created_val = AttributeValue.objects.get_or_create(
-            attribute=child_attr,
-            value=instance.value,
-            defaults={'display_order': instance.display_order},
-        )
-        if not created_val and cval.display_order != instance.display_order:
-            cval.display_order = instance.display_order
-            cval.save(update_fields=['display_order'])
+    if kwargs.get('raw', False) or is_propagating():
+        return
+    schedule_attribute_propagation(instance.attribute_id)
 
 
 @receiver(post_delete, sender=AttributeValue)
@@ -116,15 +44,14 @@ def delete_attribute_value_from_children(sender, instance: AttributeValue, **kwa
 
     This keeps child attributes' allowed value sets aligned with the parent.
     """
-    parent_attr = instance.attribute
-    parent_category = parent_attr.category
-
-    for child_category in _iter_descendant_categories(parent_category):
-        try:
-            child_attr = CategoryAttribute.objects.get(category=child_category, key=parent_attr.key)
-        except CategoryAttribute.DoesNotExist:
-            continue
-        AttributeValue.objects.filter(attribute=child_attr, value=instance.value).delete()
+    if is_propagating():
+        return
+    try:
+        parent_attr = instance.attribute
+    except CategoryAttribute.DoesNotExist:
+        # The attribute itself is being deleted (cascade), nothing to propagate
+        return
+    schedule_value_removal(parent_attr.category_id, parent_attr.key, instance.value)
 
 
 @receiver(post_save, sender=Category)
@@ -138,59 +65,55 @@ def inherit_parent_attributes_for_new_category(sender, instance: Category, creat
     if kwargs.get('raw', False):
         return
         
-    if not created or not instance.parent:
+    if not created or not instance.parent_id:
         return
 
-    try:
-        parent_category = instance.parent
-    except Category.DoesNotExist:
-        # Parent not loaded yet (during fixture loading)
-        return
-    parent_attrs = CategoryAttribute.objects.filter(category=parent_category)
-    for parent_attr in parent_attrs:
-        child_attr = _ensure_child_attribute(parent_attr, instance)
-        _sync_attribute_values(parent_attr, child_attr)
+    inherit_from_parent(instance)
 
 
 def update_product_special_offer_status(product):
     """Update the is_in_special_offers status for a product based on active offers"""
-    now = timezone.now()
-    
-    # Check if product has any active special offers
-    has_active_offers = SpecialOfferProduct.objects.filter(
-        product=product,
-        offer__enabled=True,
-        offer__is_active=True,
-        offer__valid_from__lte=now,
-        offer__valid_until__gte=now
-    ).exists()
-    
-    # Update the boolean field if it's different
-    if product.is_in_special_offers != has_active_offers:
-        product.is_in_special_offers = has_active_offers
-        product.save(update_fields=['is_in_special_offers'])
+    refresh_special_offer_flags(product_ids=[product.pk])
 
 
 @receiver(post_save, sender=SpecialOfferProduct)
 def update_product_on_offer_add(sender, instance: SpecialOfferProduct, created, **kwargs):
     """Update product's is_in_special_offers when added to or modified in a special offer"""
-    update_product_special_offer_status(instance.product)
+    refresh_special_offer_flags(product_ids=[instance.product_id])
 
 
 @receiver(post_delete, sender=SpecialOfferProduct)
 def update_product_on_offer_remove(sender, instance: SpecialOfferProduct, **kwargs):
     """Update product's is_in_special_offers when removed from a special offer"""
-    update_product_special_offer_status(instance.product)
+    refresh_special_offer_flags(product_ids=[instance.product_id])
 
 
 @receiver(post_save, sender=SpecialOffer)
 def update_products_on_offer_change(sender, instance: SpecialOffer, created, **kwargs):
     """Update all products when a special offer is modified (enabled/disabled, dates changed)"""
-    # Get all products in this offer
-    products = Product.objects.filter(specialofferproduct__offer=instance)
-    
-    # Update each product's status
-    for product in products:
-        update_product_special_offer_status(product)
+    offer_products = SpecialOfferProduct.objects.filter(offer=instance).values('product_id')
+    refresh_special_offer_flags(product_ids=offer_products)
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def update_order_totals_on_item_change(sender, instance: OrderItem, **kwargs):
+    """Keep Order.total and Order.item_count in sync when order items change"""
+    if kwargs.get('raw', False):
+        return
+    try:
+        # Use the cached order when available so callers holding it see the new totals
+        order = instance.order
+    except Order.DoesNotExist:
+        # Order is being deleted along with its items
+        return
+    order.update_totals()
 
 
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_delete, sender=ProductVariantImage)
+def release_image_file(sender, instance, **kwargs):
+    """Drop the deleted row's reference to its content-addressed file (removed with the last one)"""
+    name = instance.image.name
+    if is_content_addressed(name):
+        instance.image.storage.delete(name)
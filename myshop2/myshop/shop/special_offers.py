@@ -0,0 +1,56 @@
+"""
+Special Offer Status
+Keeps Product.is_in_special_offers in sync with the currently running special offers using
+two set-based UPDATEs, and works out when the next offer starts or ends so the flags can be
+refreshed exactly at that boundary instead of going stale.
+"""
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .models import Product, SpecialOffer, SpecialOfferProduct
+
+
+def running_offer_filter(now, prefix=''):
+    """Q object matching offers that are enabled, active and inside their validity window"""
+    return (
+        Q(**{f'{prefix}enabled': True, f'{prefix}is_active': True, f'{prefix}valid_from__lte': now})
+        & (Q(**{f'{prefix}valid_until__isnull': True}) | Q(**{f'{prefix}valid_until__gte': now}))
+    )
+
+
+def refresh_special_offer_flags(product_ids=None, now=None, dry_run=False):
+    """
+    Flip is_in_special_offers for products whose offer status changed.
+
+    product_ids may be a list or a values() queryset to limit the refresh; by default every
+    product is checked. Returns (turned_on, turned_off) counts.
+    """
+    now = now or timezone.now()
+    in_running_offer = SpecialOfferProduct.objects.filter(
+        running_offer_filter(now, prefix='offer__')
+    ).values('product_id')
+
+    products = Product.objects.all()
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+
+    to_enable = products.filter(is_in_special_offers=False, id__in=in_running_offer)
+    to_disable = products.filter(is_in_special_offers=True).exclude(id__in=in_running_offer)
+
+    if dry_run:
+        return to_enable.count(), to_disable.count()
+    return (
+        to_enable.update(is_in_special_offers=True),
+        to_disable.update(is_in_special_offers=False),
+    )
+
+
+def next_offer_boundary(now=None):
+    """Return the next time an enabled offer starts or ends, or None if nothing is scheduled"""
+    now = now or timezone.now()
+    boundaries = SpecialOffer.objects.filter(enabled=True, is_active=True).aggregate(
+        next_start=Min('valid_from', filter=Q(valid_from__gt=now)),
+        next_end=Min('valid_until', filter=Q(valid_until__gt=now)),
+    )
+    upcoming = [value for value in boundaries.values() if value is not None]
+    return min(upcoming) if upcoming else None
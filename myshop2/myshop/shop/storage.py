@@ -0,0 +1,119 @@
+"""
+Content-Addressed Media Storage
+Stores uploaded files under their SHA-256 (cas/ab/cd/<hash>.<ext>) on top of the default
+storage, so identical bytes uploaded for different products, variants or by different
+suppliers are kept once. MediaBlob rows count the references; the file is only removed
+from the backend when the last reference is deleted.
+"""
+import os
+
+from django.core.files.storage import Storage, default_storage
+from django.db import transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+from .utils import hash_file
+
+CAS_PREFIX = 'cas'
+
+
+def cas_name(digest, extension=''):
+    return f"{CAS_PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}{extension.lower()}"
+
+
+def is_content_addressed(name):
+    return bool(name) and name.startswith(f"{CAS_PREFIX}/")
+
+
+@deconstructible
+class ContentAddressedStorage(Storage):
+    """Storage wrapper that dedups by content hash and reference-counts stored files"""
+
+    def __init__(self, backend=None):
+        self._backend = backend
+
+    @property
+    def backend(self):
+        return self._backend or default_storage
+
+    def get_available_name(self, name, max_length=None):
+        # The final name comes from the content hash, never from the upload name
+        return name
+
+    def generate_filename(self, filename):
+        return filename
+
+    def _save(self, name, content):
+        from .models import MediaBlob
+
+        digest = hash_file(content)
+        target = cas_name(digest, os.path.splitext(name)[1])
+
+        with transaction.atomic():
+            if not MediaBlob.objects.filter(name=target).exists() and not self.backend.exists(target):
+                stored = self.backend.save(target, content)
+                if stored != target:
+                    # Backends that refuse to overwrite may rename; keep the canonical name
+                    self.backend.delete(stored)
+            # A concurrent first upload of the same bytes may create the row meanwhile;
+            # get_or_create falls back to the existing row instead of raising IntegrityError
+            blob, created = MediaBlob.objects.get_or_create(name=target, defaults={
+                'sha256': digest,
+                'size': getattr(content, 'size', None) or self.backend.size(target),
+                'ref_count': 1,
+            })
+            if not created:
+                MediaBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+        return target
+
+    def delete(self, name):
+        """Drop one reference; the file itself goes away with the last one"""
+        from .models import MediaBlob
+
+        if not is_content_addressed(name):
+            self.backend.delete(name)
+            return
+
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+            if blob is not None and blob.ref_count > 1:
+                MediaBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+                return
+            if blob is not None:
+                blob.delete()
+
+            def delete_if_unreferenced():
+                # A concurrent upload of the same bytes may have re-created the blob meanwhile
+                if not MediaBlob.objects.filter(name=name).exists():
+                    self.backend.delete(name)
+
+            transaction.on_commit(delete_if_unreferenced)
+
+    def _open(self, name, mode='rb'):
+        return self.backend.open(name, mode)
+
+    def exists(self, name):
+        return self.backend.exists(name)
+
+    def url(self, name):
+        return self.backend.url(name)
+
+    def size(self, name):
+        return self.backend.size(name)
+
+    def path(self, name):
+        return self.backend.path(name)
+
+    def listdir(self, path):
+        return self.backend.listdir(path)
+
+    def get_modified_time(self, name):
+        return self.backend.get_modified_time(name)
+
+
+_storage = ContentAddressedStorage()
+
+
+def content_addressed_storage():
+    """Callable used as the storage of image fields (keeps migrations free of settings)"""
+    return _storage
@@ -1,3 +1,5 @@
+from io import StringIO
+
 from django.test import TestCase
 from django.core.management import call_command
 from shop.models import Category, CategoryAttribute, AttributeValue
@@ -137,3 +139,929 @@ class CategoryAttributeInheritanceTest(TestCase):
             2, 
             "Two attributes should be inherited for the specific category"
         )
+
+
+class AttributePropagationTest(TestCase):
+    def setUp(self):
+        self.root = Category.objects.create(name='پوشاک')
+        self.children = [
+            Category.objects.create(name=f'زیردسته {i}', parent=self.root) for i in range(5)
+        ]
+        self.grandchild = Category.objects.create(name='نوه', parent=self.children[0])
+        self.attr = CategoryAttribute.objects.create(category=self.root, key='size', type='select', label_fa='سایز')
+
+    def test_value_propagation_uses_constant_queries(self):
+        # Insert, attribute lookup, one query per tree level, value diff and one bulk insert
+        with self.assertNumQueries(11):
+            AttributeValue.objects.create(attribute=self.attr, value='XL', display_order=3)
+
+        for category in self.children + [self.grandchild]:
+            value = AttributeValue.objects.get(attribute__category=category, attribute__key='size', value='XL')
+            self.assertEqual(value.display_order, 3)
+
+    def test_attribute_update_and_value_delete_propagate(self):
+        value = AttributeValue.objects.create(attribute=self.attr, value='M', display_order=1)
+        self.attr.label_fa = 'اندازه'
+        self.attr.save()
+        self.assertEqual(
+            CategoryAttribute.objects.filter(key='size', label_fa='اندازه').count(), 7
+        )
+
+        value.delete()
+        self.assertFalse(AttributeValue.objects.filter(value='M').exists())
+
+    def test_reconcile_repairs_drift(self):
+        AttributeValue.objects.create(attribute=self.attr, value='S', display_order=1)
+        AttributeValue.objects.filter(attribute__category=self.grandchild).delete()
+        CategoryAttribute.objects.filter(category=self.children[1]).update(required=True)
+
+        out = StringIO()
+        call_command('reconcile_category_attributes', '--dry-run', stdout=out)
+        self.assertIn('DRY RUN', out.getvalue())
+        self.assertFalse(AttributeValue.objects.filter(attribute__category=self.grandchild).exists())
+
+        call_command('reconcile_category_attributes', stdout=out)
+        self.assertTrue(AttributeValue.objects.filter(attribute__category=self.grandchild, value='S').exists())
+        self.assertFalse(CategoryAttribute.objects.filter(key='size', required=True).exists())
+
+
+class SessionWriteTest(TestCase):
+    def setUp(self):
+        from django.test import RequestFactory
+        from myshop.sessions import SessionStore
+
+        self.request = RequestFactory().get('/')
+        self.request.session = SessionStore()
+
+    def test_basket_read_does_not_modify_session(self):
+        from shop.api_views import _get_session_basket, _save_session_basket
+
+        basket = _get_session_basket(self.request)
+        self.assertEqual(basket['items'], {})
+        self.assertFalse(self.request.session.modified)
+
+        # Saving an unchanged basket is a no-op
+        self.assertFalse(_save_session_basket(self.request, basket))
+        self.assertFalse(self.request.session.modified)
+
+        basket['items']['5'] = 2
+        self.assertTrue(_save_session_basket(self.request, basket))
+        self.assertTrue(self.request.session.modified)
+
+    def test_refresh_only_when_stale(self):
+        import time
+        from myshop.sessions import SessionStore
+
+        self.request.session['foo'] = 'bar'
+        self.request.session.save()
+
+        session = SessionStore(self.request.session.session_key)
+        self.assertFalse(session.needs_refresh())
+
+        session = SessionStore(self.request.session.session_key)
+        session._get_session()[SessionStore.refresh_key] = time.time() - SessionStore.get_refresh_after() - 1
+        self.assertTrue(session.needs_refresh())
+
+
+class OrderTotalsTest(TestCase):
+    def setUp(self):
+        from shop.models import Order, Product
+
+        category = Category.objects.create(name='ساعت')
+        self.product = Product.objects.create(name='Watch', price_toman=1000, category=category)
+        self.order = Order.objects.create(
+            first_name='Ali', last_name='Rezaei', email='ali@example.com',
+            address='Tehran', postal_code='12345', city='Tehran',
+        )
+
+    def test_totals_follow_item_changes(self):
+        from shop.models import Order, OrderItem
+
+        item = OrderItem.objects.create(order=self.order, product=self.product, price=1000, quantity=2)
+        OrderItem.objects.create(order=self.order, product=self.product, price=500, quantity=1)
+        self.assertEqual(self.order.get_total_cost(), 2500)
+
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual(order.total, 2500)
+        self.assertEqual(order.item_count, 3)
+
+        item.delete()
+        order.refresh_from_db()
+        self.assertEqual(order.total, 500)
+        self.assertEqual(order.item_count, 1)
+
+    def test_order_detail_fetches_products_in_one_query(self):
+        from django.db import connection
+        from django.test import Client
+        from django.test.utils import CaptureQueriesContext
+        from shop.models import OrderItem, Product
+
+        for price in (100, 200, 300):
+            product = Product.objects.create(name=f'Watch {price}', price_toman=price, category=self.product.category)
+            OrderItem.objects.create(order=self.order, product=product, price=price, quantity=1)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = Client().get(f'/shop/api/orders/{self.order.pk}/')
+        self.assertEqual(len(response.json()['order']['items']), 3)
+        product_queries = [q for q in queries.captured_queries if 'FROM "shop_product" ' in q['sql']]
+        self.assertEqual(len(product_queries), 1)
+
+    def test_streaming_export_includes_lines(self):
+        import gzip
+        import json
+        from django.test import Client
+        from shop.models import OrderItem
+
+        OrderItem.objects.create(order=self.order, product=self.product, price=1000, quantity=2)
+        client = Client()
+
+        response = client.get('/shop/api/orders/export/csv/')
+        self.assertEqual(response.status_code, 200)
+        rows = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(len(rows), 2)
+        self.assertIn('Watch', rows[1])
+
+        response = client.get('/shop/api/orders/export/', {'output': 'ndjson', 'gzip': '1', 'paid': 'false'})
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode('utf-8').splitlines()
+        order = json.loads(lines[0])
+        self.assertEqual(order['grand_total'], 2000)
+        self.assertEqual(order['items'][0]['quantity'], 2)
+
+        response = client.get('/shop/api/orders/export/', {'date_from': 'not-a-date'})
+        self.assertEqual(response.status_code, 400)
+
+
+class SpecialOfferStatusTest(TestCase):
+    def setUp(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from shop.models import Product, SpecialOffer
+
+        self.now = timezone.now()
+        category = Category.objects.create(name='ساعت')
+        self.products = [
+            Product.objects.create(name=f'Watch {i}', price_toman=1000, category=category) for i in range(3)
+        ]
+        self.offer = SpecialOffer.objects.create(
+            title='Flash', offer_type='flash_sale', display_style='grid',
+            valid_from=self.now - timedelta(hours=1), valid_until=self.now + timedelta(hours=2),
+        )
+
+    def test_signals_and_boundaries(self):
+        from datetime import timedelta
+        from shop.models import Product, SpecialOfferProduct
+        from shop.special_offers import next_offer_boundary, refresh_special_offer_flags
+
+        SpecialOfferProduct.objects.create(offer=self.offer, product=self.products[0], original_price=1000)
+        SpecialOfferProduct.objects.create(offer=self.offer, product=self.products[1], original_price=1000)
+        self.assertEqual(Product.objects.filter(is_in_special_offers=True).count(), 2)
+        self.assertEqual(next_offer_boundary(self.now), self.offer.valid_until)
+
+        # After valid_until passes, one refresh flips both products back with set-based updates
+        with self.assertNumQueries(2):
+            turned_on, turned_off = refresh_special_offer_flags(now=self.now + timedelta(hours=3))
+        self.assertEqual((turned_on, turned_off), (0, 2))
+        self.assertIsNone(next_offer_boundary(self.now + timedelta(hours=3)))
+
+        self.offer.enabled = False
+        self.offer.save()
+        refresh_special_offer_flags(now=self.now)
+        self.assertFalse(Product.objects.filter(is_in_special_offers=True).exists())
+
+
+class ProductDirtyFieldsTest(TestCase):
+    def setUp(self):
+        from shop.models import Product
+
+        self.watches = Category.objects.create(name='ساعت')
+        self.shoes = Category.objects.create(name='کفش')
+        Product.objects.create(name='Watch', price_toman=1000, category=self.watches)
+
+    def test_save_uses_snapshot_instead_of_select(self):
+        from shop.models import Product
+
+        product = Product.objects.get(name='Watch')
+        self.assertEqual(product.changed_fields, set())
+
+        product.stock_quantity = 5
+        self.assertEqual(product.changed_fields, {'stock_quantity'})
+        with self.assertNumQueries(1):
+            product.save()
+        self.assertEqual(product.changed_fields, set())
+
+        with self.assertNumQueries(1):
+            product.mark_as_new_arrival()
+
+    def test_category_change_still_cleans_up(self):
+        from shop.models import Product, ProductAttribute
+
+        CategoryAttribute.objects.create(category=self.watches, key='movement', label_fa='موومنت')
+        product = Product.objects.get(name='Watch')
+        ProductAttribute.objects.create(product=product, key='movement', value='Automatic')
+
+        product.category = self.shoes
+        self.assertIn('category', product.changed_fields)
+        product.save()
+        self.assertFalse(ProductAttribute.objects.filter(product=product).exists())
+
+    def test_category_change_on_deferred_category_cleans_up(self):
+        from shop.models import Product, ProductAttribute
+
+        CategoryAttribute.objects.create(category=self.watches, key='movement', label_fa='موومنت')
+        product = Product.objects.only('name').get(name='Watch')
+        ProductAttribute.objects.create(product=product, key='movement', value='Automatic')
+
+        product.category = self.shoes
+        product.save()
+        self.assertFalse(ProductAttribute.objects.filter(product=product).exists())
+
+
+class ImagePipelineTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from shop.models import Product
+
+        self.media = tempfile.mkdtemp()
+        category = Category.objects.create(name='ساعت')
+        self.product = Product.objects.create(name='Watch', price_toman=1000, category=category)
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.media, ignore_errors=True)
+
+    def _upload(self, color='red'):
+        from io import BytesIO
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        buffer = BytesIO()
+        Image.new('RGB', (2400, 1200), color).save(buffer, format='PNG')
+        return SimpleUploadedFile('photo.png', buffer.getvalue(), content_type='image/png')
+
+    def test_upload_is_processed_after_commit(self):
+        import hashlib
+        import os
+        from django.test import override_settings
+        from shop.models import ProductImage
+
+        upload = self._upload()
+        original_hash = hashlib.sha256(upload.read()).hexdigest()
+        upload.seek(0)
+
+        with override_settings(MEDIA_ROOT=self.media, IMAGE_PROCESSING_ASYNC=True, IMAGE_PROCESSING_WORKERS=0):
+            with self.captureOnCommitCallbacks(execute=True):
+                image = ProductImage.create(product=self.product, image=upload, order=1)
+                self.assertEqual(image.processing_status, 'pending')
+                original_path = image.image.path
+
+            image.refresh_from_db()
+            self.assertEqual(image.processing_status, 'ready')
+            self.assertTrue(image.image.name.endswith('.webp'))
+            self.assertEqual(image.image_hash, original_hash)
+            self.assertFalse(os.path.exists(original_path))
+
+            # Dedup still keys on the original upload's hash
+            duplicate = ProductImage.create(product=self.product, image=self._upload(), order=2)
+            self.assertEqual(duplicate.pk, image.pk)
+
+    def test_pending_images_are_processed_by_the_pool(self):
+        from django.test import override_settings
+        from shop.models import ProductImage
+
+        with override_settings(MEDIA_ROOT=self.media, IMAGE_PROCESSING_ASYNC=True, IMAGE_PROCESSING_WORKERS=1):
+            # Commit callbacks are not run, like an upload whose server restarted before processing
+            image = ProductImage.create(product=self.product, image=self._upload('blue'), order=1)
+            call_command('process_pending_images', '--min-age', '0', stdout=StringIO())
+
+        image.refresh_from_db()
+        self.assertEqual(image.processing_status, 'ready')
+        self.assertTrue(image.image.name.endswith('.webp'))
+
+
+class ImageDerivativeTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from io import BytesIO
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.test import override_settings
+        from shop.models import Product, ProductImage
+
+        self.media = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media, IMAGE_PROCESSING_ASYNC=False)
+        self.settings_override.enable()
+
+        category = Category.objects.create(name='ساعت')
+        product = Product.objects.create(name='Watch', price_toman=1000, category=category)
+        buffer = BytesIO()
+        Image.new('RGB', (1000, 500), 'green').save(buffer, format='PNG')
+        self.image = ProductImage.create(
+            product=product, image=SimpleUploadedFile('photo.png', buffer.getvalue()), order=1
+        )
+
+    def tearDown(self):
+        import shutil
+        self.settings_override.disable()
+        shutil.rmtree(self.media, ignore_errors=True)
+
+    def test_srcset_and_lazy_generation(self):
+        import os
+        from PIL import Image
+        from django.test import Client
+        from shop.image_derivatives import build_srcset
+
+        payload = build_srcset('product', self.image)
+        entries = payload['srcset'].split(', ')
+        self.assertEqual([entry.rsplit(' ', 1)[1] for entry in entries], ['160w', '320w', '640w', '1280w'])
+
+        url = entries[1].rsplit(' ', 1)[0]
+        response = Client().get(url)
+        self.assertEqual(response.status_code, 302)
+        path = os.path.join(self.media, response['Location'].split('/media/', 1)[1])
+        with Image.open(path) as derivative:
+            self.assertEqual(derivative.size, (320, 160))
+            self.assertEqual(derivative.format, 'WEBP')
+
+        # Second request only looks up the source row
+        with self.assertNumQueries(1):
+            self.assertEqual(Client().get(url).status_code, 302)
+
+        self.assertEqual(Client().get(f'/shop/media/derivatives/product/{self.image.pk}/333.webp').status_code, 404)
+
+
+class ContentAddressedStorageTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        from shop.models import Product
+
+        self.media = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media, IMAGE_PROCESSING_ASYNC=False)
+        self.settings_override.enable()
+        category = Category.objects.create(name='ساعت')
+        self.products = [
+            Product.objects.create(name=f'Watch {i}', price_toman=1000, category=category) for i in range(2)
+        ]
+
+    def tearDown(self):
+        import shutil
+        self.settings_override.disable()
+        shutil.rmtree(self.media, ignore_errors=True)
+
+    def _upload(self):
+        from io import BytesIO
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        buffer = BytesIO()
+        Image.new('RGB', (64, 64), 'navy').save(buffer, format='PNG')
+        return SimpleUploadedFile('supplier.png', buffer.getvalue())
+
+    def test_identical_uploads_share_one_file(self):
+        import os
+        from shop.models import MediaBlob, ProductImage
+
+        first = ProductImage.create(product=self.products[0], image=self._upload(), order=1)
+        second = ProductImage.create(product=self.products[1], image=self._upload(), order=1)
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(first.image.name.startswith('cas/'))
+        self.assertEqual(MediaBlob.objects.get(name=first.image.name).ref_count, 2)
+
+        path = first.image.path
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(MediaBlob.objects.get(name=second.image.name).ref_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_deleting_one_product_image_keeps_the_shared_file(self):
+        import os
+        from django.urls import reverse
+        from shop.models import MediaBlob, ProductImage
+
+        first = ProductImage.create(product=self.products[0], image=self._upload(), order=1)
+        second = ProductImage.create(product=self.products[1], image=self._upload(), order=1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('shop:delete_product_image', args=[first.id]))
+        self.assertFalse(ProductImage.objects.filter(pk=first.pk).exists())
+        self.assertTrue(os.path.exists(second.image.path))
+        self.assertEqual(MediaBlob.objects.get(name=second.image.name).ref_count, 1)
+
+    def test_concurrent_first_upload_counts_a_reference(self):
+        from django.core.files.storage import default_storage
+        from shop.models import MediaBlob
+        from shop.storage import ContentAddressedStorage
+
+        class RacingBackend:
+            """Another upload of the same bytes commits its MediaBlob while this one stores the file"""
+            def exists(self, name):
+                MediaBlob.objects.create(name=name, sha256='x', size=1, ref_count=1)
+                return default_storage.exists(name)
+
+            def __getattr__(self, attr):
+                return getattr(default_storage, attr)
+
+        name = ContentAddressedStorage(RacingBackend()).save('supplier.png', self._upload())
+        self.assertEqual(MediaBlob.objects.get(name=name).ref_count, 2)
+
+    def test_hash_file_streams_and_rewinds(self):
+        import hashlib
+        from io import BytesIO
+        from shop.utils import hash_file
+
+        data = b'x' * 200000
+        stream = BytesIO(data)
+        self.assertEqual(hash_file(stream, chunk_size=1024), hashlib.sha256(data).hexdigest())
+        self.assertEqual(stream.tell(), 0)
+
+
+class SafeOpenImageTest(TestCase):
+    def _jpeg(self, size=(400, 300), orientation=None):
+        from io import BytesIO
+        from PIL import Image, ImageCms
+
+        exif = Image.Exif()
+        if orientation:
+            exif[0x0112] = orientation
+        icc = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+        output = BytesIO()
+        Image.new('RGB', size, 'red').save(output, format='JPEG', exif=exif, icc_profile=icc)
+        output.seek(0)
+        return output
+
+    def test_strips_profile_and_applies_orientation(self):
+        from shop.utils import safe_open_image
+
+        img = safe_open_image(self._jpeg(orientation=6))
+        self.assertNotIn('icc_profile', img.info)
+        self.assertEqual(img.size, (300, 400))
+
+    def test_draft_decodes_jpeg_at_reduced_scale(self):
+        from shop.utils import safe_open_image
+
+        img = safe_open_image(self._jpeg(size=(4000, 3000)), target_size=(1000, 1000))
+        img.load()
+        # Draft picks the smallest DCT scale that still covers the 1000x750 result
+        self.assertEqual(img.size, (1000, 750))
+
+    def test_palette_image_keeps_transparency(self):
+        from io import BytesIO
+        from PIL import Image
+        from shop.utils import safe_open_image
+
+        output = BytesIO()
+        Image.new('RGBA', (20, 20), (0, 0, 0, 0)).convert('P').save(output, format='PNG', transparency=0)
+        output.seek(0)
+        img = safe_open_image(output)
+        self.assertEqual(img.mode, 'P')
+        self.assertIn('transparency', img.info)
+
+
+class CatalogImportTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from shop.models import Attribute
+
+        self.tmp = tempfile.mkdtemp()
+        self.category = Category.objects.create(name='ساعت')
+        Attribute.objects.create(name='برند', key='brand')
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _write_catalog(self, products):
+        import json
+        import os
+        from PIL import Image
+
+        Image.new('RGB', (40, 30), 'red').save(os.path.join(self.tmp, 'watch.jpg'))
+        path = os.path.join(self.tmp, 'catalog.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(products, f)
+        return path
+
+    def test_import_and_resume_is_idempotent(self):
+        from django.test import override_settings
+        from shop.models import Product, ProductImage, ProductVariant
+
+        path = self._write_catalog([
+            {'sku': 'W-1', 'name': 'Watch 1', 'price_toman': '۱۲۰۰', 'category_id': self.category.id,
+             'attributes': {'brand': 'Casio'}, 'images': ['watch.jpg', 'watch.jpg'],
+             'variants': [{'sku': 'W-1-R', 'attributes': {'color': 'red'}}]},
+            {'sku': 'W-2', 'name': 'Watch 2', 'price_toman': 900, 'category': 'ساعت'},
+            {'sku': 'W-3', 'name': '', 'price_toman': 'abc', 'category_id': 999},
+        ])
+        out = StringIO()
+        with override_settings(MEDIA_ROOT=self.tmp):
+            call_command('import_catalog', path, '--workers', '0', '--batch-size', '2', stdout=out, stderr=out)
+            call_command('import_catalog', path, '--workers', '0', stdout=out, stderr=out)
+        self.assertIn('Row 2 (sku W-3)', out.getvalue())
+
+        self.assertEqual(Product.objects.count(), 2)
+        product = Product.objects.get(sku='W-1')
+        self.assertEqual(product.price_toman, 1200)
+        self.assertEqual(product.get_attribute_value('brand'), 'Casio')
+        self.assertEqual(ProductVariant.objects.get(product=product).price_toman, 1200)
+        # Duplicate image bytes within one product are stored once
+        self.assertEqual(ProductImage.objects.filter(product=product).count(), 1)
+        self.assertTrue(ProductImage.objects.get(product=product).image.name.endswith('.webp'))
+        # bulk_create skips save(), so the placeholder comes from the pool result
+        self.assertTrue(ProductImage.objects.get(product=product).placeholder.startswith('data:image/webp'))
+
+    def test_api_imports_only_read_images_under_the_configured_root(self):
+        import os
+        from django.contrib.auth import get_user_model
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.test import override_settings
+        from shop.catalog_import import run_catalog_import
+
+        admin = get_user_model().objects.create_user(email='admin@example.com', password='x', is_staff=True)
+        self.client.force_login(admin)
+        upload = SimpleUploadedFile('catalog.json', b'[]', content_type='application/json')
+        with override_settings(CATALOG_IMPORT_IMAGE_ROOT=os.path.join(self.tmp, 'images')):
+            response = self.client.post('/shop/api/admin/catalog-import/', {'file': upload, 'image_root': '../..'})
+        self.assertEqual(response.status_code, 400)
+
+        # Paths inside the catalog cannot leave the root either
+        path = self._write_catalog([
+            {'sku': 'W-1', 'name': 'Watch 1', 'price_toman': 100, 'category_id': self.category.id,
+             'images': [os.path.join(self.tmp, 'watch.jpg')]},
+            {'sku': 'W-2', 'name': 'Watch 2', 'price_toman': 100, 'category_id': self.category.id,
+             'images': ['../watch.jpg']},
+        ])
+        os.makedirs(os.path.join(self.tmp, 'images'))
+        stats = run_catalog_import(path, workers=0, image_root=os.path.join(self.tmp, 'images'),
+                                   confine_images=True, dry_run=True)
+        self.assertEqual(stats['failed'], 2)
+        self.assertIn('outside the import directory', str(stats['errors']))
+
+
+class BulkAttributeWriterTest(TestCase):
+    def setUp(self):
+        from shop.models import Attribute, NewAttributeValue, Product
+
+        category = Category.objects.create(name='ساعت')
+        self.products = [Product.objects.create(name=f'Watch {i}', price_toman=100, category=category) for i in range(3)]
+        self.brand = Attribute.objects.create(name='برند', key='brand')
+        self.size = Attribute.objects.create(name='سایز', key='size')
+        self.casio = NewAttributeValue.objects.create(attribute=self.brand, value='Casio')
+
+    def test_bulk_set_normalizes_and_upserts(self):
+        from shop.models import Product, ProductAttributeValue
+
+        self.products[0].set_attribute_value('brand', 'Old')
+        assignments = {p: {'brand': 'Casio', 'size': '۴۲‌ mm', 'missing': 'x'} for p in self.products}
+
+        with self.assertNumQueries(3):
+            outcomes = Product.bulk_set_attribute_values(assignments)
+
+        statuses = {(o['product_id'], o['attribute_key']): o['status'] for o in outcomes}
+        self.assertEqual(statuses[(self.products[0].pk, 'brand')], 'predefined')
+        self.assertEqual(statuses[(self.products[0].pk, 'size')], 'custom')
+        self.assertEqual(statuses[(self.products[0].pk, 'missing')], 'error')
+
+        self.assertEqual(ProductAttributeValue.objects.count(), 6)
+        pav = ProductAttributeValue.objects.get(product=self.products[0], attribute=self.brand)
+        self.assertEqual(pav.attribute_value, self.casio)
+        self.assertIsNone(pav.custom_value)
+        self.assertEqual(self.products[1].get_attribute_value('size'), '42 mm')
+
+
+class PerceptualHashTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        from shop.models import Product
+
+        self.media = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media, IMAGE_PROCESSING_ASYNC=False)
+        self.settings_override.enable()
+        category = Category.objects.create(name='کفش')
+        self.products = [
+            Product.objects.create(name=f'Boot {i}', price_toman=1000, category=category) for i in range(3)
+        ]
+
+    def tearDown(self):
+        import shutil
+        self.settings_override.disable()
+        shutil.rmtree(self.media, ignore_errors=True)
+
+    def _photo(self, size=(400, 300), flip=False):
+        from PIL import Image
+        gradient = Image.linear_gradient('L').resize(size)
+        img = Image.merge('RGB', (gradient, gradient.rotate(90).resize(size), gradient))
+        if flip:
+            img = img.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+        return img
+
+    def _upload(self, img, name, fmt, **params):
+        from io import BytesIO
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        buffer = BytesIO()
+        img.save(buffer, format=fmt, **params)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def test_reencoded_copy_is_found_and_grouped(self):
+        from shop.models import ProductImage
+        from shop.perceptual_hash import find_similar_images, from_hex, near_duplicate_report
+
+        original = ProductImage.create(
+            product=self.products[0], image=self._upload(self._photo(), 'boot.png', 'PNG'), order=1
+        )
+        resized = ProductImage.create(
+            product=self.products[1],
+            image=self._upload(self._photo((200, 150)), 'boot.jpg', 'JPEG', quality=40),
+            order=1,
+        )
+        different = ProductImage.create(
+            product=self.products[2], image=self._upload(self._photo(flip=True), 'other.png', 'PNG'), order=1
+        )
+        self.assertNotEqual(original.image_hash, resized.image_hash)
+        self.assertEqual(resized.perceptual_group, original.perceptual_group)
+        self.assertNotEqual(different.perceptual_group, original.perceptual_group)
+
+        matches = find_similar_images(from_hex(resized.perceptual_hash), exclude=[('product', resized.pk)])
+        self.assertEqual([m['id'] for m in matches], [original.pk])
+
+        report = near_duplicate_report()
+        self.assertEqual(len(report), 1)
+        self.assertEqual({image['id'] for image in report[0]['images']}, {original.pk, resized.pk})
+        self.assertEqual(report[0]['products'], 2)
+
+    def test_grouping_is_transitive(self):
+        from shop.perceptual_hash import group_near_duplicates
+
+        base = 0x0123456789ABCDEF
+        entries = [
+            ('a', base),
+            ('b', base ^ 0b111),            # 3 bits from a
+            ('c', base ^ 0b111 ^ 0b111000),  # 3 bits from b, 6 from a
+            ('d', ~base & (2 ** 64 - 1)),
+        ]
+        self.assertEqual(group_near_duplicates(entries, threshold=3), [['a', 'b', 'c']])
+        self.assertEqual(group_near_duplicates(entries, threshold=2), [])
+
+
+class PlaceholderTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        from shop.models import Product
+
+        self.media = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media, IMAGE_PROCESSING_ASYNC=False)
+        self.settings_override.enable()
+        category = Category.objects.create(name='کیف')
+        self.product = Product.objects.create(name='Bag', price_toman=1000, category=category)
+
+    def tearDown(self):
+        import shutil
+        self.settings_override.disable()
+        shutil.rmtree(self.media, ignore_errors=True)
+
+    def _upload(self, name='bag.jpg', size=(2400, 1600)):
+        from io import BytesIO
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        buffer = BytesIO()
+        Image.new('RGB', size, (180, 40, 40)).save(buffer, format='JPEG')
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def test_placeholder_is_a_tiny_webp(self):
+        import base64
+        from io import BytesIO
+        from PIL import Image
+        from shop.models import ProductImage
+        from shop.utils import PLACEHOLDER_SIZE
+
+        image = ProductImage.create(product=self.product, image=self._upload(), order=1)
+        prefix = 'data:image/webp;base64,'
+        self.assertTrue(image.placeholder.startswith(prefix))
+        self.assertLess(len(image.placeholder), 500)
+
+        decoded = Image.open(BytesIO(base64.b64decode(image.placeholder[len(prefix):])))
+        self.assertEqual(decoded.size, (PLACEHOLDER_SIZE, round(PLACEHOLDER_SIZE * 1600 / 2400)))
+
+    def test_command_backfills_missing_placeholders(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from shop.models import ProductImage, SpecialOffer
+
+        image = ProductImage.create(product=self.product, image=self._upload(), order=1)
+        ProductImage.objects.filter(pk=image.pk).update(placeholder='')
+        offer = SpecialOffer.objects.create(
+            title='Sale',
+            valid_from=timezone.now(),
+            valid_until=timezone.now() + timedelta(days=1),
+            banner_image=self._upload('banner.jpg', (1200, 400)),
+        )
+        self.assertTrue(offer.banner_placeholder)
+        SpecialOffer.objects.filter(pk=offer.pk).update(banner_placeholder='')
+
+        out = StringIO()
+        call_command('generate_placeholders', workers=0, stdout=out)
+        self.assertIn('Generated 2 placeholders', out.getvalue())
+        image.refresh_from_db()
+        offer.refresh_from_db()
+        self.assertTrue(image.placeholder.startswith('data:image/webp'))
+        self.assertTrue(offer.banner_placeholder.startswith('data:image/webp'))
+
+
+class ReencodeMediaTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        from shop.models import Product
+
+        self.media = tempfile.mkdtemp()
+        self.checkpoint = f"{self.media}/checkpoint.json"
+        self.settings_override = override_settings(MEDIA_ROOT=self.media, IMAGE_PROCESSING_ASYNC=False)
+        self.settings_override.enable()
+        category = Category.objects.create(name='ساعت')
+        self.product = Product.objects.create(name='Watch', price_toman=1000, category=category)
+
+    def tearDown(self):
+        import shutil
+        self.settings_override.disable()
+        shutil.rmtree(self.media, ignore_errors=True)
+
+    def _legacy_image(self, name, angle=90):
+        """A product image stored as an uncompressed PNG, like rows from before compress_image"""
+        from io import BytesIO
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from shop.models import ProductImage
+
+        noise = Image.effect_noise((900, 700), 40)
+        buffer = BytesIO()
+        Image.merge('RGB', (noise, noise.rotate(angle), noise)).save(buffer, format='PNG')
+        image = ProductImage(product=self.product, image=SimpleUploadedFile(name, buffer.getvalue()), order=angle)
+        image.save(compress=False)
+        return image
+
+    def _run(self, **options):
+        out = StringIO()
+        call_command('reencode_media', workers=0, checkpoint=self.checkpoint, stdout=out, stderr=StringIO(), **options)
+        return out.getvalue()
+
+    def test_dry_run_projects_without_changing_files(self):
+        image = self._legacy_image('old.png')
+        output = self._run(dry_run=True)
+        self.assertIn('product: 1 files', output)
+        self.assertIn('DRY RUN: 1 files would be re-encoded', output)
+        image.refresh_from_db()
+        self.assertTrue(image.image.name.endswith('.png'))
+
+    def test_reencodes_and_resumes_from_checkpoint(self):
+        import json
+        import os
+
+        first = self._legacy_image('first.png')
+        second = self._legacy_image('second.png', angle=180)
+        old_size, old_hash = first.image.size, first.image_hash
+
+        self._run(only=['product'], limit=1)
+        with open(self.checkpoint) as f:
+            self.assertEqual(json.load(f), {'product': first.pk})
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertTrue(first.image.name.endswith('.webp'))
+        self.assertLess(first.image.size, old_size)
+        self.assertEqual(first.image_hash, old_hash)
+        self.assertTrue(second.image.name.endswith('.png'))
+
+        output = self._run(only=['product'])
+        self.assertIn('Resuming from', output)
+        self.assertIn('Re-encoded 1 files', output)
+        second.refresh_from_db()
+        self.assertTrue(second.image.name.endswith('.webp'))
+        self.assertTrue(second.placeholder)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+
+class OrphanedMediaSweepTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        from shop.models import Product
+
+        self.media = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media, IMAGE_PROCESSING_ASYNC=False)
+        self.settings_override.enable()
+        category = Category.objects.create(name='عینک')
+        self.product = Product.objects.create(name='Glasses', price_toman=1000, category=category)
+
+    def tearDown(self):
+        import shutil
+        self.settings_override.disable()
+        shutil.rmtree(self.media, ignore_errors=True)
+
+    def _write(self, name, age_hours=48):
+        import os
+        import time
+
+        path = os.path.join(self.media, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x' * 10)
+        stamp = time.time() - age_hours * 3600
+        os.utime(path, (stamp, stamp))
+        return path
+
+    def test_unreferenced_files_are_quarantined(self):
+        import os
+        from io import BytesIO
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from shop.image_derivatives import derivative_name, source_version
+        from shop.models import ProductImage
+
+        buffer = BytesIO()
+        Image.new('RGB', (50, 50), (10, 200, 10)).save(buffer, format='PNG')
+        image = ProductImage.create(product=self.product, image=SimpleUploadedFile('g.png', buffer.getvalue()))
+        kept = [
+            self._write(image.image.name),
+            self._write(derivative_name('product', image.pk, source_version(image, 'image'), 320, 'webp')),
+        ]
+        orphans = [
+            self._write('product_images/deleted.jpg'),
+            self._write('edited_images/edited/edited_old.png'),
+            self._write(derivative_name('product', image.pk, 'stale', 320, 'webp')),
+            self._write('cas/ff/ff/ff00.webp'),
+        ]
+        recent = self._write('product_images/just_uploaded.jpg', age_hours=0)
+
+        out = StringIO()
+        call_command('sweep_orphaned_media', dry_run=True, chunk_size=2, stdout=out)
+        self.assertIn('DRY RUN: 4 orphaned files', out.getvalue())
+        self.assertTrue(all(os.path.exists(path) for path in orphans))
+
+        out = StringIO()
+        call_command('sweep_orphaned_media', chunk_size=2, stdout=out)
+        self.assertIn('1 within the grace period', out.getvalue())
+        self.assertTrue(all(os.path.exists(path) for path in kept + [recent]))
+        self.assertFalse(any(os.path.exists(path) for path in orphans))
+        quarantined = [name for _, _, files in os.walk(os.path.join(self.media, 'quarantine')) for name in files]
+        self.assertEqual(sorted(quarantined), sorted(os.path.basename(path) for path in orphans))
+
+    def test_external_sort_merges_spilled_chunks(self):
+        from shop.media_sweep import external_sort
+
+        lines = [f"name{i % 7}" for i in range(50)]
+        self.assertEqual(list(external_sort(lines, chunk_size=3)), sorted(set(lines)))
+
+
+class RateLimitTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+
+    def test_sliding_window_weights_previous_window(self):
+        from shop.rate_limiting import hit
+
+        for second in range(5):
+            self.assertTrue(hit('test', 'ip:1.2.3.4', 5, 60, now=6000 + second).allowed)
+        rejected = hit('test', 'ip:1.2.3.4', 5, 60, now=6010)
+        self.assertFalse(rejected.allowed)
+        self.assertEqual(rejected.retry_after, 50)
+
+        # Halfway through the next window half of the previous hits still count
+        result = hit('test', 'ip:1.2.3.4', 5, 60, now=6090)
+        self.assertTrue(result.allowed)
+        self.assertEqual(result.remaining, 1)
+
+    def test_concurrent_hits_are_not_lost(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from shop.rate_limiting import hit
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(lambda _: hit('test', 'ip:1.2.3.4', 40, 60, now=6000), range(100)))
+        self.assertEqual(sum(result.allowed for result in results), 40)
+
+    def test_middleware_keys_by_rule_not_path(self):
+        from shop.middleware import GlobalRateLimitMiddleware
+
+        middleware = GlobalRateLimitMiddleware(lambda request: None)
+        rule_id, max_requests, window, _ = middleware._get_rate_limit('/shop/api/customer/orders/1/')
+        self.assertEqual(middleware._get_rate_limit('/shop/api/customer/orders/2/')[0], rule_id)
+        self.assertEqual(middleware._get_rate_limit('/shop/api/customer/orders/2/cancel/')[0], 'order-cancellation')
+        self.assertIsNone(middleware._get_rate_limit('/shop/products/'))
+        self.assertTrue(middleware._is_excluded('/static/app.css'))
+
+        for order in range(max_requests):
+            response = self.client.get(f'/shop/api/customer/orders/{order}/')
+        self.assertEqual(response['RateLimit-Remaining'], '0')
+        self.assertEqual(response['RateLimit-Policy'], f'{max_requests};w={window}')
+
+        response = self.client.get('/shop/api/customer/orders/999/')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
@@ -15,8 +15,9 @@ from .api_views import (
     SpecialOffersByTypeAPIView, FlashSalesAPIView, DiscountsAPIView, BundleDealsAPIView, FreeShippingAPIView, 
     SeasonalOffersAPIView, ClearanceOffersAPIView, CouponOffersAPIView, AdminSpecialOffersAPIView, 
     AdminSpecialOfferDetailAPIView, AdminSpecialOfferProductsAPIView, ProductsWithSaleInfoAPIView,
+    AdminCatalogImportAPIView, AdminCatalogImportStatusAPIView,
     # Order APIs
-    api_orders_list, api_orders_detail, api_orders_update_paid, api_orders_export_csv,
+    api_orders_list, api_orders_detail, api_orders_update_paid, api_orders_export, api_orders_export_csv,
     # Product Variants APIs
     api_products_with_variants, api_product_variants, api_variants_by_attributes
 )
@@ -155,15 +156,21 @@ urlpatterns = [
     path('api/admin/special-offers/', AdminSpecialOffersAPIView.as_view(), name='admin_special_offers'),
     path('api/admin/special-offers/<int:offer_id>/', AdminSpecialOfferDetailAPIView.as_view(), name='admin_special_offer_detail'),
     path('api/admin/special-offers/<int:offer_id>/products/', AdminSpecialOfferProductsAPIView.as_view(), name='admin_special_offer_products'),
+    path('api/admin/catalog-import/', AdminCatalogImportAPIView.as_view(), name='admin_catalog_import'),
+    path('api/admin/catalog-import/<str:job_id>/', AdminCatalogImportStatusAPIView.as_view(), name='admin_catalog_import_status'),
     
     # Admin Special Offers UI
     path('admin/offers/', views.admin_special_offers_view, name='admin_special_offers'),
     
+    # Responsive image derivatives (generated on first request)
+    path('media/derivatives/<str:kind>/<int:pk>/<int:width>.<str:fmt>', views.image_derivative, name='image_derivative'),
+    
     # Products with Sale Info API
     path('api/products/with-sale-info/', ProductsWithSaleInfoAPIView.as_view(), name='api_products_with_sale_info'),
     
     # Order APIs
     path('api/orders/', api_orders_list, name='api_orders_list'),
+    path('api/orders/export/', api_orders_export, name='api_orders_export'),
     path('api/orders/export/csv/', api_orders_export_csv, name='api_orders_export_csv'),
     path('api/orders/<int:order_id>/', api_orders_detail, name='api_orders_detail'),
     path('api/orders/<int:order_id>/paid/', api_orders_update_paid, name='api_orders_update_paid'),
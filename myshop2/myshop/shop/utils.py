@@ -1,42 +1,145 @@
 from io import BytesIO
-from PIL import Image
-from django.core.files.uploadedfile import InMemoryUploadedFile
+from PIL import Image, ImageOps
+from django.core.files.uploadedfile import InMemoryUploadedFile, SimpleUploadedFile
+import base64
+import hashlib
 import os
 import warnings
 
 # Suppress ICC profile warnings
 warnings.filterwarnings('ignore', category=UserWarning, module='PIL')
 
-def safe_open_image(image_path_or_file):
+HASH_CHUNK_SIZE = 64 * 1024
+
+# Placeholders are tiny blurred WebPs inlined as data URIs (a few hundred bytes)
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 30
+PLACEHOLDER_MAX_LENGTH = 1000
+
+
+def hash_file(file_obj, chunk_size=HASH_CHUNK_SIZE):
+    """
+    SHA-256 hex digest of a file-like object, read in chunks and rewound afterwards.
+
+    The digest is remembered on the underlying file object (the upload wrapped by a FieldFile),
+    so content-addressed storage can reuse it instead of hashing the same upload again.
+    """
+    from django.db.models.fields.files import FieldFile
+
+    def underlying():
+        # Never cache on a FieldFile itself: it outlives the file it points to
+        return getattr(file_obj, '_file', None) if isinstance(file_obj, FieldFile) else file_obj
+
+    cached = getattr(underlying(), '_content_sha256', None)
+    if cached:
+        return cached
+
+    digest = hashlib.sha256()
+    if hasattr(file_obj, 'chunks'):
+        for chunk in file_obj.chunks(chunk_size):
+            digest.update(chunk)
+    else:
+        file_obj.seek(0)
+        for chunk in iter(lambda: file_obj.read(chunk_size), b''):
+            digest.update(chunk)
+    file_obj.seek(0)
+
+    hex_digest = digest.hexdigest()
+    target = underlying()
+    if target is not None:
+        try:
+            target._content_sha256 = hex_digest
+        except AttributeError:
+            pass
+    return hex_digest
+
+
+_SRGB_PROFILE = None
+
+
+def _srgb_profile():
+    global _SRGB_PROFILE
+    if _SRGB_PROFILE is None:
+        from PIL import ImageCms
+        _SRGB_PROFILE = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB'))
+    return _SRGB_PROFILE
+
+
+def _to_srgb(img, icc_profile):
+    """
+    Convert an RGB/RGBA image from its embedded profile to sRGB with LittleCMS.
+    Returns None when the profile is already sRGB or cannot be used, so the caller just drops it.
+    """
+    if img.mode not in ('RGB', 'RGBA'):
+        return None
+    try:
+        from PIL import ImageCms
+        source = ImageCms.ImageCmsProfile(BytesIO(icc_profile))
+        description = (ImageCms.getProfileDescription(source) or '').lower()
+        if 'srgb' in description:
+            return None
+        return ImageCms.profileToProfile(img, source, _srgb_profile(), outputMode=img.mode)
+    except Exception:
+        return None
+
+
+def _draft_size(img, target_size):
+    """Size the image will be scaled to when fit into target_size, in stored (pre-EXIF) orientation"""
+    max_width, max_height = target_size
+    orientation = img.getexif().get(0x0112, 1)
+    if orientation in (5, 6, 7, 8):
+        # Stored rotated by 90 degrees, so the box applies to the other axis
+        max_width, max_height = max_height, max_width
+    width, height = img.size
+    scale = min(
+        max_width / width if max_width else 1,
+        max_height / height if max_height else 1,
+    )
+    if scale >= 1:
+        return None
+    return (max(1, int(width * scale)), max(1, int(height * scale)))
+
+
+def safe_open_image(image_path_or_file, target_size=None, convert_icc=True):
     """
     Safely open an image and strip problematic ICC profiles.
     
     Args:
         image_path_or_file: Path to image file or file-like object
+        target_size: Optional (max_width, max_height) box the caller will fit the image into
+            (either side may be None). JPEGs are then decoded in draft mode at the smallest
+            DCT scale that still covers the final size.
+        convert_icc: Convert non-sRGB embedded profiles (e.g. Display P3 phone photos) to sRGB
+            instead of only dropping them
     
     Returns:
-        PIL.Image: Image object with ICC profile stripped if problematic
+        PIL.Image: Image object with ICC profile stripped and EXIF orientation applied
     """
+    img = Image.open(image_path_or_file)
+
+    if target_size and img.format == 'JPEG':
+        draft_size = _draft_size(img, target_size)
+        if draft_size:
+            img.draft(img.mode if img.mode in ('L', 'CMYK') else 'RGB', draft_size)
+
+    # Drop the profile from the metadata instead of copying every pixel into a new image
+    icc_profile = img.info.pop('icc_profile', None)
+    if icc_profile and convert_icc:
+        converted = _to_srgb(img, icc_profile)
+        if converted is not None:
+            img = converted
+            img.info.pop('icc_profile', None)
+
+    # Bake the EXIF orientation into the pixels so saved copies (without EXIF) display upright.
+    # exif_transpose() copies the image even when there is nothing to do, so check first.
     try:
-        img = Image.open(image_path_or_file)
-        
-        # Check if image has ICC profile and strip it if present
-        if hasattr(img, 'info') and 'icc_profile' in img.info:
-            # Create a new image without the ICC profile
-            img_data = list(img.getdata())
-            new_img = Image.new(img.mode, img.size)
-            new_img.putdata(img_data)
-            return new_img
-        
-        return img
+        if img.getexif().get(0x0112, 1) != 1:
+            img = ImageOps.exif_transpose(img)
+            img.info.pop('icc_profile', None)
     except Exception as e:
-        # If there's any error opening the image, try without ICC profile
-        warnings.warn(f"Error opening image, attempting without ICC profile: {e}")
-        img = Image.open(image_path_or_file)
-        img_data = list(img.getdata())
-        new_img = Image.new(img.mode, img.size)
-        new_img.putdata(img_data)
-        return new_img
+        warnings.warn(f"Could not apply EXIF orientation: {e}")
+
+    return img
 
 def compress_image(image_file, max_size=1600):
     """
@@ -53,8 +156,8 @@ def compress_image(image_file, max_size=1600):
     if hasattr(image_file, 'size') and image_file.size > 20 * 1024 * 1024:
         return image_file
         
-    # Open the image using PIL with ICC profile handling
-    img = safe_open_image(image_file)
+    # Open the image using PIL with ICC profile handling (draft-decoded when downscaling)
+    img = safe_open_image(image_file, target_size=(max_size, max_size))
     
     # Convert to RGB if necessary
     if img.mode in ('RGBA', 'P'):
@@ -100,4 +203,68 @@ def compress_image(image_file, max_size=1600):
         'image/webp',
         output.getbuffer().nbytes,
         None
-    ) 
\ No newline at end of file
+    )
+
+
+def make_placeholder(image_path_or_file):
+    """
+    Low-quality image placeholder: the image shrunk to 16px on its longest side and encoded
+    as a very low quality WebP data URI, small enough to inline in list payloads.
+    JPEGs are decoded at 1/8 scale, so this stays cheap even for large originals.
+    """
+    if hasattr(image_path_or_file, 'seek'):
+        image_path_or_file.seek(0)
+    img = safe_open_image(image_path_or_file, target_size=(PLACEHOLDER_SIZE * 8, PLACEHOLDER_SIZE * 8))
+    img.load()
+    if hasattr(image_path_or_file, 'seek'):
+        image_path_or_file.seek(0)
+
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+    img.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.Resampling.BOX)
+
+    for quality in (PLACEHOLDER_QUALITY, 10):
+        output = BytesIO()
+        img.save(output, format='WEBP', quality=quality, method=6)
+        uri = 'data:image/webp;base64,' + base64.b64encode(output.getvalue()).decode('ascii')
+        if len(uri) <= PLACEHOLDER_MAX_LENGTH:
+            return uri
+    return ''
+
+
+def process_image_bytes(data, name, max_size=1600):
+    """
+    Hash and compress image bytes. Like process_image_path() but for files that are not on local disk.
+
+    Returns:
+        dict: {'name', 'hash', 'content', 'placeholder'} where content is the bytes to store
+    """
+    image_hash = hashlib.sha256(data).hexdigest()
+    try:
+        placeholder = make_placeholder(BytesIO(data))
+    except Exception:
+        placeholder = ''
+
+    if not name.lower().endswith('.webp'):
+        compressed = compress_image(SimpleUploadedFile(name, data), max_size=max_size)
+        name = compressed.name
+        data = compressed.read()
+
+    return {'name': name, 'hash': image_hash, 'content': data, 'placeholder': placeholder}
+
+
+def process_image_path(path, max_size=1600):
+    """
+    Hash and compress an image file from disk.
+
+    Module-level and free of ORM access so it can run inside a ProcessPoolExecutor.
+    The hash is taken from the original bytes, matching ProductImage.save().
+
+    Returns:
+        dict: {'path', 'name', 'hash', 'content', 'placeholder'} where content is the bytes to store
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    result = process_image_bytes(data, os.path.basename(path), max_size=max_size)
+    result['path'] = path
+    return result
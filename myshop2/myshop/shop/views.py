@@ -236,16 +236,8 @@ def delete_product_image(request, image_id):
         image = get_object_or_404(ProductImage, id=image_id)
         product = image.product
         
-        # Delete the image file from storage
-        if image.image:
-            try:
-                # Get the full path to the image file
-                image_path = image.image.path
-                # Delete the file if it exists
-                if os.path.isfile(image_path):
-                    os.remove(image_path)
-            except Exception as e:
-                print(f"Error deleting image file: {e}")
+        # The file is shared by every row with the same bytes; deleting the row releases
+        # its reference (see release_image_file) and the last one removes the file
         
         # Store the order before deletion for reordering
         deleted_order = image.order
@@ -3269,7 +3261,7 @@ def api_customer_checkout(request):
     
     try:
         # Apply rate limiting (30 requests per minute for checkout - more restrictive)
-        rate_limit_error = check_rate_limit(request, max_requests_per_minute=30, window_seconds=60)
+        rate_limit_error = check_rate_limit(request, max_requests_per_minute=30, window_seconds=60, rule_id='checkout')
         if rate_limit_error:
             return rate_limit_error
         
@@ -3859,3 +3851,22 @@ def api_debug_add_to_cart(request):
     except Exception as e:
         print(f"❌ Error in api_debug_add_to_cart: {str(e)}")
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@require_http_methods(['GET', 'HEAD'])
+def image_derivative(request, kind, pk, width, fmt):
+    """Redirect to a resized copy of a product/variant/offer image, generating it on first request"""
+    from django.core.files.storage import default_storage
+    from django.http import Http404, HttpResponseRedirect
+    from django.utils.cache import patch_cache_control
+    from .image_derivatives import DerivativeError, get_derivative
+
+    try:
+        name = get_derivative(kind, pk, width, fmt)
+    except DerivativeError as e:
+        raise Http404(str(e))
+
+    response = HttpResponseRedirect(default_storage.url(name))
+    # URLs carry the source version (?v=), so the redirect itself can be cached
+    patch_cache_control(response, public=True, max_age=60 * 60 * 24 * 7)
+    return response
@@ -0,0 +1,194 @@
+"""
+Direct Image Uploads
+Supplier photos are uploaded straight to storage instead of through a Django form post, so
+a slow phone upload no longer holds a web worker for its whole duration.
+
+With S3 storage the client gets a presigned POST (size and content type enforced by S3) and
+uploads to the bucket itself. On local storage it sends the file in small chunks that can be
+resumed from the last stored offset after a dropped connection. Either way the file is
+staged under uploads/ and only becomes a ProductImage/ProductVariantImage on finalize, which
+goes through the usual save() (duplicate check, hashing, async WebP pipeline).
+"""
+import os
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image
+
+from .models import UploadSession
+
+STAGING_DIR = 'uploads'
+ALLOWED_CONTENT_TYPES = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/webp': '.webp',
+}
+
+
+class UploadError(Exception):
+    status = 400
+
+
+class UploadConflict(UploadError):
+    """A chunk did not start at the stored offset; the client resumes from `offset`"""
+    status = 409
+
+    def __init__(self, message, offset):
+        super().__init__(message)
+        self.offset = offset
+
+
+def uses_s3(storage=None):
+    """Whether the storage is S3-backed (django-storages' S3 storage exposes a bucket and a boto connection)"""
+    storage = storage or default_storage
+    return bool(getattr(storage, 'bucket_name', None)) and hasattr(storage, 'connection')
+
+
+def get_max_size():
+    return getattr(settings, 'DIRECT_UPLOAD_MAX_SIZE', 20 * 1024 * 1024)
+
+
+def get_chunk_size():
+    return getattr(settings, 'DIRECT_UPLOAD_CHUNK_SIZE', 1024 * 1024)
+
+
+def presigned_post(key, content_type, expires_in, storage=None):
+    """Presigned S3 POST for one object, limited to the declared content type and the size limit"""
+    storage = storage or default_storage
+    client = storage.connection.meta.client
+    object_key = storage._normalize_name(key)
+    return client.generate_presigned_post(
+        Bucket=storage.bucket_name,
+        Key=object_key,
+        Fields={'Content-Type': content_type},
+        Conditions=[
+            {'Content-Type': content_type},
+            ['content-length-range', 1, get_max_size()],
+        ],
+        ExpiresIn=expires_in,
+    )
+
+
+def start_upload(user, product, filename, content_type, size, variant=None, order=0, is_primary=False,
+                 storage=None):
+    """Create an UploadSession; returns (session, instructions for the client)"""
+    storage = storage or default_storage
+    extension = ALLOWED_CONTENT_TYPES.get(content_type)
+    if extension is None:
+        raise UploadError(f"Unsupported content type '{content_type}'")
+    if not 0 < size <= get_max_size():
+        raise UploadError(f"File size must be between 1 byte and {get_max_size()} bytes")
+
+    token = uuid.uuid4().hex
+    expires_in = getattr(settings, 'DIRECT_UPLOAD_EXPIRY', 60 * 60)
+    session = UploadSession.objects.create(
+        token=token,
+        user=user,
+        product=product,
+        variant=variant,
+        backend='s3' if uses_s3(storage) else 'local',
+        key=f"{STAGING_DIR}/{token}{extension}",
+        filename=os.path.basename(filename or f"upload{extension}")[:255],
+        content_type=content_type,
+        size=size,
+        order=order,
+        is_primary=is_primary,
+        expires_at=timezone.now() + timedelta(seconds=expires_in),
+    )
+
+    if session.backend == 's3':
+        post = presigned_post(session.key, content_type, expires_in, storage)
+        return session, {'method': 'POST', 'url': post['url'], 'fields': post['fields']}
+    return session, {'method': 'PUT', 'chunk_size': get_chunk_size(), 'offset': 0}
+
+
+def write_chunk(session, offset, data, storage=None):
+    """
+    Store one chunk of a local upload at `offset`, which must be where the previous chunk ended.
+    Returns the number of bytes received so far.
+    """
+    storage = storage or default_storage
+    if session.backend != 'local':
+        raise UploadError('This upload goes directly to S3')
+    if session.status != 'pending' or session.is_expired:
+        raise UploadError('Upload is no longer accepting data')
+    if offset != session.received:
+        raise UploadConflict(f"Expected a chunk at offset {session.received}", session.received)
+    if not data or len(data) > get_chunk_size() or offset + len(data) > session.size:
+        raise UploadError('Chunk is empty, too large or past the declared size')
+
+    path = storage.path(session.key)
+    if offset == 0:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'r+b' if offset else 'wb') as f:
+        f.seek(offset)
+        f.write(data)
+
+    # Two retries of the same chunk write the same bytes; only one may advance the offset
+    updated = UploadSession.objects.filter(pk=session.pk, received=offset).update(received=F('received') + len(data))
+    session.refresh_from_db(fields=['received'])
+    if not updated:
+        raise UploadConflict(f"Expected a chunk at offset {session.received}", session.received)
+    return session.received
+
+
+def _staged_size(session, storage):
+    if session.backend == 'local':
+        return session.received
+    if not storage.exists(session.key):
+        return 0
+    return storage.size(session.key)
+
+
+def finalize_upload(session, storage=None):
+    """
+    Turn a completely staged file into a product or variant image and remove the staged copy.
+    Returns the image (an existing one when the same file was already uploaded).
+    """
+    from shop.models import ProductImage, ProductVariantImage
+
+    storage = storage or default_storage
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if session.status == 'finalized':
+            model = ProductVariantImage if session.variant_id else ProductImage
+            return model.objects.get(pk=session.image_id)
+        if session.status != 'pending':
+            raise UploadError('Upload has failed')
+
+        staged = _staged_size(session, storage)
+        if staged != session.size:
+            raise UploadError(f"Upload is incomplete ({staged} of {session.size} bytes)")
+
+        with storage.open(session.key, 'rb') as f:
+            try:
+                Image.open(f).verify()
+            except Exception:
+                image = None
+            else:
+                f.seek(0)
+                upload = File(f, name=session.filename)
+                if session.variant_id:
+                    image = ProductVariantImage.create(
+                        variant=session.variant, image=upload, order=session.order, is_primary=session.is_primary
+                    )
+                else:
+                    image = ProductImage.create(
+                        product=session.product, image=upload, order=session.order, is_primary=session.is_primary
+                    )
+
+        if image is None:
+            UploadSession.objects.filter(pk=session.pk).update(status='failed', error='Not a valid image')
+        else:
+            UploadSession.objects.filter(pk=session.pk).update(status='finalized', image_id=image.pk)
+        transaction.on_commit(lambda: storage.delete(session.key))
+
+    if image is None:
+        raise UploadError('Uploaded file is not a valid image')
+    return image
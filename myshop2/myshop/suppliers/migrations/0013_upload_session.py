@@ -0,0 +1,43 @@
+# Generated by Django 5.2.1 on 2026-10-19 05:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0053_image_placeholders'),
+        ('suppliers', '0012_make_store_name_unique'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=32, unique=True)),
+                ('backend', models.CharField(choices=[('s3', 'S3 presigned upload'), ('local', 'Chunked local upload')], max_length=10)),
+                ('key', models.CharField(help_text='Storage name of the staged file', max_length=255)),
+                ('filename', models.CharField(max_length=255)),
+                ('content_type', models.CharField(max_length=100)),
+                ('size', models.PositiveBigIntegerField(help_text='Declared size in bytes')),
+                ('received', models.PositiveBigIntegerField(default=0, help_text='Bytes stored so far (chunked uploads)')),
+                ('order', models.PositiveIntegerField(default=0)),
+                ('is_primary', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('finalized', 'Finalized'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('image_id', models.PositiveIntegerField(blank=True, help_text='Created ProductImage/ProductVariantImage', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to='shop.product')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to=settings.AUTH_USER_MODEL)),
+                ('variant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to='shop.productvariant')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -312,3 +312,50 @@ class DeletedSupplier(models.Model):
 
     def __str__(self):
         return f"Deleted: {self.name}"
+
+
+class UploadSession(models.Model):
+    """
+    A product or variant image uploaded straight to storage (see suppliers.direct_uploads):
+    a presigned S3 PUT or, on local storage, resumable chunks. The image row is only created
+    by the finalize call.
+    """
+    BACKEND_CHOICES = [
+        ('s3', 'S3 presigned upload'),
+        ('local', 'Chunked local upload'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('finalized', 'Finalized'),
+        ('failed', 'Failed'),
+    ]
+
+    token = models.CharField(max_length=32, unique=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions')
+    product = models.ForeignKey('shop.Product', on_delete=models.CASCADE, related_name='upload_sessions')
+    variant = models.ForeignKey(
+        'shop.ProductVariant', on_delete=models.CASCADE, null=True, blank=True, related_name='upload_sessions'
+    )
+    backend = models.CharField(max_length=10, choices=BACKEND_CHOICES)
+    key = models.CharField(max_length=255, help_text="Storage name of the staged file")
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100)
+    size = models.PositiveBigIntegerField(help_text="Declared size in bytes")
+    received = models.PositiveBigIntegerField(default=0, help_text="Bytes stored so far (chunked uploads)")
+    order = models.PositiveIntegerField(default=0)
+    is_primary = models.BooleanField(default=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    error = models.CharField(max_length=255, blank=True)
+    image_id = models.PositiveIntegerField(null=True, blank=True, help_text="Created ProductImage/ProductVariantImage")
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Upload {self.token} ({self.filename}, {self.status})"
+
+    @property
+    def is_expired(self):
+        return timezone.now() >= self.expires_at
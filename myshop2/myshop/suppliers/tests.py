@@ -1,3 +1,152 @@
+from types import SimpleNamespace
+
+from django.core.files.storage import FileSystemStorage
 from django.test import TestCase
 
 # Create your tests here.
+
+
+class StubS3Storage(FileSystemStorage):
+    """S3 stand-in: files on disk, and a boto-like client that records presigned POST requests"""
+    bucket_name = 'media-bucket'
+    presigned = []
+
+    @property
+    def connection(self):
+        return SimpleNamespace(meta=SimpleNamespace(client=self))
+
+    def _normalize_name(self, name):
+        return f"media/{name}"
+
+    def generate_presigned_post(self, **kwargs):
+        StubS3Storage.presigned.append(kwargs)
+        return {'url': f"https://s3.test/{kwargs['Bucket']}", 'fields': dict(kwargs['Fields'], key=kwargs['Key'])}
+
+
+class DirectUploadTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.contrib.auth import get_user_model
+        from django.test import override_settings
+        from shop.models import Category, Product
+
+        self.media = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media, IMAGE_PROCESSING_ASYNC=False, DIRECT_UPLOAD_CHUNK_SIZE=1000
+        )
+        self.settings_override.enable()
+        category = Category.objects.create(name='کفش')
+        self.product = Product.objects.create(name='Sneaker', price_toman=1000, category=category)
+        self.admin = get_user_model().objects.create_user(email='admin@example.com', password='x', is_superuser=True)
+        self.other = get_user_model().objects.create_user(email='other@example.com', password='x')
+
+    def tearDown(self):
+        import shutil
+        self.settings_override.disable()
+        shutil.rmtree(self.media, ignore_errors=True)
+
+    def _photo(self):
+        from io import BytesIO
+        from PIL import Image
+
+        buffer = BytesIO()
+        Image.effect_noise((120, 90), 30).convert('RGB').save(buffer, format='PNG')
+        return buffer.getvalue()
+
+    def _start(self, size, **extra):
+        return self.client.post(
+            '/suppliers/api/uploads/',
+            data=dict({'product_id': self.product.id, 'filename': 'shoe.png', 'content_type': 'image/png', 'size': size}, **extra),
+            content_type='application/json',
+        )
+
+    def test_chunked_upload_resumes_and_finalizes(self):
+        import os
+
+        data = self._photo()
+        self.client.force_login(self.admin)
+        response = self._start(len(data))
+        self.assertEqual(response.status_code, 201)
+        started = response.json()
+        self.assertEqual(started['upload']['method'], 'PUT')
+        chunk_url = started['urls']['chunk']
+
+        # First chunk lands, then the client "reconnects" and sends a chunk at a stale offset
+        response = self.client.put(f"{chunk_url}?offset=0", data=data[:1000], content_type='application/octet-stream')
+        self.assertEqual(response.json()['offset'], 1000)
+        response = self.client.put(f"{chunk_url}?offset=0", data=data[:1000], content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 409)
+        offset = self.client.get(started['urls']['status']).json()['offset']
+        self.assertEqual(offset, 1000)
+
+        response = self.client.post(started['urls']['finalize'])
+        self.assertEqual(response.status_code, 400)
+        while offset < len(data):
+            response = self.client.put(
+                f"{chunk_url}?offset={offset}", data=data[offset:offset + 1000], content_type='application/octet-stream'
+            )
+            offset = response.json()['offset']
+        self.assertTrue(response.json()['complete'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(started['urls']['finalize'])
+        self.assertEqual(response.status_code, 200)
+        image = self.product.images.get()
+        self.assertEqual(response.json()['image_id'], image.id)
+        self.assertTrue(image.placeholder)
+        self.assertEqual(os.listdir(f"{self.media}/uploads"), [])
+
+    def test_image_status_hidden_from_users_without_supplier(self):
+        # The product has no supplier; a customer must not match it through supplier=None
+        self.client.force_login(self.other)
+        response = self.client.get(f'/suppliers/api/products/{self.product.id}/image-status/')
+        self.assertEqual(response.status_code, 404)
+
+        self.client.force_login(self.admin)
+        response = self.client.get(f'/suppliers/api/products/{self.product.id}/image-status/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_s3_storage_gets_a_presigned_post(self):
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import default_storage
+        from django.test import override_settings
+
+        data = self._photo()
+        StubS3Storage.presigned.clear()
+        storages = {
+            'default': {'BACKEND': 'suppliers.tests.StubS3Storage'},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        }
+        with override_settings(STORAGES=storages, DIRECT_UPLOAD_EXPIRY=600):
+            self.client.force_login(self.admin)
+            response = self._start(len(data))
+            self.assertEqual(response.status_code, 201)
+            started = response.json()
+            self.assertEqual(started['upload']['method'], 'POST')
+            self.assertEqual(started['upload']['url'], 'https://s3.test/media-bucket')
+
+            request = StubS3Storage.presigned[0]
+            self.assertEqual(request['Bucket'], 'media-bucket')
+            self.assertTrue(request['Key'].startswith('media/uploads/'))
+            self.assertEqual(request['ExpiresIn'], 600)
+            self.assertIn({'Content-Type': 'image/png'}, request['Conditions'])
+            self.assertIn(['content-length-range', 1, 20 * 1024 * 1024], request['Conditions'])
+
+            # Chunks are refused; the client posts to the bucket, which we simulate
+            response = self.client.put(f"{started['urls']['chunk']}?offset=0", data=data, content_type='application/octet-stream')
+            self.assertEqual(response.status_code, 400)
+            key = request['Key'][len('media/'):]
+            default_storage.save(key, ContentFile(data))
+
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(started['urls']['finalize'])
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(default_storage.exists(key))
+        self.assertEqual(self.product.images.count(), 1)
+
+    def test_other_users_cannot_upload_to_a_product(self):
+        self.client.force_login(self.other)
+        self.assertEqual(self._start(100).status_code, 404)
+
+        self.client.force_login(self.admin)
+        self.assertEqual(self._start(100, content_type='text/html').status_code, 400)
@@ -22,6 +22,12 @@ urlpatterns = [
     path('test-save-product/', views.test_save_product, name='test_save_product'),
     path('api/category/<int:category_id>/form-fields/', views.get_category_form_fields, name='get_category_form_fields'),
     path('api/products/<int:product_id>/', views.product_detail_api, name='product_detail_api'),
+    path('api/products/<int:product_id>/image-status/', views.product_image_status_api, name='product_image_status_api'),
+    path('api/images/similar/', views.similar_images_api, name='similar_images_api'),
+    path('api/uploads/', views.direct_upload_start, name='direct_upload_start'),
+    path('api/uploads/<str:token>/', views.direct_upload_status, name='direct_upload_status'),
+    path('api/uploads/<str:token>/chunk/', views.direct_upload_chunk, name='direct_upload_chunk'),
+    path('api/uploads/<str:token>/finalize/', views.direct_upload_finalize, name='direct_upload_finalize'),
     path('api/debug/<int:product_id>/', views.product_debug_api, name='product_debug_api'),
     # Backup URLs
     path('admin/backup/', views.backup_dashboard, name='backup_dashboard'),
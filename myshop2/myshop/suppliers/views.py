@@ -11,7 +11,7 @@ from django.views.generic import View, ListView, DetailView
 from django.db.models import Q, Max, Sum
 from django.utils.translation import gettext_lazy as _
 from django.urls import reverse
-from django.http import HttpResponseForbidden, JsonResponse, HttpResponse, HttpResponseServerError
+from django.http import Http404, HttpResponseForbidden, JsonResponse, HttpResponse, HttpResponseServerError
 from django.contrib import admin
 from django.contrib.admin.helpers import AdminForm
 from django.contrib.admin.options import get_ul_class
@@ -21,7 +21,7 @@ from django.utils.html import format_html
 from django.core.exceptions import PermissionDenied
 from functools import wraps
 from django.template.loader import render_to_string
-from django.views.decorators.http import require_GET
+from django.views.decorators.http import require_GET, require_POST
 from django.contrib.admin.views.decorators import staff_member_required
 from django.core.management import call_command
 from .models import BackupLog, Supplier, SupplierInvitation, SupplierAdmin, Store
@@ -1063,8 +1063,7 @@ def add_product(request):
                                 if str(img.id) not in preserved_ids:
                                     try:
                                         print(f"🗑️ Deleting removed image {img.id} {img.image.name}")
-                                        if img.image and os.path.isfile(img.image.path):
-                                            os.remove(img.image.path)
+                                        # Releases the row's reference to the shared file (release_image_file)
                                         img.delete()
                                     except Exception as e:
                                         print(f"❌ Delete error for image {img.id}: {e}")
@@ -1547,7 +1546,8 @@ def add_product(request):
                 'id': img.id,
                 'url': img.image.url,
                 'is_primary': img.is_primary,
-                'order': img.order
+                'order': img.order,
+                'processing_status': img.processing_status
             })
     
     title = _('Edit Product') if product else _('Add Product')
@@ -2184,7 +2184,8 @@ def product_detail_api(request, product_id):
                         'id': img.id,
                         'url': img.image.url,
                         'is_primary': img.is_primary if hasattr(img, 'is_primary') else False,
-                        'order': img.order if hasattr(img, 'order') else 0
+                        'order': img.order if hasattr(img, 'order') else 0,
+                        'processing_status': img.processing_status
                     })
             product_data['images'] = images
         except Exception as e:
@@ -2212,6 +2213,190 @@ def product_detail_api(request, product_id):
         print(traceback.format_exc())
         return JsonResponse({'error': str(e)}, status=400)
 
+def _own_product(request, product_id):
+    """The product if the user may manage its images (superusers: any product)"""
+    if request.user.is_superuser:
+        return get_object_or_404(Product, id=product_id)
+    supplier = Supplier.objects.filter(email=request.user.email).first()
+    if supplier is None:
+        # Products without a supplier must not match a user who is not one
+        raise Http404('No supplier account')
+    return get_object_or_404(Product, id=product_id, supplier=supplier)
+
+@login_required
+@require_GET
+def product_image_status_api(request, product_id):
+    """Processing status of a product's images, polled by the product form after upload"""
+    from shop.models import ProductVariantImage
+
+    product = _own_product(request, product_id)
+
+    def describe(img):
+        return {
+            'id': img.id,
+            'url': img.image.url,
+            'order': img.order,
+            'processing_status': img.processing_status,
+            'processing_error': img.processing_error,
+        }
+
+    images = [describe(img) for img in product.images.all().order_by('order')]
+    variant_images = [
+        dict(describe(img), variant_id=img.variant_id)
+        for img in ProductVariantImage.objects.filter(variant__product=product).order_by('variant_id', 'order')
+    ]
+    all_images = images + variant_images
+    return JsonResponse({
+        'product_id': product.id,
+        'pending': sum(1 for img in all_images if img['processing_status'] in ('pending', 'processing')),
+        'images': images,
+        'variant_images': variant_images,
+    })
+
+@login_required
+@require_POST
+def similar_images_api(request):
+    """
+    Upload-time check: is a visually similar image (resized or re-encoded copy) already in the
+    catalog? Details are only returned for the supplier's own products.
+    """
+    from shop.perceptual_hash import dhash_file, find_similar_images
+
+    upload = request.FILES.get('image')
+    if not upload:
+        return JsonResponse({'error': 'No image uploaded'}, status=400)
+    try:
+        value = dhash_file(upload)
+    except Exception as e:
+        return JsonResponse({'error': f'Invalid image: {e}'}, status=400)
+
+    matches = find_similar_images(value)
+    if request.user.is_superuser:
+        visible_products = None
+    else:
+        supplier = Supplier.objects.filter(email=request.user.email).first()
+        visible_products = set(
+            Product.objects.filter(
+                supplier=supplier, id__in={m['product_id'] for m in matches}
+            ).values_list('id', flat=True)
+        ) if supplier else set()
+
+    storage = ProductImage._meta.get_field('image').storage
+    own = [
+        {
+            'kind': m['kind'],
+            'id': m['id'],
+            'product_id': m['product_id'],
+            'url': storage.url(m['image']),
+            'distance': m['distance'],
+        }
+        for m in matches
+        if visible_products is None or m['product_id'] in visible_products
+    ]
+    return JsonResponse({
+        'similar_exists': bool(matches),
+        'count': len(matches),
+        'matches': own,
+    })
+
+def _upload_session(request, token):
+    from .models import UploadSession
+    return get_object_or_404(UploadSession, token=token, user=request.user)
+
+def _upload_state(session):
+    return {
+        'upload_id': session.token,
+        'backend': session.backend,
+        'status': session.status,
+        'size': session.size,
+        'offset': session.received,
+        'expires_at': session.expires_at.isoformat(),
+    }
+
+@login_required
+@require_POST
+def direct_upload_start(request):
+    """
+    Start a direct image upload for a product (or one of its variants).
+    Expects JSON {product_id, filename, content_type, size, variant_id?, order?, is_primary?}.
+    """
+    from shop.models import ProductVariant
+    from .direct_uploads import UploadError, start_upload
+
+    try:
+        data = json.loads(request.body or b'{}')
+        product = _own_product(request, int(data.get('product_id')))
+        size = int(data.get('size'))
+        order = int(data.get('order') or 0)
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'product_id and size are required'}, status=400)
+
+    variant = None
+    if data.get('variant_id'):
+        variant = get_object_or_404(ProductVariant, id=data['variant_id'], product=product)
+
+    try:
+        session, instructions = start_upload(
+            request.user, product, data.get('filename', ''), data.get('content_type', ''), size,
+            variant=variant, order=order, is_primary=bool(data.get('is_primary')),
+        )
+    except UploadError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+
+    return JsonResponse(dict(_upload_state(session), upload=instructions, urls={
+        'status': reverse('suppliers:direct_upload_status', args=[session.token]),
+        'chunk': reverse('suppliers:direct_upload_chunk', args=[session.token]),
+        'finalize': reverse('suppliers:direct_upload_finalize', args=[session.token]),
+    }), status=201)
+
+@login_required
+@require_GET
+def direct_upload_status(request, token):
+    """Where an upload stands; a client resuming a chunked upload continues from `offset`"""
+    return JsonResponse(_upload_state(_upload_session(request, token)))
+
+@login_required
+def direct_upload_chunk(request, token):
+    """Store one chunk of a local upload: PUT the raw bytes with ?offset=<bytes already sent>"""
+    from .direct_uploads import UploadConflict, UploadError, write_chunk
+
+    if request.method != 'PUT':
+        return JsonResponse({'error': 'Use PUT'}, status=405)
+    session = _upload_session(request, token)
+    try:
+        offset = int(request.GET.get('offset', ''))
+    except ValueError:
+        return JsonResponse({'error': 'offset is required'}, status=400)
+
+    try:
+        received = write_chunk(session, offset, request.body)
+    except UploadConflict as e:
+        return JsonResponse({'error': str(e), 'offset': e.offset}, status=e.status)
+    except UploadError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+    return JsonResponse({'upload_id': session.token, 'offset': received, 'complete': received == session.size})
+
+@login_required
+@require_POST
+def direct_upload_finalize(request, token):
+    """Register a completely uploaded file as a product/variant image and queue its processing"""
+    from .direct_uploads import UploadError, finalize_upload
+
+    session = _upload_session(request, token)
+    try:
+        image = finalize_upload(session)
+    except UploadError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+
+    return JsonResponse({
+        'upload_id': session.token,
+        'image_id': image.id,
+        'variant_id': session.variant_id,
+        'url': image.image.url,
+        'processing_status': image.processing_status,
+        'status_url': reverse('suppliers:product_image_status_api', args=[session.product_id]),
+    })
+
 def product_debug_api(request, product_id):
     """Simple debug API endpoint that returns minimal product information"""
     try: